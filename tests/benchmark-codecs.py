@@ -0,0 +1,62 @@
+"""
+Benchmark the record codecs: the bytes they write for a set of documents
+and how many documents they encode and decode per second.
+
+The first row serializes the documents the way the log storages did before
+they got codecs: ``json.dumps()`` followed by stripping the braces.
+
+Usage: python tests/benchmark-codecs.py [documents]
+"""
+
+import json
+import sys
+from timeit import default_timer
+
+from tinydb.storages import JSONCodec, MarshalCodec, PickleCodec
+
+
+class DumpsCodec:
+    def encode(self, value):
+        return (json.dumps(value)[1:-1] + ',\n').encode('utf-8')
+
+    def decode(self, data):
+        return json.loads('{' + data.decode('utf-8').rstrip()[:-1] + '}')
+
+
+def documents(count):
+    return [{str(i): {
+        'a': i,
+        'content': 'this is test value, the value is %d' % i,
+        'tags': ['x', 'y', 'z'],
+        'score': i / 3,
+        'active': i % 2 == 0,
+    }} for i in range(count)]
+
+
+def measure(codec, values):
+    start = default_timer()
+    encoded = [codec.encode(value) for value in values]
+    encode_time = default_timer() - start
+
+    start = default_timer()
+    for data in encoded:
+        codec.decode(data)
+    decode_time = default_timer() - start
+
+    return sum(len(data) for data in encoded), encode_time, decode_time
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    values = documents(count)
+
+    print('{:<20} {:>10} {:>14} {:>14}'.format(
+        'codec', 'MiB', 'encode doc/s', 'decode doc/s'))
+
+    for name, codec in [('json.dumps (before)', DumpsCodec()),
+                        ('JSONCodec', JSONCodec()),
+                        ('MarshalCodec', MarshalCodec()),
+                        ('PickleCodec', PickleCodec())]:
+        size, encode_time, decode_time = measure(codec, values)
+        print('{:<20} {:>10.2f} {:>14.0f} {:>14.0f}'.format(
+            name, size / 1024 / 1024, count / encode_time, count / decode_time))
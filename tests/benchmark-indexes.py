@@ -0,0 +1,73 @@
+"""
+Benchmark ``search()`` with equality and range queries on a field without an
+index, with a hash index and with an ordered index (see
+``Table.create_index()``), and ``order_by()`` with and without an ordered
+index.
+
+The query cache is disabled, so every search is evaluated. This is measured
+with a storage reporting table revisions (``MemoryStorage``) and with one
+that doesn't (``JSONStorage`` behind ``CachingMiddleware``, so the file
+isn't parsed for every search), whose indexes follow the changes made
+through the table.
+
+Usage: python tests/benchmark-indexes.py [documents] [rounds]
+"""
+
+import os
+import sys
+import tempfile
+from timeit import default_timer
+
+from tinydb import TinyDB, where
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import JSONStorage, MemoryStorage
+
+
+def run(count, rounds, index, path=None):
+    if path is None:
+        db = TinyDB(storage=MemoryStorage)
+    else:
+        db = TinyDB(path, storage=CachingMiddleware(JSONStorage))
+    table = db.table('bench', cache_size=0)
+    table.insert_multiple({'a': i % 1000, 'b': i} for i in range(count))
+
+    if index is not None:
+        table.create_index('b', ordered=index == 'ordered')
+
+    # Build the index outside of the measurement
+    table.search(where('b') == 0)
+
+    start = default_timer()
+    for i in range(rounds):
+        table.search(where('b') == i * 7)
+    equal_time = default_timer() - start
+
+    start = default_timer()
+    for i in range(rounds):
+        table.search((where('b') >= i * 7) & (where('b') < i * 7 + 100))
+    range_time = default_timer() - start
+
+    start = default_timer()
+    table.order_by('b')
+    order_time = default_timer() - start
+
+    db.close()
+
+    return rounds / equal_time, rounds / range_time, order_time
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    print('{:<8} {:<8} {:>14} {:>14} {:>14}'.format(
+        'storage', 'index', 'equal query/s', 'range query/s', 'order_by s'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for storage in ('memory', 'json'):
+            for index in (None, 'hash', 'ordered'):
+                path = None if storage == 'memory' else os.path.join(directory, '{}.json'.format(index))
+                equal, range_, order = run(count, rounds, index, path)
+
+                print('{:<8} {:<8} {:>14.0f} {:>14.0f} {:>14.3f}'.format(
+                    storage, index or 'none', equal, range_, order))
@@ -0,0 +1,90 @@
+"""
+Benchmark ``update()`` and ``update_multiple()`` with the operations from
+``tinydb.operations`` against the same updates done by plain functions, as
+the operations were implemented before they became inspectable.
+
+For the log storage the bytes appended to the log are reported as well.
+
+Usage: python tests/benchmark-operations.py [documents] [rounds]
+"""
+
+import os
+import sys
+import tempfile
+from timeit import default_timer
+
+from tinydb import TinyDB, where
+from tinydb.operations import increment, set
+from tinydb.storages import JSONMultiTableLineStorage, MemoryStorage
+
+
+def increment_function(field):
+    def transform(doc):
+        doc[field] += 1
+
+    return transform
+
+
+def set_function(field, val):
+    def transform(doc):
+        doc[field] = val
+
+    return transform
+
+
+def open_db(kind, path):
+    if kind == 'memory':
+        return TinyDB(storage=MemoryStorage)
+
+    return TinyDB(path, storage=JSONMultiTableLineStorage, materialize=True,
+                  durability='fsync_on_close')
+
+
+def run(kind, path, count, rounds, operations):
+    db = open_db(kind, path)
+    db.insert_multiple({
+        'a': i,
+        'hits': 0,
+        'content': 'this is test value, the value is %d' % i,
+        'tags': ['x', 'y', 'z'],
+    } for i in range(count))
+
+    size = os.path.getsize(path) if kind == 'log' else 0
+    inc, assign = (increment, set) if operations else (increment_function, set_function)
+
+    start = default_timer()
+    for _ in range(rounds):
+        db.update(inc('hits'))
+    update_time = default_timer() - start
+
+    start = default_timer()
+    for i in range(rounds):
+        db.update_multiple([
+            (inc('hits'), where('a') < count // 2),
+            (assign('flag', i), where('a') >= count // 2),
+        ])
+    multiple_time = default_timer() - start
+
+    db.close()
+    written = os.path.getsize(path) - size if kind == 'log' else 0
+
+    updates = count * rounds
+    return updates / update_time, updates / multiple_time, written
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    print('{:<8} {:<12} {:>14} {:>16} {:>12}'.format(
+        'storage', 'updates', 'update doc/s', 'multiple doc/s', 'MiB written'))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for kind in ('memory', 'log'):
+            for operations in (False, True):
+                path = os.path.join(directory, '{}-{}.db'.format(kind, operations))
+                update, multiple, written = run(kind, path, count, rounds, operations)
+
+                print('{:<8} {:<12} {:>14.0f} {:>16.0f} {:>12.2f}'.format(
+                    kind, 'operations' if operations else 'functions',
+                    update, multiple, written / 1024 / 1024))
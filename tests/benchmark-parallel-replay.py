@@ -0,0 +1,62 @@
+"""
+Benchmark the cold start of a ``JSONMultiTableLineStorage`` replaying its log
+in a single process and in parallel with an increasing number of chunks.
+
+Usage: python tests/benchmark-parallel-replay.py [records] [max chunks]
+"""
+
+import os
+import sys
+import tempfile
+from timeit import default_timer
+
+from tinydb.storages import JSONMultiTableLineStorage
+
+
+def write_log(path, records):
+    storage = JSONMultiTableLineStorage(path, durability='fsync_on_close')
+
+    for i in range(records):
+        storage.write_table('table{}'.format(i % 4), {str(i): {
+            'a': i,
+            'content': 'this is test value, the value is %d' % i,
+        }})
+
+    storage.close()
+
+
+def replay(path, workers=None, chunk_size=None):
+    kwargs = {}
+    if workers is not None:
+        kwargs = {'replay_workers': workers, 'replay_chunk_size': chunk_size}
+
+    start = default_timer()
+    storage = JSONMultiTableLineStorage(path, access_mode='r', **kwargs)
+    storage.read()
+    elapsed = default_timer() - start
+    storage.close()
+
+    return elapsed
+
+
+if __name__ == '__main__':
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    max_chunks = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'db.json')
+        write_log(path, records)
+        size = os.path.getsize(path)
+
+        print('{} records, {:.1f} MiB, {} CPUs'.format(
+            records, size / 1024 / 1024, os.cpu_count()))
+
+        baseline = replay(path)
+        print('sequential: {:8.3f}s'.format(baseline))
+
+        chunks = 1
+        while chunks <= max_chunks:
+            elapsed = replay(path, workers=chunks, chunk_size=size // chunks)
+            print('{:3d} chunks: {:8.3f}s  {:5.2f}x'.format(
+                chunks, elapsed, baseline / elapsed))
+            chunks *= 2
@@ -2,7 +2,7 @@ import os
 
 from tinydb import TinyDB
 from tinydb.middlewares import CachingMiddleware
-from tinydb.storages import MemoryStorage, JSONStorage
+from tinydb.storages import MemoryStorage, JSONStorage, JSONMultiTableLineStorage
 
 doc = {'none': [None, None], 'int': 42, 'float': 3.1415899999999999,
        'list': ['LITE', 'RES_ACID', 'SUS_DEXT'],
@@ -103,3 +103,83 @@ def test_caching_json_write(tmpdir):
     # Reopen database
     with TinyDB(path, storage=CachingMiddleware(JSONStorage)) as db:
         assert db.all() == [{'key': 'value'}]
+
+
+def test_caching_read_document(storage):
+    storage.write({'_default': {'1': {'key': 'value'}}})
+
+    # The document is served from the cache
+    assert storage.storage.memory is None
+    assert storage.read_document('_default', '1') == {'key': 'value'}
+    assert storage.read_document('_default', '2') is None
+
+
+def test_caching_table_scoped(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    storage = CachingMiddleware(JSONMultiTableLineStorage)(path)
+    storage.write_table('table1', {'1': {'a': 1}})
+    storage.flush()
+
+    writes = []
+    write_table = storage.storage.write_table
+    storage.storage.write_table = lambda table, documents: (
+        writes.append(table) or write_table(table, documents)
+    )
+
+    # Only the accessed tables are read and only their changes are flushed
+    db = TinyDB(storage=lambda: storage)
+    db.table('table2').insert({'b': 1})
+    assert db.table('table1').all() == [{'a': 1}]
+    assert storage.cache is None
+
+    storage.flush()
+    assert writes == ['table2']
+
+    db.close()
+    reopened = JSONMultiTableLineStorage(path)
+    assert reopened.read() == {'table1': {'1': {'a': 1}}, 'table2': {'1': {'b': 1}}}
+    reopened.close()
+
+
+def test_caching_next_id(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    storage = CachingMiddleware(JSONMultiTableLineStorage)(path)
+    storage.write_table('_default', {'1': {'a': 1}})
+
+    # The next ID is found in the cached table, the storage doesn't know
+    # about the unflushed document
+    assert storage.storage.read_next_id('_default') == 1
+    assert storage.read_next_id('_default') is None
+
+    db = TinyDB(storage=lambda: storage)
+    assert db.insert({'a': 2}) == 2
+    db.close()
+
+
+def test_caching_update_drop_table(tmpdir):
+    from tinydb.operations import increment
+
+    path = str(tmpdir.join('test.db'))
+    db = TinyDB(path, storage=CachingMiddleware(JSONMultiTableLineStorage),
+                materialize=True)
+    db.insert({'a': 1, 'b': {'c': 1}})
+    db.table('other').insert({'x': 1})
+    db.storage.flush()
+
+    # The updates must not change the storage's documents, as flushing the
+    # whole database only writes what differs from them
+    db.update({'a': 2})
+    db.update(increment('a'))
+
+    def transform(doc):
+        doc['b']['c'] = 2
+
+    db.update(transform)
+    db.drop_table('other')
+    db.close()
+
+    db = TinyDB(path, storage=CachingMiddleware(JSONMultiTableLineStorage),
+                materialize=True)
+    assert db.all() == [{'a': 3, 'b': {'c': 2}}]
+    assert db.tables() == {'_default'}
+    db.close()
@@ -1,5 +1,11 @@
-from tinydb import where
-from tinydb.operations import delete, increment, decrement, add, subtract, set
+import json
+
+import pytest
+
+from tinydb import TinyDB, where
+from tinydb.operations import Operation, delete, increment, decrement, add, \
+    subtract, set
+from tinydb.storages import JSONMultiTableLineStorage
 
 
 def test_delete(db):
@@ -35,3 +41,61 @@ def test_increment(db):
 def test_decrement(db):
     db.update(decrement('int'), where('char') == 'a')
     assert db.get(where('char') == 'a')['int'] == 0
+
+
+def test_operation_objects():
+    operation = add('int', 5)
+    assert (operation.name, operation.field, operation.value) == ('add', 'int', 5)
+    assert operation == add('int', 5)
+    assert operation != add('int', 6)
+    assert repr(operation) == "Operation('add', 'int', 5)"
+    assert repr(delete('int')) == "Operation('delete', 'int')"
+
+    # Operations are still callable on a dict and replace the field
+    tags = ['a']
+    doc = {'int': 1, 'tags': tags}
+    operation(doc)
+    add('tags', ['b'])(doc)
+    assert doc == {'int': 6, 'tags': ['a', 'b']}
+    assert tags == ['a']
+
+    assert increment('int').patch == ['inc', ['int'], 1]
+    assert subtract('int', 2).patch == ['inc', ['int'], -2]
+    assert set('int', 2).patch == ['set', ['int'], 2]
+    assert delete('int').patch == ['unset', ['int']]
+
+    with pytest.raises(ValueError):
+        Operation('append', 'int', 1)
+
+
+def test_operations_patch_records(tmpdir):
+    path = str(tmpdir.join('test.db'))
+
+    db = TinyDB(path, storage=JSONMultiTableLineStorage, materialize=True)
+    db.insert_multiple({'char': c, 'int': 1, 'text': 'x' * 10} for c in 'abc')
+    db.update(increment('int'), where('char') == 'a')
+    db.update_multiple([
+        (add('int', 5), where('char') == 'b'),
+        ({'text': 'y'}, where('char') == 'b'),
+        (delete('text'), where('char') == 'c'),
+    ])
+    db.update(lambda doc: doc.update(int=9), where('char') == 'c')
+    db.close()
+
+    with open(path, 'rb') as f:
+        frames = [json.loads(line) for line in f.read().splitlines()]
+
+    # Only the changed fields have been written, functions changing the
+    # document are compared with its previous version
+    assert [frame['V'] for frame in frames[1:]] == [
+        {'1': {'_patch': [['inc', ['int'], 1]]}},
+        {'2': {'_patch': [['inc', ['int'], 5], ['set', ['text'], 'y']]},
+         '3': {'_patch': [['unset', ['text']]]}},
+        {'3': {'_patch': [['inc', ['int'], 8]]}},
+    ]
+
+    db = TinyDB(path, storage=JSONMultiTableLineStorage)
+    assert db.all() == [{'char': 'a', 'int': 2, 'text': 'x' * 10},
+                        {'char': 'b', 'int': 6, 'text': 'y'},
+                        {'char': 'c', 'int': 9}]
+    db.close()
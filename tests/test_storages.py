@@ -1,12 +1,21 @@
 import json
+import mmap
+import multiprocessing
 import os
+import pickle
 import random
 import tempfile
+import threading
+import time
 
 import pytest
 
 from tinydb import TinyDB, where
-from tinydb.storages import JSONStorage, MemoryStorage, Storage, touch
+from tinydb.storages import JSONStorage, MemoryStorage, Storage, touch, \
+    JSONFrameStorage, JSONMultiTableLineStorage, FSYNC_EVERY_N_MS, \
+    FSYNC_EVERY_N_RECORDS, FSYNC_ON_CLOSE, TOMBSTONE, BinaryFrameStorage, \
+    JSONMultiFrameStorage, JSONCodec, MarshalCodec, PickleCodec, FileLock, \
+    make_patch, apply_patch, apply_changes
 from tinydb.table import Document
 
 random.seed()
@@ -279,3 +288,1631 @@ def test_encoding(tmpdir):
 
     jap_storage = JSONStorage(path, encoding="cp936")
     assert japanese_doc == jap_storage.read()
+
+
+def test_json_frame_tail_replay(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    writer = JSONFrameStorage(path)
+    reader = JSONFrameStorage(path)
+
+    assert reader.read() is None
+
+    writer.write_table('_default', {'1': {'a': 1}})
+    writer.write_table('_default', {'2': {'a': 2}})
+    tables = reader.read()
+    assert tables == {'_default': {'1': {'a': 1}, '2': {'a': 2}}}
+
+    # Only the frames appended since the last read are replayed, the
+    # previously replayed documents are kept
+    replayed = tables['_default']
+    writer.write_table('_default', {'1': {'a': 3}})
+    assert reader.read() == {'_default': {'1': {'a': 3}, '2': {'a': 2}}}
+    assert reader.read()['_default'] is replayed
+    assert reader._offset == os.path.getsize(path)
+
+    writer.close()
+    reader.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+def test_log_materialized(tmpdir, storage_cls):
+    path = str(tmpdir.join('test.db'))
+
+    storage = storage_cls(path)
+    storage.write_table('_default', {'1': {'a': 1}})
+    storage.close()
+
+    # Reopening replays the log once ...
+    storage = storage_cls(path, materialize=True)
+    assert storage.read() == {'_default': {'1': {'a': 1}}}
+
+    # ... after that writes are applied in memory ...
+    storage.write_table('_default', {'2': {'a': 2}})
+    storage.write_table('_default', {'1': {'_del': 1}})
+    assert storage.read() == {'_default': {'2': {'a': 2}}}
+
+    # ... and the log isn't read anymore
+    other = storage_cls(path)
+    other.write_table('_default', {'3': {'a': 3}})
+    assert '3' not in storage.read()['_default']
+
+    other.close()
+    storage.close()
+
+    storage = storage_cls(path, materialize=True)
+    assert storage.read() == {'_default': {'2': {'a': 2}, '3': {'a': 3}}}
+    storage.close()
+
+
+def test_json_line_tables(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    storage = JSONMultiTableLineStorage(path)
+
+    storage.write_table('table1', {'1': {'a': 1}})
+    storage.write_table('_default', {'1': {'a': 2}})
+
+    assert storage.read() == {'table1': {'1': {'a': 1}},
+                              '_default': {'1': {'a': 2}}}
+
+    # A partially written line is not replayed yet
+    with open(path, 'a') as handle:
+        handle.write('{"T": "table1", "V": {"2"')
+
+    assert storage.read() == {'table1': {'1': {'a': 1}},
+                              '_default': {'1': {'a': 2}}}
+    storage.close()
+
+
+def test_log_group_commit(tmpdir, monkeypatch):
+    path = str(tmpdir.join('test.db'))
+    fsyncs = []
+    commits = []
+    monkeypatch.setattr(os, 'fsync', fsyncs.append)
+
+    storage = JSONMultiTableLineStorage(path, materialize=True,
+                                        durability=FSYNC_EVERY_N_RECORDS,
+                                        sync_records=3,
+                                        on_commit=commits.append)
+    for i in range(7):
+        storage.write_table('_default', {str(i): {'a': i}})
+
+    assert commits == [3, 3]
+    assert len(fsyncs) == 2
+
+    # Pending frames are visible in memory but not on disk yet
+    assert len(storage.read()['_default']) == 7
+    assert JSONMultiTableLineStorage(path).read()['_default'] == {
+        str(i): {'a': i} for i in range(6)
+    }
+
+    storage.close()
+    assert commits == [3, 3, 1]
+    assert len(fsyncs) == 3
+
+
+def test_log_fsync_every_n_ms(tmpdir, monkeypatch):
+    path = str(tmpdir.join('test.db'))
+    commits = []
+
+    storage = JSONFrameStorage(path, durability=FSYNC_EVERY_N_MS,
+                               sync_interval=200, on_commit=commits.append)
+    storage.write_table('_default', {'1': {'a': 1}})
+    storage.write_table('_default', {'2': {'a': 2}})
+    assert commits == []
+
+    # The frames are committed once the interval has passed, without
+    # waiting for another write
+    deadline = time.monotonic() + 5
+    while not commits and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert commits == [2]
+    assert JSONFrameStorage(path).read() == {
+        '_default': {'1': {'a': 1}, '2': {'a': 2}}
+    }
+
+    # A failed commit is reported by the next flush
+    def fail(fd):
+        raise OSError('fsync failed')
+
+    monkeypatch.setattr(os, 'fsync', fail)
+    storage.write_table('_default', {'3': {'a': 3}})
+
+    deadline = time.monotonic() + 5
+    while storage._writer._error is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    with pytest.raises(OSError):
+        storage.flush()
+
+    monkeypatch.undo()
+    storage.close()
+    assert commits == [2, 1]
+
+
+def test_log_fsync_on_close(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    commits = []
+
+    storage = JSONFrameStorage(path, durability=FSYNC_ON_CLOSE,
+                               on_commit=commits.append)
+    storage.write_table('_default', {'1': {'a': 1}})
+    storage.write_table('_default', {'2': {'a': 2}})
+    assert commits == []
+
+    # Reading commits the pending frames so they can be replayed
+    assert storage.read() == {'_default': {'1': {'a': 1}, '2': {'a': 2}}}
+    assert commits == [2]
+    storage.close()
+
+    with pytest.raises(ValueError):
+        JSONFrameStorage(path, durability='sometimes')
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+def test_log_compact(tmpdir, storage_cls):
+    path = str(tmpdir.join('test.db'))
+    storage = storage_cls(path)
+
+    for i in range(10):
+        storage.write_table('_default', {'1': {'a': i}})
+    storage.write_table('_default', {'2': {'a': 2}})
+    storage.write_table('_default', {'3': {'a': 3}})
+    storage.write_table('_default', {'3': {'_del': 1}})
+
+    size = os.path.getsize(path)
+    assert storage.read()['_default']['1'] == {'a': 9}
+    assert storage.garbage_ratio > 0.5
+
+    storage.compact()
+
+    assert os.path.getsize(path) < size
+    assert storage.garbage_ratio == 0
+    assert not os.path.exists(path + storage.compact_suffix)
+
+    # The storage keeps working on the compacted log
+    storage.write_table('_default', {'4': {'a': 4}})
+    storage.close()
+
+    storage = storage_cls(path)
+    assert storage.read() == {'_default': {'1': {'a': 9}, '2': {'a': 2},
+                                           '4': {'a': 4}}}
+    assert storage.garbage_ratio == 0
+    storage.close()
+
+
+def test_log_compact_automatically(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    storage = JSONMultiTableLineStorage(path, materialize=True,
+                                        compact_threshold=0.4,
+                                        compact_min_size=0)
+
+    storage.write_table('_default', {'1': {'a': 1}})
+    storage.write_table('_default', {'2': {'a': 2}})
+    storage.write_table('_default', {'1': {'a': 3}})
+    assert storage.garbage_ratio < 0.4
+
+    # Superseding the first document again exceeds the threshold
+    storage.write_table('_default', {'1': {'a': 4}})
+    assert storage.garbage_ratio == 0
+
+    with open(path) as handle:
+        assert len(handle.readlines()) == 2
+
+    storage.close()
+
+
+def test_json_frame_legacy_log(tmpdir):
+    path = str(tmpdir.join('test.db'))
+
+    with open(path, 'w') as handle:
+        handle.write('_default'.ljust(500, '\0'))
+        handle.write('"1": {"a": 1},"2": {"a": 2},')
+
+    storage = JSONFrameStorage(path)
+    storage.write_table('_default', {'3': {'a': 3}})
+
+    assert storage.read() == {'_default': {'1': {'a': 1}, '2': {'a': 2},
+                                           '3': {'a': 3}}}
+    storage.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+def test_log_torn_tail(tmpdir, caplog, storage_cls):
+    path = str(tmpdir.join('test.db'))
+    storage = storage_cls(path)
+    for i in range(1000):
+        storage.write_table('_default', {str(i): {'a': i}})
+    storage.close()
+    size = os.path.getsize(path)
+
+    # The process died while writing a frame
+    frame = storage._encode('_default', {'1000': {'a': 1000}})
+    with open(path, 'ab') as handle:
+        handle.write(frame[:len(frame) // 2])
+
+    # Opening the log for reading leaves it alone, opening it for writing
+    # cuts off the torn frame
+    reader = storage_cls(path, access_mode='r')
+    assert len(reader.read()['_default']) == 1000
+    reader.close()
+    assert os.path.getsize(path) > size
+
+    storage = storage_cls(path)
+    assert os.path.getsize(path) == size
+    assert 'Discarding {} bytes'.format(len(frame) // 2) in caplog.text
+
+    storage.write_table('_default', {'1000': {'a': 1000}})
+    assert len(storage.read()['_default']) == 1001
+    storage.close()
+
+
+def test_json_frame_torn_first_frame(tmpdir, caplog):
+    path = str(tmpdir.join('test.db'))
+
+    with open(path, 'w') as handle:
+        handle.write('_default'.ljust(500, '\0'))
+        handle.write('"1":{"a":1,')
+
+    storage = JSONFrameStorage(path)
+    assert os.path.getsize(path) == 500
+    assert 'Discarding 11 bytes' in caplog.text
+
+    storage.write_table('_default', {'1': {'a': 1}})
+    assert storage.read() == {'_default': {'1': {'a': 1}}}
+    storage.close()
+
+
+@pytest.mark.parametrize('first', [False, True])
+def test_json_frame_torn_after_comma(tmpdir, caplog, first):
+    path = str(tmpdir.join('test.db'))
+
+    storage = JSONFrameStorage(path)
+    if not first:
+        storage.write_table('_default', {'1': {'a': 1}})
+    frame = storage._encode('_default', {'2': {'a': 2}, '3': {'a': 3}})
+    storage.close()
+    size = os.path.getsize(path)
+
+    # The frame is cut off right after the comma between its documents, so
+    # it looks like a log of fragments written before frames got their own
+    # lines
+    torn = frame[:frame.index(b',') + 1]
+    with open(path, 'ab') as handle:
+        handle.write(torn)
+
+    expected = {} if first else {'1': {'a': 1}}
+
+    # Reading again replays the log from the torn frame on
+    reader = JSONFrameStorage(path, access_mode='r')
+    assert reader.read_table('_default') == expected
+    assert reader.read_table('_default') == expected
+    reader.close()
+
+    storage = JSONFrameStorage(path)
+    assert os.path.getsize(path) == size
+    assert 'Discarding {} bytes'.format(len(torn)) in caplog.text
+    assert storage.read_table('_default') == expected
+    storage.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+def test_log_tombstones(tmpdir, storage_cls):
+    path = str(tmpdir.join('test.db'))
+    storage = storage_cls(path)
+
+    storage.write_table('_default', {'1': {'a': 1}, '2': {'a': 2}})
+    storage.write_table('_default', {'1': TOMBSTONE})
+    storage.write_table('_default', {'3': TOMBSTONE})
+    assert storage.read() == {'_default': {'2': {'a': 2}}}
+
+    # A removed document can be written again
+    storage.write_table('_default', {'1': {'a': 3}})
+    assert storage.read() == {'_default': {'2': {'a': 2}, '1': {'a': 3}}}
+    storage.close()
+
+
+def test_binary_frames(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    storage = BinaryFrameStorage(path)
+
+    storage.write_table('table1', {'1': {'a': 1}})
+    storage.write_table('_default', {'1': {'a': 2}, '2': {'a': 3}})
+    storage.write_table('table1', {'1': TOMBSTONE})
+    storage.close()
+
+    storage = BinaryFrameStorage(path, access_mode='r')
+    assert storage.read() == {'_default': {'1': {'a': 2}, '2': {'a': 3}}}
+    storage.close()
+
+    # The header holds the format version and the table names
+    with open(path, 'rb') as handle:
+        header = handle.read(BinaryFrameStorage.header_size)
+    assert header[0] == BinaryFrameStorage.format_version
+    assert b'table1_default' in header
+
+
+def test_binary_frames_torn_tail(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    storage = BinaryFrameStorage(path)
+    storage.write_table('_default', {'1': {'a': 1}})
+    storage.write_table('_default', {'2': {'a': 2}})
+    storage.close()
+
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as handle:
+        handle.truncate(size - 3)
+
+    # Reading stops at the incomplete record ...
+    storage = BinaryFrameStorage(path, access_mode='r')
+    assert storage.read() == {'_default': {'1': {'a': 1}}}
+    storage.close()
+
+    # ... and opening the log for writing cuts it off
+    storage = BinaryFrameStorage(path)
+    storage.write_table('_default', {'3': {'a': 3}})
+    storage.close()
+
+    storage = BinaryFrameStorage(path)
+    assert storage.read() == {'_default': {'1': {'a': 1}, '3': {'a': 3}}}
+    storage.close()
+
+
+def test_binary_frames_torn_frame(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    storage = BinaryFrameStorage(path)
+    storage.write_table('_default', {'1': {'a': 1}})
+    storage.write_table('_default', {'2': {'a': 2}, '3': {'a': 3}})
+    record = len(storage._encode('_default', {'3': {'a': 3}}))
+    storage.close()
+
+    # Cut off the last record of the write, the other one is complete
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as handle:
+        handle.truncate(size - record)
+
+    # The write is replayed as a whole or not at all ...
+    storage = BinaryFrameStorage(path, access_mode='r')
+    assert storage.read() == {'_default': {'1': {'a': 1}}}
+    storage.close()
+
+    # ... and opening the log for writing cuts it off
+    storage = BinaryFrameStorage(path)
+    storage.close()
+    assert os.path.getsize(path) < size - record
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+@pytest.mark.parametrize('materialize', [False, True])
+def test_log_table_revision(tmpdir, storage_cls, materialize):
+    path = str(tmpdir.join('test.db'))
+
+    # Every write is applied once, whatever the number of documents
+    storage = storage_cls(path, materialize=materialize)
+    storage.write_table('_default', {str(i): {'a': i} for i in range(5)})
+    storage.read_table('_default')
+    assert storage.table_revision('_default') == 1
+
+    storage.write_table('_default', {'1': TOMBSTONE, '7': {'a': 7}})
+    storage.read_table('_default')
+    assert storage.table_revision('_default') == 2
+    storage.close()
+
+    # Replaying the log applies the writes in the same way
+    storage = storage_cls(path)
+    storage.read_table('_default')
+    assert storage.table_revision('_default') == 2
+    storage.close()
+
+
+def test_binary_frames_corrupt(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    storage = BinaryFrameStorage(path)
+    storage.write_table('_default', {'1': {'a': 1}})
+    storage.write_table('_default', {'2': {'a': 2}})
+    storage.close()
+
+    # Flip a byte in the payload of the last record
+    with open(path, 'r+b') as handle:
+        handle.seek(-3, os.SEEK_END)
+        byte = handle.read(1)
+        handle.seek(-3, os.SEEK_END)
+        handle.write(bytes([byte[0] ^ 0xff]))
+
+    storage = BinaryFrameStorage(path, access_mode='r')
+    assert storage.read() == {'_default': {'1': {'a': 1}}}
+    storage.close()
+
+
+def test_binary_frames_invalid(tmpdir):
+    path = str(tmpdir.join('test.db'))
+
+    with open(path, 'wb') as handle:
+        handle.write(b'\x01' + b'\0' * 499)
+
+    with pytest.raises(ValueError):
+        BinaryFrameStorage(path)
+
+    storage = BinaryFrameStorage(str(tmpdir.join('other.db')))
+    with pytest.raises(ValueError):
+        storage.write_table('x' * 21, {'1': {}})
+    storage.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage])
+@pytest.mark.parametrize('segment_size', [None, 100])
+def test_log_keydir_batches(tmpdir, storage_cls, segment_size):
+    path = str(tmpdir.join('test.db'))
+    storage = storage_cls(path, keydir=True, segment_size=segment_size)
+    storage.write_table('_default', {str(i): {'a': i} for i in range(100)})
+    storage.write_table('_default', {'1': make_patch({'a': 1, 'b': 1}, {'a': 2, 'b': 1})})
+
+    # Replay the log, so only reading the frames decodes them
+    storage.read()
+
+    decoded = []
+    decode = storage._decode
+    storage._decode = lambda frame: decoded.append(frame) or decode(frame)
+
+    # Every frame is only decoded once while reading the table, not once for
+    # every document of the batch
+    documents = storage.read_table('_default')
+    assert documents['1'] == {'a': 2}
+    assert documents['99'] == {'a': 99}
+    assert len(decoded) == 2
+
+    del decoded[:]
+    storage.compact()
+    assert len(decoded) == 2
+    assert storage.read_table('_default') == dict(documents)
+    storage.close()
+
+
+def test_binary_frames_background_writer_tables(tmpdir):
+    # New tables are registered in the header while the writer thread is
+    # appending frames. Whether they interfere depends on the timing, so
+    # this is tried a few times.
+    for attempt in range(3):
+        path = str(tmpdir.join('test{}.db'.format(attempt)))
+        storage = BinaryFrameStorage(path, write_queue_size=64)
+
+        for i in range(200):
+            storage.write_table('table{}'.format(i % 15), {str(i): {'a': 'x' * 200}})
+        storage.close()
+
+        storage = BinaryFrameStorage(path)
+        assert storage.read() == {
+            'table{}'.format(table): {
+                str(i): {'a': 'x' * 200} for i in range(table, 200, 15)
+            }
+            for table in range(15)
+        }
+        storage.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+def test_log_keydir(tmpdir, monkeypatch, storage_cls):
+    path = str(tmpdir.join('test.db'))
+    storage = storage_cls(path, keydir=True)
+
+    storage.write_table('_default', {'1': {'a': 1}})
+    storage.write_table('_default', {'2': {'a': 2}})
+    storage.write_table('_default', {'1': {'a': 3}})
+    storage.write_table('_default', {'2': TOMBSTONE})
+
+    # Only the keydir is kept in memory, documents are read from the log
+    assert storage.read_document('_default', '1') == {'a': 3}
+    assert storage.read_document('_default', '2') is None
+    assert storage.read() == {'_default': {'1': {'a': 3}}}
+    assert not any(storage._tables.values())
+
+    storage.close()
+    assert os.path.exists(path + storage.hint_suffix)
+
+    # Appending to the log after the hint has been written
+    other = storage_cls(path)
+    other.write_table('_default', {'3': {'a': 4}})
+    other.close()
+
+    # Opening the storage loads the keydir from the hint and only replays
+    # the frames written after it
+    with open(path + storage.hint_suffix) as handle:
+        hint_offset = json.load(handle)['offset']
+
+    replayed = []
+    replay = storage_cls._replay
+    monkeypatch.setattr(storage_cls, '_replay', lambda self, buf, start, base, table=None: (
+        replayed.append(base + start) or replay(self, buf, start, base, table)
+    ))
+
+    storage = storage_cls(path, keydir=True)
+    assert storage.read_document('_default', '3') == {'a': 4}
+    assert replayed == [hint_offset]
+    assert storage.read_document('_default', '1') == {'a': 3}
+
+    storage.compact()
+    assert storage.read() == {'_default': {'1': {'a': 3}, '3': {'a': 4}}}
+    storage.close()
+
+
+def test_log_keydir_stale_hint(tmpdir):
+    path = str(tmpdir.join('test.db'))
+    storage = JSONMultiTableLineStorage(path, keydir=True)
+    storage.write_table('_default', {'1': {'a': 1}})
+    storage.write_table('_default', {'1': {'a': 2}})
+    storage.close()
+
+    # Compacting without keydir replaces the log the hint belongs to
+    storage = JSONMultiTableLineStorage(path)
+    storage.compact()
+    storage.write_table('_default', {'2': {'a': 3}})
+    storage.close()
+
+    storage = JSONMultiTableLineStorage(path, keydir=True)
+    assert storage.read() == {'_default': {'1': {'a': 2}, '2': {'a': 3}}}
+    storage.close()
+
+
+def test_log_get_by_id(tmpdir):
+    path = str(tmpdir.join('test.db'))
+
+    with TinyDB(path, storage=JSONMultiTableLineStorage, keydir=True) as db:
+        doc_id = db.insert({'a': 1})
+        assert db.get(doc_id=doc_id) == {'a': 1}
+        assert db.contains(doc_id=doc_id)
+        assert not db.contains(doc_id=doc_id + 1)
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+def test_log_background_writer(tmpdir, monkeypatch, storage_cls):
+    path = str(tmpdir.join('test.db'))
+    commits = []
+    syncing = threading.Event()
+    released = threading.Event()
+    fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: (
+        syncing.set() or released.wait(5) and fsync(fd)
+    ))
+
+    storage = storage_cls(path, materialize=True, write_queue_size=2,
+                          on_commit=commits.append)
+    futures = [storage.write_table('_default', {'1': {'a': 1}})]
+    assert syncing.wait(5)
+
+    # While the disk is stuck, writes are queued until the queue is full
+    # and the writes are already visible in memory
+    futures.append(storage.write_table('_default', {'2': {'a': 2}}))
+    futures.append(storage.write_table('_default', {'3': {'a': 3}}))
+    blocked = threading.Thread(target=lambda: futures.append(
+        storage.write_table('_default', {'4': {'a': 4}})
+    ))
+    blocked.start()
+    blocked.join(0.1)
+
+    assert blocked.is_alive()
+    assert not any(future.done() for future in futures)
+    assert len(storage.read_table('_default')) == 3
+
+    # Once the disk catches up, the futures resolve and the queued frames
+    # are committed in batches
+    released.set()
+    blocked.join()
+    for future in futures:
+        assert future.result(5) is None
+    storage.flush()
+
+    assert sum(commits) == 4 and len(commits) < 4
+    assert storage_cls(path, access_mode='r').read()['_default'] == {
+        str(i): {'a': i} for i in range(1, 5)
+    }
+
+    # A failed write is reported by its future and the next flush
+    def fail(fd):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'fsync', fail)
+    future = storage.write_table('_default', {'5': {'a': 5}})
+    assert isinstance(future.exception(5), OSError)
+    with pytest.raises(OSError):
+        storage.flush()
+
+    # Closing reports the failure too, but closes the storage
+    monkeypatch.setattr(os, 'fsync', fsync)
+    with pytest.raises(OSError):
+        storage.close()
+    assert storage._handle.closed
+
+
+class FailingFile:
+    """
+    A file failing to write once ``failing`` is set, after waiting for
+    ``released``.
+    """
+
+    def __init__(self, handle):
+        self.handle = handle
+        self.failing = False
+        self.writing = threading.Event()
+        self.released = threading.Event()
+
+    def write(self, data):
+        if self.failing:
+            self.writing.set()
+            self.released.wait(5)
+            raise OSError('disk full')
+
+        return self.handle.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.handle, name)
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+@pytest.mark.parametrize('keydir', [False, True])
+def test_log_background_writer_failure(tmpdir, storage_cls, keydir):
+    path = str(tmpdir.join('test.db'))
+
+    storage = storage_cls(path, materialize=True, keydir=keydir, write_queue_size=4)
+    storage.write_table('_default', {'1': {'a': 1}})
+    storage.flush()
+
+    handle = storage._writer.handle = FailingFile(storage._writer.handle)
+    handle.failing = True
+    failed = storage.write_table('_default', {'2': {'a': 2}})
+    assert handle.writing.wait(5)
+
+    # A frame queued behind the failing one isn't written, as it would
+    # leave a gap in the log
+    handle.failing = False
+    queued = storage.write_table('_default', {'2': make_patch({'a': 2}, {'a': 3})})
+    handle.released.set()
+
+    assert isinstance(failed.exception(5), OSError)
+    assert isinstance(queued.exception(5), OSError)
+
+    # The storage keeps failing until it is reopened
+    with pytest.raises(OSError):
+        storage.write_table('_default', {'3': {'a': 3}})
+    with pytest.raises(OSError):
+        storage.flush()
+    with pytest.raises(OSError):
+        storage.read_table('_default')
+    with pytest.raises(OSError):
+        storage.close()
+
+    storage = storage_cls(path, keydir=keydir)
+    assert storage.read() == {'_default': {'1': {'a': 1}}}
+    storage.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+def test_log_mmap(tmpdir, monkeypatch, storage_cls):
+    path = str(tmpdir.join('test.db'))
+    mapped = []
+    mmap_cls = mmap.mmap
+    monkeypatch.setattr(mmap, 'mmap', lambda *args, **kwargs: (
+        mapped.append(kwargs['offset']) or mmap_cls(*args, **kwargs)
+    ))
+
+    writer = storage_cls(path)
+    reader = storage_cls(path, use_mmap=True)
+
+    # Write more than the allocation granularity, so the tail replay has to
+    # map the file from an aligned offset before the replay offset
+    for i in range(mmap.ALLOCATIONGRANULARITY // 10):
+        writer.write_table('_default', {str(i): {'a': i}})
+
+    tables = reader.read()
+    assert len(tables['_default']) == mmap.ALLOCATIONGRANULARITY // 10
+
+    writer.write_table('_default', {'0': {'a': 'updated'}})
+    writer.write_table('_default', {'1': TOMBSTONE})
+    tables = reader.read()
+
+    assert tables['_default']['0'] == {'a': 'updated'}
+    assert '1' not in tables['_default']
+    assert len(mapped) == 2 and mapped[1] > 0
+
+    writer.close()
+    reader.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+def test_log_segments(tmpdir, storage_cls):
+    path = str(tmpdir.join('test.db'))
+
+    writer = storage_cls(path, segment_size=1024, keydir=True)
+    reader = storage_cls(path, access_mode='r', segment_size=1024)
+    assert reader.read() is None
+
+    for i in range(100):
+        writer.write_table('_default', {str(i): {'a': i}})
+    writer.write_table('_default', {'0': TOMBSTONE})
+
+    with open(path + '.manifest') as f:
+        segments = json.load(f)['segments']
+
+    # The log has been split into numbered segments which stay below the
+    # segment size but one frame
+    assert len(segments) > 2
+    assert segments[:2] == ['test.db.000001', 'test.db.000002']
+    assert not os.path.exists(path)
+    for segment in segments[:-1]:
+        assert 1024 <= os.path.getsize(str(tmpdir.join(segment))) < 1100
+
+    # Documents are found in all segments
+    expected = {str(i): {'a': i} for i in range(1, 100)}
+    assert reader.read()['_default'] == expected
+    assert writer.read_document('_default', '1') == {'a': 1}
+    assert writer.read_document('_default', '99') == {'a': 99}
+    reader.close()
+
+    # Compaction collapses the log into a single new segment
+    writer.compact()
+    with open(path + '.manifest') as f:
+        compacted = json.load(f)['segments']
+
+    assert len(compacted) == 1 and compacted[0] not in segments
+    assert sorted(os.listdir(str(tmpdir))) == sorted(compacted + [
+        'test.db.manifest'
+    ])
+    writer.close()
+
+    reopened = storage_cls(path, segment_size=1024, use_mmap=True)
+    assert reopened.read()['_default'] == expected
+    reopened.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+def test_log_segments_existing_log(tmpdir, storage_cls):
+    path = str(tmpdir.join('test.db'))
+
+    storage = storage_cls(path)
+    storage.write_table('_default', {str(i): {'a': i} for i in range(10)})
+    storage.close()
+
+    expected = {str(i): {'a': i} for i in range(10)}
+
+    # A reader sees the log before it has been segmented ...
+    reader = storage_cls(path, access_mode='r', segment_size=1024)
+    assert reader.read()['_default'] == expected
+
+    # ... and the existing log is continued as the first segment
+    writer = storage_cls(path, segment_size=1024)
+    assert writer.read()['_default'] == expected
+
+    for i in range(10, 100):
+        writer.write_table('_default', {str(i): {'a': i}})
+
+    with open(path + '.manifest') as f:
+        segments = json.load(f)['segments']
+
+    assert segments[:3] == ['test.db', 'test.db.000001', 'test.db.000002']
+
+    expected.update((str(i), {'a': i}) for i in range(10, 100))
+    assert reader.read()['_default'] == expected
+    reader.close()
+    writer.close()
+
+    reopened = storage_cls(path, segment_size=1024)
+    assert reopened.read()['_default'] == expected
+
+    # Compaction replaces all segments, the unsegmented log included
+    reopened.compact()
+    assert not os.path.exists(path)
+    assert reopened.read()['_default'] == expected
+    reopened.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+def test_log_checkpoint(tmpdir, monkeypatch, storage_cls):
+    path = str(tmpdir.join('test.db'))
+
+    storage = storage_cls(path)
+    for i in range(20):
+        storage.write_table('_default', {str(i % 10): {'a': i}})
+    storage.write_table('_default', {'0': TOMBSTONE})
+    storage.checkpoint()
+    storage.write_table('_default', {'1': {'a': 'updated'}})
+    storage.close()
+
+    expected = {str(i): {'a': i + 10} for i in range(2, 10)}
+    expected['1'] = {'a': 'updated'}
+
+    replayed = []
+    replay = storage_cls._replay
+    monkeypatch.setattr(storage_cls, '_replay', lambda self, buf, start, base, table=None: (
+        replayed.append(len(buf) - start) or replay(self, buf, start, base, table)
+    ))
+
+    # Opening the storage loads the snapshot and only replays the frame
+    # written after it
+    reopened = storage_cls(path)
+    assert reopened.read()['_default'] == expected
+    assert replayed == [len(storage._encode('_default', {'1': {'a': 'updated'}}))]
+
+    fresh = storage_cls(path + '.copy')
+    with open(path, 'rb') as src, open(path + '.copy', 'r+b') as dst:
+        dst.write(src.read())
+    assert fresh.read() == reopened.read()
+    assert fresh._keydir == reopened._keydir
+    assert fresh._live_bytes == reopened._live_bytes
+    fresh.close()
+
+    # Compacting replaces the log and drops the snapshot
+    reopened.compact()
+    assert not os.path.exists(path + reopened.snapshot_suffix)
+    reopened.close()
+
+    reopened = storage_cls(path)
+    assert reopened.read()['_default'] == expected
+    reopened.close()
+
+
+def test_file_lock(tmpdir):
+    fcntl = pytest.importorskip('fcntl')
+    path = str(tmpdir.join('test.db.lock'))
+    lock = FileLock(path)
+
+    def try_lock(mode):
+        # A lock on another open file description stands in for another
+        # process
+        with open(path, 'ab') as handle:
+            try:
+                fcntl.flock(handle.fileno(), mode | fcntl.LOCK_NB)
+            except OSError:
+                return False
+
+            return True
+
+    with lock.hold():
+        assert try_lock(fcntl.LOCK_SH)
+        assert not try_lock(fcntl.LOCK_EX)
+
+        # Holding the lock exclusively within a shared hold upgrades it
+        # until the inner hold ends
+        with lock.hold(exclusive=True):
+            assert not try_lock(fcntl.LOCK_SH)
+
+            with lock.hold():
+                assert not try_lock(fcntl.LOCK_SH)
+
+        assert try_lock(fcntl.LOCK_SH)
+        assert not try_lock(fcntl.LOCK_EX)
+
+    assert try_lock(fcntl.LOCK_EX)
+    lock.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+def test_log_locking(tmpdir, storage_cls):
+    pytest.importorskip('fcntl')
+    path = str(tmpdir.join('test.db'))
+
+    # Storage instances with their own handles stand in for processes
+    first = storage_cls(path, materialize=True, locking=True)
+    second = storage_cls(path, materialize=True, locking=True)
+
+    first.write_table('_default', {'1': {'a': 1}})
+    second.write_table('_default', {'2': {'a': 2}})
+    first.write_table('_default', {'3': {'a': 3}})
+    assert first.read() == second.read() == {'_default': {
+        '1': {'a': 1}, '2': {'a': 2}, '3': {'a': 3},
+    }}
+
+    # Compacting replaces the log, which the other instance notices
+    second.write_table('_default', {'1': TOMBSTONE})
+    first.compact()
+    second.write_table('_default', {'4': {'a': 4}})
+    assert first.read_table('_default') == second.read_table('_default') == {
+        '2': {'a': 2}, '3': {'a': 3}, '4': {'a': 4},
+    }
+
+    first.close()
+    second.close()
+
+    with pytest.raises(ValueError):
+        storage_cls(path, locking=True, write_queue_size=10)
+
+
+def _insert_locked(path, worker, storage_cls, kwargs):
+    db = TinyDB(path, storage=storage_cls, locking=True, **kwargs)
+    for i in range(50):
+        db.insert({'worker': worker, 'i': i})
+        db.all()
+    db.close()
+
+
+@pytest.mark.parametrize('storage_cls, kwargs', [
+    (JSONMultiTableLineStorage, {'materialize': True}),
+    (JSONMultiFrameStorage, {'extent_size': 1024}),
+])
+def test_log_locking_processes(tmpdir, storage_cls, kwargs):
+    pytest.importorskip('fcntl')
+    path = str(tmpdir.join('test.db'))
+    storage_cls(path, locking=True).close()
+
+    processes = [
+        multiprocessing.Process(target=_insert_locked,
+                                args=(path, worker, storage_cls, kwargs))
+        for worker in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    # The workers have given their documents different IDs, so none has
+    # been overwritten, and no frame has been lost or torn
+    db = TinyDB(path, storage=storage_cls)
+    assert sorted((doc['worker'], doc['i']) for doc in db.all()) == [
+        (worker, i) for worker in range(4) for i in range(50)
+    ]
+    assert sorted(doc.doc_id for doc in db.all()) == list(range(1, 201))
+    db.close()
+
+
+def test_json_multi_frame_locking(tmpdir):
+    pytest.importorskip('fcntl')
+    path = str(tmpdir.join('test.db'))
+
+    # Storage instances with their own handles stand in for processes
+    first = JSONMultiFrameStorage(path, extent_size=64, locking=True)
+    second = JSONMultiFrameStorage(path, extent_size=64, locking=True)
+
+    # Both write to the same extents and allocate new ones in turn
+    for i in range(10):
+        first.write_table('_default', {str(2 * i): {'a': 2 * i}})
+        second.write_table('_default', {str(2 * i + 1): {'a': 2 * i + 1}})
+
+    # Tables registered by one instance are kept by the other
+    first.write_table('table1', {'1': {'b': 1}})
+    second.write_table('table2', {'1': {'c': 1}})
+
+    expected = {
+        '_default': {str(i): {'a': i} for i in range(20)},
+        'table1': {'1': {'b': 1}},
+        'table2': {'1': {'c': 1}},
+    }
+    assert first.read() == second.read() == expected
+    first.close()
+    second.close()
+
+    reopened = JSONMultiFrameStorage(path)
+    assert reopened.read() == expected
+    reopened.close()
+
+
+def test_json_locking(tmpdir):
+    pytest.importorskip('fcntl')
+    path = str(tmpdir.join('test.db'))
+
+    first = JSONStorage(path, locking=True)
+    second = JSONStorage(path, locking=True)
+    first.write({'_default': {'1': {'a': 1}}})
+    assert second.read() == {'_default': {'1': {'a': 1}}}
+    assert os.path.exists(path + '.lock')
+
+    first.close()
+    second.close()
+
+
+def test_log_checkpoint_background(tmpdir):
+    path = str(tmpdir.join('test.db'))
+
+    storage = JSONMultiTableLineStorage(path, checkpoint_bytes=1000)
+    for i in range(100):
+        storage.write_table('_default', {str(i): {'a': i}})
+
+    # A checkpoint has been started by the writes and is waited for when
+    # closing the storage
+    assert storage._checkpoint_thread is not None
+    storage.close()
+
+    with open(path + storage.snapshot_suffix) as f:
+        assert 0 < json.loads(f.readline())['offset'] <= os.path.getsize(path)
+
+    storage = JSONMultiTableLineStorage(path, access_mode='r')
+    assert storage.read()['_default'] == {str(i): {'a': i} for i in range(100)}
+    storage.close()
+
+
+def test_log_checkpoint_interval(tmpdir):
+    path = str(tmpdir.join('test.db'))
+
+    storage = JSONMultiTableLineStorage(path, checkpoint_interval=0.05)
+    storage.write_table('_default', {'1': {'a': 1}})
+
+    # The checkpoint is taken by the timer without another write
+    deadline = time.monotonic() + 5
+    while storage._written and time.monotonic() < deadline:
+        time.sleep(0.01)
+    storage._join_checkpoint()
+    assert os.path.exists(path + storage.snapshot_suffix)
+
+    storage.close()
+    assert storage._checkpoint_timer is None
+
+    storage = JSONMultiTableLineStorage(path, access_mode='r')
+    assert storage.read()['_default'] == {'1': {'a': 1}}
+    storage.close()
+
+
+@pytest.mark.parametrize('codec', [JSONCodec(), JSONCodec(sort_keys=True),
+                                   MarshalCodec(), PickleCodec()])
+def test_codecs(codec):
+    value = {'b': [1, 2.5, None, True], 'a': {'c': 'text \u00e4'}}
+    encoded = codec.encode(value)
+
+    assert isinstance(encoded, bytes)
+    assert codec.decode(encoded) == value
+
+    # Codecs are reused in worker processes
+    assert pickle.loads(pickle.dumps(codec)).decode(encoded) == value
+
+
+def test_json_codec():
+    class SetEncoder(json.JSONEncoder):
+        def default(self, o):
+            return sorted(o)
+
+    assert JSONCodec().encode({'a': [1, 2]}) == b'{"a":[1,2]}'
+    assert JSONCodec(separators=(', ', ': ')).encode({'a': [1, 2]}) == b'{"a": [1, 2]}'
+    assert JSONCodec(cls=SetEncoder).encode({'a': {2, 1}}) == b'{"a":[1,2]}'
+    assert JSONCodec('utf-16').decode('{"a":1}'.encode('utf-16')) == {'a': 1}
+
+
+@pytest.mark.parametrize('codec', [MarshalCodec(), PickleCodec()])
+def test_binary_frames_codec(tmpdir, codec):
+    path = str(tmpdir.join('test.db'))
+
+    storage = BinaryFrameStorage(path, codec=codec)
+    storage.write_table('_default', {'1': {'a': 1}, '2': {'a': [1, 2]}})
+    storage.write_table('t', {'1': {'b': 'line\nbreak'}})
+    storage.checkpoint()
+    storage.write_table('_default', {'1': TOMBSTONE})
+    storage.close()
+
+    expected = {'_default': {'2': {'a': [1, 2]}}, 't': {'1': {'b': 'line\nbreak'}}}
+
+    # Reopening loads the snapshot written with the codec
+    storage = BinaryFrameStorage(path, codec=codec)
+    assert storage.read() == expected
+    storage.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         JSONMultiFrameStorage])
+def test_json_frames_codec(tmpdir, storage_cls):
+    path = str(tmpdir.join('test.db'))
+
+    # Binary codecs may write line breaks, which break the lines apart
+    with pytest.raises(ValueError):
+        storage_cls(path, codec=MarshalCodec())
+
+    # Frames are written without whitespace
+    storage = storage_cls(path, codec=JSONCodec(sort_keys=True))
+    storage.write_table('_default', {'1': {'b': 1, 'a': 2}})
+    storage.close()
+
+    with open(path, 'rb') as f:
+        assert b'{"a":2,"b":1}' in f.read()
+
+
+def test_json_line_parallel_replay(tmpdir):
+    path = str(tmpdir.join('test.db'))
+
+    storage = JSONMultiTableLineStorage(path)
+    for i in range(200):
+        storage.write_table('table{}'.format(i % 3), {str(i % 50): {'a': i}})
+        if i % 7 == 0:
+            storage.write_table('table{}'.format(i % 3), {str(i % 40): TOMBSTONE})
+    storage.close()
+
+    sequential = JSONMultiTableLineStorage(path, access_mode='r')
+    parallel = JSONMultiTableLineStorage(path, access_mode='r',
+                                         replay_workers=2,
+                                         replay_chunk_size=512)
+
+    # The log is split into many chunks
+    parallel._handle.seek(0, os.SEEK_END)
+    size = parallel._handle.tell()
+    assert len(parallel._chunk_bounds(parallel._handle, 0, size)) > 10
+
+    # Merging the chunks gives the same result as replaying the frames one
+    # after another, including the order of the documents
+    tables = sequential.read()
+    assert list(parallel.read().items()) == list(tables.items())
+    assert all(list(parallel._tables[name]) == list(docs)
+               for name, docs in tables.items())
+    assert parallel._keydir == sequential._keydir
+    assert parallel._live_bytes == sequential._live_bytes
+    assert parallel._offset == size
+
+    sequential.close()
+    parallel.close()
+
+
+def test_patches():
+    old = {'hits': 1, 'name': 'a', 'gone': True, 'nested': {'x': 1, 'y': [1]},
+           'flag': False, 'score': 0.5, 'kept': 'b'}
+    new = {'hits': 3, 'name': 'a', 'nested': {'x': 1, 'y': [1, 2]},
+           'flag': True, 'score': 1.5, 'kept': 'b', 'added': None}
+
+    patch = make_patch(old, new)
+    assert patch == {'_patch': [
+        ['unset', ['gone']],
+        ['inc', ['hits'], 2],
+        ['set', ['nested', 'y'], [1, 2]],
+        ['set', ['flag'], True],
+        ['set', ['score'], 1.5],
+        ['set', ['added'], None],
+    ]}
+
+    # The document itself isn't modified
+    assert apply_patch(old, patch) == new
+    assert old['hits'] == 1 and old['nested'] == {'x': 1, 'y': [1]}
+
+    # Patches changing every field aren't cheaper than the document
+    assert make_patch({'a': 1}, {'a': 2}) is None
+
+    with pytest.raises(ValueError):
+        apply_patch(old, {'_patch': [['append', ['hits'], 1]]})
+
+    # Patches of missing documents are ignored
+    documents = {'1': old}
+    apply_changes(documents, {'1': patch, '2': patch})
+    assert documents == {'1': new}
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+@pytest.mark.parametrize('keydir', [False, True])
+def test_log_patches(tmpdir, storage_cls, keydir):
+    path = str(tmpdir.join('test.db'))
+    document = {'hits': 0, 'name': 'x' * 100, 'stats': {'a': 1, 'b': 2}}
+
+    storage = storage_cls(path, keydir=keydir)
+    storage.write_table('_default', {'1': document})
+    storage.write_table('_default', {'2': {'a': 1}})
+    for i in range(10):
+        storage.write_table('_default', {'1': {'_patch': [['inc', ['hits'], 1]]}})
+    storage.write_table('_default', {'1': {'_patch': [['set', ['stats', 'b'], 3],
+                                                      ['unset', ['name']]]}})
+
+    # Patches of missing documents are ignored
+    storage.write_table('_default', {'3': {'_patch': [['set', ['a'], 1]]}})
+
+    expected = {'1': {'hits': 10, 'stats': {'a': 1, 'b': 3}}, '2': {'a': 1}}
+    assert storage.read() == {'_default': expected}
+
+    # Compacting folds the patches into the document, so they are garbage
+    assert storage.garbage_ratio > 0.5
+    assert storage.read_document('_default', '1') == expected['1']
+    assert document['hits'] == 0
+    storage.close()
+
+    # Replaying (or loading the hint) applies the patches again
+    reopened = storage_cls(path, keydir=keydir)
+    assert reopened.read() == {'_default': expected}
+    assert reopened._live_bytes == storage._live_bytes
+
+    # Compacting writes the documents in full
+    reopened.compact()
+    assert reopened.read() == {'_default': expected}
+    assert not reopened._chains
+    reopened.close()
+
+    with open(path, 'rb') as f:
+        assert b'_patch' not in f.read()
+
+    reopened = storage_cls(path, keydir=keydir)
+    assert reopened.read() == {'_default': expected}
+    reopened.close()
+
+
+@pytest.mark.parametrize('keydir', [False, True])
+def test_log_patches_compact(tmpdir, keydir):
+    from tinydb.operations import increment
+
+    path = str(tmpdir.join('test.db'))
+
+    db = TinyDB(path, storage=JSONMultiTableLineStorage, keydir=keydir,
+                compact_threshold=0.5, compact_min_size=0)
+    db.insert({'hits': 0, 'content': 'x' * 4000})
+
+    for _ in range(500):
+        db.update(increment('hits'), doc_ids=[1])
+
+    # Compaction keeps folding the patches into the document
+    assert os.path.getsize(path) < 3 * 4000
+    assert db.get(doc_id=1)['hits'] == 500
+    db.close()
+
+    db = TinyDB(path, storage=JSONMultiTableLineStorage, keydir=keydir)
+    assert db.get(doc_id=1)['hits'] == 500
+    db.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+def test_log_patch_chains(tmpdir, storage_cls):
+    path = str(tmpdir.join('test.db'))
+
+    storage = storage_cls(path, keydir=True)
+    storage.write_table('_default', {'1': {'hits': 0}, '2': {'hits': 0}})
+
+    for i in range(100):
+        storage.write_table('_default', {'1': {'_patch': [['inc', ['hits'], 1]]},
+                                         '2': {'_patch': [['inc', ['hits'], 2]]}})
+        storage.read_table('_default')
+
+        # Documents are written in full again before their chains grow
+        # beyond the limit
+        chains = storage._chains.get('_default', {})
+        assert all(len(chain) <= storage.max_patch_chain for chain in chains.values())
+
+    expected = {'1': {'hits': 100}, '2': {'hits': 200}}
+    assert storage.read_table('_default') == expected
+    storage.close()
+
+    reopened = storage_cls(path, keydir=True)
+    assert reopened.read_table('_default') == expected
+    reopened.close()
+
+
+def test_log_patches_applied_once(tmpdir):
+    path = str(tmpdir.join('test.db'))
+
+    storage = JSONMultiTableLineStorage(path, keydir=True)
+    storage.write_table('t1', {'1': {'hits': 0, 'a': 1}})
+    storage.read()
+    storage.write_table('t1', {'1': {'_patch': [['inc', ['hits'], 1]]}})
+    storage.write_table('t2', {'1': {'a': 1}})
+
+    # The keydir saved to the hint covers a patch beyond its offset, which
+    # must not be applied again when replaying the log after the hint
+    storage.read_table('t1')
+    storage.close()
+
+    reopened = JSONMultiTableLineStorage(path, keydir=True)
+    assert reopened.read() == {'t1': {'1': {'hits': 1, 'a': 1}},
+                               't2': {'1': {'a': 1}}}
+    reopened.close()
+
+
+def test_json_line_parallel_replay_patches(tmpdir):
+    path = str(tmpdir.join('test.db'))
+
+    storage = JSONMultiTableLineStorage(path)
+    for i in range(200):
+        doc_id = str(i % 20)
+        if i < 20 or i % 11 == 0:
+            storage.write_table('_default', {doc_id: {'hits': 0, 'i': i}})
+        elif i % 13 == 0:
+            storage.write_table('_default', {doc_id: TOMBSTONE})
+        else:
+            storage.write_table('_default', {doc_id: {'_patch': [['inc', ['hits'], 1],
+                                                                 ['set', ['i'], i]]}})
+    storage.close()
+
+    sequential = JSONMultiTableLineStorage(path, access_mode='r')
+    parallel = JSONMultiTableLineStorage(path, access_mode='r',
+                                         replay_workers=2,
+                                         replay_chunk_size=512)
+
+    tables = sequential.read()
+    assert list(parallel.read()['_default'].items()) == list(tables['_default'].items())
+    assert parallel._keydir == sequential._keydir
+    assert parallel._live_bytes == sequential._live_bytes
+
+    sequential.close()
+    parallel.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+def test_table_update_patches(tmpdir, storage_cls):
+    from tinydb.operations import increment
+
+    path = str(tmpdir.join('test.db'))
+    document = {'hits': 0, 'tags': ['a'], 'content': 'x' * 1000}
+
+    db = TinyDB(path, storage=storage_cls, materialize=True)
+    table = db.table('_default')
+    table.insert(document)
+    size = os.path.getsize(path)
+
+    for _ in range(100):
+        table.update(increment('hits'), doc_ids=[1])
+
+    # Only the counter is written, not the whole document
+    assert os.path.getsize(path) - size < 100 * 100
+
+    # Documents changed in place are copied, so the previous version the
+    # patch is computed from stays intact
+    table.update(lambda doc: doc['tags'].append('b'), doc_ids=[1])
+    assert table.get(doc_id=1) == dict(document, hits=100, tags=['a', 'b'])
+    db.close()
+
+    db = TinyDB(path, storage=storage_cls)
+    assert db.table('_default').get(doc_id=1) == dict(document, hits=100, tags=['a', 'b'])
+    db.close()
+
+
+@pytest.mark.parametrize('storage_cls', [JSONFrameStorage,
+                                         JSONMultiTableLineStorage,
+                                         BinaryFrameStorage])
+@pytest.mark.parametrize('keydir', [False, True])
+def test_log_next_id(tmpdir, storage_cls, keydir):
+    path = str(tmpdir.join('test.db'))
+
+    storage = storage_cls(path, keydir=keydir)
+    assert storage.read_next_id('_default') == 1
+    storage.write_table('_default', {'1': {'a': 1}, '7': {'a': 7}, 'x': {'a': 0}})
+    storage.write_table('_default', {'7': TOMBSTONE, '3': {'a': 3}})
+
+    # Removing the document with the largest ID doesn't free its ID
+    assert storage.read_next_id('_default') == 8
+    storage.close()
+
+    reopened = storage_cls(path, keydir=keydir)
+    assert reopened.read_next_id('_default') == 8
+    if not keydir:
+        reopened.checkpoint()
+    reopened.close()
+
+    suffix = storage_cls.hint_suffix if keydir else storage_cls.snapshot_suffix
+    with open(path + suffix, 'rb') as f:
+        assert json.loads(f.readline())['next_ids'] == {'_default': 8}
+
+    # Without replaying the log
+    reopened = storage_cls(path, keydir=keydir)
+    assert reopened._next_ids == {'_default': 8}
+
+    # IDs start over once the table is empty
+    reopened.write_table('_default', {'1': TOMBSTONE, '3': TOMBSTONE, 'x': TOMBSTONE})
+    assert reopened.read_next_id('_default') == 1
+    reopened.close()
+
+
+def test_log_next_id_tinydb(tmpdir, monkeypatch):
+    path = str(tmpdir.join('test.db'))
+
+    db = TinyDB(path, storage=JSONMultiTableLineStorage, keydir=True)
+    db.insert_multiple({'a': i} for i in range(10))
+    db.close()
+
+    # Inserting into the table doesn't read its documents to find the next ID
+    db = TinyDB(path, storage=JSONMultiTableLineStorage, keydir=True)
+    monkeypatch.setattr(JSONMultiTableLineStorage, '_read_frame', None)
+    assert db.insert({'a': 10}) == 11
+    monkeypatch.undo()
+    assert len(db) == 11
+    db.close()
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'separators': (',', ':')}])
+def test_json_line_table_prefilter(tmpdir, monkeypatch, kwargs):
+    path = str(tmpdir.join('test.db'))
+    writer = JSONMultiTableLineStorage(path, **kwargs)
+    reader = JSONMultiTableLineStorage(path, access_mode='r', **kwargs)
+
+    for i in range(40):
+        table = 'a' if i % 10 == 0 else 'a2'
+        writer.write_table(table, {str(i % 7): {'a': i}})
+    writer.write_table('a', {'0': TOMBSTONE})
+    writer.flush()
+
+    decoded = []
+    decode = JSONMultiTableLineStorage._decode
+    monkeypatch.setattr(JSONMultiTableLineStorage, '_decode', lambda self, frame: (
+        decoded.append(frame) or decode(self, frame)
+    ))
+
+    # Reading a table only decodes the lines of that table
+    assert reader.read_table('a') == {'3': {'a': 10}, '6': {'a': 20}, '2': {'a': 30}}
+    assert len(decoded) == 5
+
+    # Later writes are replayed incrementally, the lines the table has
+    # already been replayed up to aren't decoded again
+    decoded.clear()
+    writer.write_table('a', {'3': {'a': 'updated'}})
+    writer.write_table('a2', {'3': {'a': 'updated'}})
+    writer.flush()
+    assert reader.read_table('a')['3'] == {'a': 'updated'}
+    assert len(decoded) == 1
+
+    # Replaying the rest of the log leaves the tables in the same state as
+    # replaying it in one go
+    decoded.clear()
+    fresh = JSONMultiTableLineStorage(path, access_mode='r', **kwargs)
+    tables = fresh.read()
+    assert reader.read() == tables
+    assert len(decoded) == 2 * 43
+    assert reader._keydir == fresh._keydir
+    assert reader._live_bytes == fresh._live_bytes
+
+    # Lines written with spaces after the separators by older versions are
+    # decoded as well
+    writer.flush()
+    with open(path, 'a') as handle:
+        handle.write('{"T": "a", "V": {"9": {"a": 9}}}\n')
+        handle.write('{"T": "a2", "V": {"9": {"a": 9}}}\n')
+
+    other = JSONMultiTableLineStorage(path, access_mode='r', **kwargs)
+    assert other.read_table('a') == dict(tables['a'], **{'9': {'a': 9}})
+
+    writer.close()
+    reader.close()
+    fresh.close()
+    other.close()
+
+
+def test_json_multi_frame(tmpdir, monkeypatch):
+    path = str(tmpdir.join('test.db'))
+    writer = JSONMultiFrameStorage(path, tables=['a'], extent_size=64)
+    reader = JSONMultiFrameStorage(path, access_mode='r')
+    assert reader.read() is None
+
+    # Interleave the frames of the tables and spill them over several
+    # extents, a frame larger than an extent gets an extent of its own
+    for i in range(20):
+        writer.write_table('a', {str(i): {'a': i}})
+        writer.write_table('b', {str(i): {'b': i}})
+    writer.write_table('b', {'20': {'b': 'x' * 100}})
+    writer.write_table('a', {'0': TOMBSTONE})
+
+    expected_a = {str(i): {'a': i} for i in range(1, 20)}
+    expected_b = {str(i): {'b': i} for i in range(20)}
+    expected_b['20'] = {'b': 'x' * 100}
+
+    # Reading a table only decodes the frames of that table
+    decoded = []
+    decode = JSONMultiFrameStorage._decode
+    monkeypatch.setattr(JSONMultiFrameStorage, '_decode', lambda self, frame: (
+        decoded.append(decode(self, frame)) or decoded[-1]
+    ))
+
+    assert reader.read_table('a') == expected_a
+    assert len(decoded) == 21 and all('a' in doc for frame in decoded
+                                      for doc in frame.values()
+                                      if doc != TOMBSTONE)
+
+    # Later writes are replayed incrementally
+    decoded.clear()
+    writer.write_table('a', {'1': {'a': 'updated'}})
+    expected_a['1'] = {'a': 'updated'}
+    assert reader.read() == {'a': expected_a, 'b': expected_b}
+    assert len(decoded) == 22
+    assert reader.read_document('b', '20') == {'b': 'x' * 100}
+    writer.close()
+
+    # A reopened storage continues in the last extent of a table
+    size = os.path.getsize(path)
+    writer = JSONMultiFrameStorage(path, extent_size=64)
+    writer.write_table('a', {'2': TOMBSTONE})
+    assert os.path.getsize(path) == size
+    del expected_a['2']
+    assert reader.read_table('a') == expected_a
+
+    writer.close()
+    reader.close()
+
+    db = TinyDB(path, storage=JSONMultiFrameStorage)
+    db.insert({'int': 1})
+    assert db.all() == [{'int': 1}]
+    db.close()
+
+
+def test_json_multi_frame_invalid(tmpdir):
+    path = str(tmpdir.join('test.db'))
+
+    with open(path, 'wb') as handle:
+        handle.write(b'\x02' + b'\0' * 819)
+
+    with pytest.raises(ValueError):
+        JSONMultiFrameStorage(path)
+
+    storage = JSONMultiFrameStorage(str(tmpdir.join('other.db')))
+    with pytest.raises(ValueError):
+        storage.write_table('x' * 21, {'1': {}})
+    with pytest.raises(ValueError):
+        JSONMultiFrameStorage(str(tmpdir.join('indent.db')), indent=2)
+    storage.close()
+
+
+def test_table_scoped_defaults():
+    # noinspection PyAbstractClass
+    class MyStorage(Storage):
+        def __init__(self):
+            self.memory = None
+
+        def read(self):
+            return self.memory
+
+        def write(self, data):
+            self.memory = data
+
+    storage = MyStorage()
+    assert storage.read_table('table1') == {}
+
+    storage.write_table('table1', {'1': {'a': 1}, '2': {'a': 2}})
+    storage.write_table('table1', {'1': TOMBSTONE})
+    storage.write_table('table2', {'1': {'b': 1}})
+
+    assert storage.read() == {'table1': {'2': {'a': 2}}, 'table2': {'1': {'b': 1}}}
+    assert storage.read_table('table1') == {'2': {'a': 2}}
+    assert storage.read_document('table2', '1') == {'b': 1}
+    assert storage.read_next_id('table1') is None
+    assert storage.table_revision('table1') is None
+
+    memory = MemoryStorage()
+    memory.write_table('table1', {'1': {'a': 1}})
+    assert memory.read() == {'table1': {'1': {'a': 1}}}
+    assert memory.table_revision('table1') == 1
+    memory.write({'table2': {}})
+    assert memory.table_revision('table1') == 2
+    assert memory.table_revision('table2') == 1
+
+
+@pytest.mark.parametrize('storage_cls', [JSONMultiTableLineStorage,
+                                         BinaryFrameStorage,
+                                         JSONMultiFrameStorage])
+def test_table_scoped_tinydb(tmpdir, storage_cls):
+    path = str(tmpdir.join('test.db'))
+
+    db = TinyDB(path, storage=storage_cls)
+    db.table('table1').insert_multiple({'a': i} for i in range(3))
+    db.table('table2').insert({'b': 1})
+    db.table('table1').update({'a': 9}, where('a') == 1)
+    db.table('table1').remove(where('a') == 2)
+
+    assert db.tables() == {'table1', 'table2'}
+    assert db.table('table1').all() == [{'a': 0}, {'a': 9}]
+    assert db.table('table2').all() == [{'b': 1}]
+
+    # Dropping tables writes the whole database
+    db.drop_table('table2')
+    assert db.tables() == {'table1'}
+    db.close()
+
+    db = TinyDB(path, storage=storage_cls)
+    assert db.tables() == {'table1'}
+    assert db.table('table1').all() == [{'a': 0}, {'a': 9}]
+
+    db.table('table1').truncate()
+    assert db.table('table1').all() == []
+    db.drop_tables()
+    assert db.tables() == set()
+    db.close()
@@ -169,3 +169,261 @@ def test_table_repr(db):
 def test_truncate_table(db):
     db.truncate()
     assert db._get_next_id() == 1
+
+
+def test_insert_appends(monkeypatch):
+    from tinydb import TinyDB
+    from tinydb.storages import MemoryStorage
+    from tinydb.table import Document
+
+    db = TinyDB(storage=MemoryStorage)
+    table = db.table('table1')
+    table.insert({'int': 0})
+
+    reads = []
+    writes = []
+    storage = db.storage
+    monkeypatch.setattr(storage, 'read', lambda: reads.append(None))
+    monkeypatch.setattr(storage, 'read_table', lambda name: reads.append(name))
+    write_table = storage.write_table
+    monkeypatch.setattr(storage, 'write_table', lambda name, documents: (
+        writes.append(documents) or write_table(name, documents)
+    ))
+
+    # Inserting only writes the new documents and doesn't read the table
+    assert table.insert({'int': 1}) == 2
+    assert table.insert_multiple([{'int': 2}, Document({'int': 3}, doc_id=10)]) == [3, 10]
+    assert table.insert_multiple([]) == []
+    assert reads == []
+    assert writes == [{'2': {'int': 1}}, {'3': {'int': 2}, '10': {'int': 3}}]
+
+    with pytest.raises(ValueError, match='Document with ID 10 already exists'):
+        table.insert(Document({'int': 4}, doc_id=10))
+
+    with pytest.raises(ValueError, match='Document with ID 11 already exists'):
+        table.insert_multiple([Document({}, doc_id=11), Document({}, doc_id=11)])
+
+    assert len(writes) == 2
+    monkeypatch.undo()
+    assert [doc.doc_id for doc in table.all()] == [1, 2, 3, 10]
+
+
+@pytest.mark.parametrize('storage_cls', ['memory', 'log'])
+def test_native_table_kept(tmpdir, storage_cls):
+    from tinydb import TinyDB
+    from tinydb.operations import increment
+    from tinydb.storages import JSONMultiTableLineStorage, MemoryStorage
+
+    if storage_cls == 'memory':
+        db = TinyDB(storage=MemoryStorage)
+    else:
+        db = TinyDB(str(tmpdir.join('test.db')),
+                    storage=JSONMultiTableLineStorage, materialize=True)
+
+    table = db.table('table1')
+    table.insert_multiple({'int': i} for i in range(3))
+
+    # The table data keyed by document ID is kept in between updates
+    table.update(increment('int'), doc_ids=[1])
+    native = table._native_table[1]
+    table.update(increment('int'), doc_ids=[2])
+    table.insert({'int': 9})
+    table.remove(doc_ids=[3])
+    assert table._native_table[1] is native
+    assert native == {1: {'int': 1}, 2: {'int': 2}, 4: {'int': 9}}
+
+    # Changes written by someone else make the table convert the IDs again
+    db.storage.write_table('table1', {'1': {'int': 5}})
+    table.update(increment('int'), doc_ids=[1])
+    assert table._native_table[1] is not native
+    assert table.get(doc_id=1) == {'int': 6}
+
+    # A failing update doesn't leave changes behind
+    with pytest.raises(KeyError):
+        table.update(lambda doc: doc.pop('missing'), doc_ids=[2])
+    assert table._native_table is None
+    assert [doc['int'] for doc in table.all()] == [6, 2, 9]
+    db.close()
+
+
+def test_indexes(db):
+    from tinydb import Query
+    from tinydb.operations import set
+
+    db.insert_multiple([
+        {'int': 2, 'nested': {'x': [1, 2]}},
+        {'int': 3, 'nested': {'x': 'y'}},
+        {'nested': None},
+    ])
+    db.create_index('int')
+    db.create_index(Query().nested.x)
+
+    # Only the documents found in the index are tested
+    calls = []
+    cond = where('int') == 1
+
+    def spy(doc):
+        calls.append(doc)
+        return cond(doc)
+
+    query = Query()
+    query._hash = cond._hash
+    query._test = spy
+    assert [doc['char'] for doc in db.search(query)] == ['a', 'b', 'c']
+    assert len(calls) == 3
+
+    assert db.count(where('int').one_of([2, 3, 4])) == 2
+    assert [doc.doc_id for doc in db.search(where('int').exists())] == [1, 2, 3, 4, 5]
+    assert db.get(Query().nested.x == [1, 2]).doc_id == 4
+    assert db.count(Query().nested.x.exists()) == 2
+    assert db.search((where('int') == 1) & (where('char') == 'b')) == [{'int': 1, 'char': 'b'}]
+    assert db.count((where('int') == 2) | (Query().nested.x == 'y')) == 2
+    assert db.get(where('int') == 4) is None
+
+    # The indexes are kept up to date on writes
+    db.update(set('int', 4), where('char') == 'a')
+    db.update({'nested': {'x': 'y'}}, doc_ids=[4])
+    db.remove(doc_ids=[2])
+    db.insert({'int': 1})
+    assert [doc.doc_id for doc in db.search(where('int') == 1)] == [3, 7]
+    assert db.get(where('int') == 4).doc_id == 1
+    assert db.count(Query().nested.x == 'y') == 2
+    assert db.count(Query().nested.x == [1, 2]) == 0
+    assert db._indexes_current
+
+    db.truncate()
+    assert db.search(where('int') == 1) == []
+
+    db.drop_index('int')
+    assert list(db._indexes) == [('nested', 'x')]
+
+    with pytest.raises(ValueError):
+        db.create_index(Query().int.map(str))
+
+
+def test_indexes_rebuilt():
+    from tinydb import TinyDB
+    from tinydb.storages import MemoryStorage
+
+    db = TinyDB(storage=MemoryStorage)
+    db.insert_multiple({'int': i} for i in range(3))
+    db.create_index('int')
+    assert db.count(where('int') == 1) == 1
+
+    # Changes written by someone else make the table rebuild its indexes
+    db.storage.write_table('_default', {'1': {'int': 1}})
+    assert db.count(where('int').one_of([1])) == 2
+
+
+def test_sorted_indexes(db):
+    from tinydb import Query
+    from tinydb.operations import set
+
+    db.truncate()
+    db.insert_multiple([
+        {'a': 5}, {'a': 1.5}, {'a': 'b'}, {'a': True}, {'a': None},
+        {'a': 3}, {'a': 'a'}, {'a': [1]}, {'b': 1}, {'a': 3},
+    ])
+    db.create_index('a', ordered=True)
+    a = Query().a
+
+    # Only values of the same type are compared
+    assert [doc['a'] for doc in db.search(a > 1)] == [5, 1.5, 3, 3]
+    assert [doc['a'] for doc in db.search(a <= 'a')] == ['a']
+    assert db.count(a >= 'a') == 2
+    assert db.count(a < 1.5) == 1
+    assert db.count(a == 3) == 2
+
+    # Ranges combined by & are looked up as a single slice
+    calls = []
+    original = db._indexes[('a',)].range
+
+    def spy(bounds):
+        calls.append(sorted(bounds))
+        return original(bounds)
+
+    db._indexes[('a',)].range = spy
+    assert [doc.doc_id for doc in db.search((a >= 1.5) & (a < 5) & (a > 1))] == [2, 6, 10]
+    assert calls == [[('<', 5), ('>', 1), ('>=', 1.5)]]
+    assert db.search((a > 1) & (a < 'z')) == []
+    assert db.count((a > 4) | (a < 2)) == 3
+
+    # The index is kept up to date on writes
+    db.update(set('a', 0), doc_ids=[1])
+    db.remove(doc_ids=[6])
+    db.insert({'a': 2})
+    assert [doc.doc_id for doc in db.search(a < 3)] == [1, 2, 4, 11]
+    assert db._indexes_current
+
+    # Documents are ordered by their values, numbers before strings
+    assert [doc.doc_id for doc in db.order_by('a')] == [1, 4, 2, 11, 10, 7, 3, 5, 8]
+    assert [doc['a'] for doc in db.order_by(a, a >= 1, reverse=True)] == [3, 2, 1.5, True]
+
+    db.drop_index('a')
+    assert [doc.doc_id for doc in db.order_by('a')] == [1, 4, 2, 11, 10, 7, 3, 5, 8]
+
+
+def test_indexes_unknown_revision(tmpdir):
+    from tinydb import TinyDB, Query, JSONStorage
+
+    db = TinyDB(str(tmpdir.join('test.json')), storage=JSONStorage)
+    table = db.table('table1')
+    table.insert_multiple({'int': i} for i in range(3))
+    table.create_index('int', ordered=True)
+    assert table.count(where('int').one_of([1, 2])) == 2
+
+    builds = []
+    index = table._indexes[('int',)]
+    build = index.build
+    index.build = lambda documents: builds.append(1) or build(documents)
+
+    # JSONStorage doesn't report table revisions, so the indexes follow the
+    # changes made through the table instead of being rebuilt
+    table.insert({'int': 1})
+    table.update({'int': 5}, doc_ids=[1])
+    assert [doc.doc_id for doc in table.search(Query().int.one_of([1, 5]))] == [1, 2, 4]
+    assert [doc['int'] for doc in table.order_by('int')] == [1, 1, 2, 5]
+    assert builds == []
+
+    # Documents removed elsewhere aren't found
+    db.drop_tables()
+    assert table.search(Query().int.one_of([2, 1])) == []
+    assert table.order_by('int') == []
+
+    # Documents added elsewhere are found once the cache is cleared
+    db.storage.write({'table1': {'1': {'int': 1}}})
+    assert table.search(Query().int == 1) == []
+    table.clear_cache()
+    assert table.search(Query().int == 1) == [{'int': 1}]
+    assert builds == [1]
+
+
+def test_indexes_incremental_log(tmpdir):
+    from tinydb import TinyDB
+    from tinydb.storages import JSONMultiTableLineStorage
+
+    path = str(tmpdir.join('test.db'))
+    db = TinyDB(path, storage=JSONMultiTableLineStorage)
+    db.insert_multiple({'int': i} for i in range(10))
+    db.create_index('int')
+
+    builds = []
+    index = db._indexes[('int',)]
+    build = index.build
+    index.build = lambda documents: builds.append(1) or build(documents)
+
+    # The log applies the writes only when the table is read next, the
+    # indexes are updated nonetheless instead of being rebuilt
+    for i in range(5):
+        db.insert({'int': i})
+        db.update({'int': 9}, doc_ids=[i + 1])
+        assert db.count(where('int') == i) == 1
+    assert builds == [1]
+
+    # Writes by someone else make the indexes be rebuilt
+    other = TinyDB(path, storage=JSONMultiTableLineStorage)
+    other.insert({'int': 9})
+    other.close()
+    assert db.count(where('int') == 9) == 7
+    assert builds == [1, 1]
+    db.close()
@@ -0,0 +1,439 @@
+"""
+Indexes on document fields.
+
+Indexes are created with :meth:`Table.create_index()
+<tinydb.table.Table.create_index>`. Searching a table then looks up the
+documents a query may match in its indexes instead of testing every document.
+The query is still tested against these documents, so an index only has to
+find a superset of the matching documents.
+
+Queries are recognized by their hash value (see
+:class:`~tinydb.queries.QueryInstance`) which holds the operation, the path of
+the field and the value the query compares the field with.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from numbers import Number
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    cast
+)
+
+from .utils import freeze
+
+__all__ = ('HashIndex', 'SortedIndex', 'resolve', 'find')
+
+#: The value :func:`resolve` returns for documents that don't have a field
+MISSING = object()
+
+#: The key of documents with a value that can't be hashed
+UNHASHABLE = object()
+
+
+def resolve(document: Mapping, path: Tuple[str, ...]) -> Any:
+    """
+    Get the value of a field of a document like a query does.
+
+    :param document: The document
+    :param path: The path of the field, as a tuple of keys
+    :returns: the value or :data:`MISSING` if the document doesn't have the
+              field
+    """
+    value: Any = document
+
+    try:
+        for part in path:
+            value = value[part]
+    except (KeyError, TypeError):
+        return MISSING
+
+    return value
+
+
+def rank(value: Any) -> Optional[int]:
+    """
+    Get the rank of the type of a value in the order of a
+    :class:`SortedIndex`.
+
+    Numbers come first, strings second. Other values, including NaN which
+    can't be compared, aren't ordered.
+
+    :param value: The value
+    :returns: ``0`` for numbers, ``1`` for strings or ``None`` otherwise
+    """
+    if isinstance(value, str):
+        return 1
+
+    if isinstance(value, Number) and not isinstance(value, complex):
+        # NaN isn't equal to itself
+        return 0 if value == value else None
+
+    return None
+
+
+class HashIndex:
+    """
+    An index mapping the values of a field to the IDs of the documents
+    having them.
+
+    Values are frozen (see :func:`tinydb.utils.freeze`) as queries do, so
+    lists and dicts can be looked up too. Documents with a value that can't be
+    hashed even then are found by every lookup.
+
+    :param path: The path of the field, as a tuple of keys
+    """
+
+    def __init__(self, path: Tuple[str, ...]):
+        self.path = path
+
+        # The IDs of the documents by the value of their field
+        self._ids: Dict[Any, Set] = {}
+
+        # The values of the indexed documents by their ID, to find them
+        # again when a document is removed
+        self._keys: Dict[Any, Any] = {}
+
+        # The IDs of the documents with a value that can't be hashed
+        self._unhashable: Set = set()
+
+    def __len__(self):
+        """
+        Get the number of documents having the field.
+        """
+        return len(self._keys)
+
+    def clear(self) -> None:
+        """
+        Remove all documents from the index.
+        """
+        self._ids.clear()
+        self._keys.clear()
+        self._unhashable.clear()
+
+    def build(self, documents: Iterable[Tuple[Any, Mapping]]) -> None:
+        """
+        Index all documents of a table, replacing the current ones.
+
+        :param documents: The documents with their IDs
+        """
+        self.clear()
+
+        for doc_id, document in documents:
+            self.add(doc_id, document)
+
+    def add(self, doc_id, document: Mapping) -> None:
+        """
+        Add a document to the index.
+
+        :param doc_id: The ID of the document
+        :param document: The document
+        """
+        value = resolve(document, self.path)
+
+        if value is MISSING:
+            return
+
+        key = freeze(value)
+
+        try:
+            ids = self._ids.get(key)
+        except TypeError:
+            self._unhashable.add(doc_id)
+            self._keys[doc_id] = UNHASHABLE
+
+            return
+
+        if ids is None:
+            ids = self._ids[key] = set()
+            self._add_key(key)
+
+        ids.add(doc_id)
+        self._keys[doc_id] = key
+
+    def remove(self, doc_id) -> None:
+        """
+        Remove a document from the index, if it has been added.
+
+        :param doc_id: The ID of the document
+        """
+        key = self._keys.pop(doc_id, MISSING)
+
+        if key is MISSING:
+            return
+
+        if key is UNHASHABLE:
+            self._unhashable.discard(doc_id)
+            return
+
+        ids = self._ids[key]
+        ids.discard(doc_id)
+
+        if not ids:
+            del self._ids[key]
+            self._remove_key(key)
+
+    def lookup(self, value: Any) -> Set:
+        """
+        Find the documents with a field equal to a value.
+
+        :param value: The frozen value
+        :returns: the IDs of the documents
+        :raises TypeError: if the value can't be hashed
+        """
+        return self._ids.get(value, set()) | self._unhashable
+
+    def all(self) -> Set:
+        """
+        Find the documents having the field.
+
+        :returns: the IDs of the documents
+        """
+        return set(self._keys)
+
+    def _add_key(self, key: Any) -> None:
+        """
+        Called when the first document with a value has been added.
+        """
+
+    def _remove_key(self, key: Any) -> None:
+        """
+        Called when the last document with a value has been removed.
+        """
+
+
+class SortedIndex(HashIndex):
+    """
+    An index that also keeps the values of a field in order, to find the
+    documents with a value in a range.
+
+    The distinct values are kept in sorted lists, one for numbers and one for
+    strings, that are searched using :mod:`bisect`. A range is always looked
+    up in the list of its bounds' type: numbers are only compared with
+    numbers and strings only with strings, no matter how the documents' values
+    are mixed.
+
+    :param path: The path of the field, as a tuple of keys
+    """
+
+    def __init__(self, path: Tuple[str, ...]):
+        super().__init__(path)
+
+        # The distinct values by their rank, see rank()
+        self._sorted: Tuple[List, List] = ([], [])
+        self._building = False
+
+    def clear(self) -> None:
+        super().clear()
+
+        for values in self._sorted:
+            values.clear()
+
+    def build(self, documents: Iterable[Tuple[Any, Mapping]]) -> None:
+        # Sorting the values once is cheaper than inserting them one by one
+        self._building = True
+
+        try:
+            super().build(documents)
+        finally:
+            self._building = False
+
+            for values in self._sorted:
+                values.sort()
+
+    def range(self, bounds: Iterable[Tuple[str, Any]]) -> Optional[Set]:
+        """
+        Find the documents with a value within bounds.
+
+        :param bounds: The bounds as pairs of a comparison operator (``<``,
+                       ``<=``, ``>`` or ``>=``) and the value to compare with
+        :returns: the IDs of the documents or ``None`` if a value can't be
+                  ordered
+        """
+        value_rank = None
+        lower: Any = None
+        upper: Any = None
+        include_lower = include_upper = True
+
+        for operation, value in bounds:
+            bound_rank = rank(value)
+
+            if bound_rank is None:
+                return None
+
+            if value_rank is None:
+                value_rank = bound_rank
+            elif bound_rank != value_rank:
+                # No value compares with both numbers and strings
+                return set()
+
+            # Keep the tightest bounds
+            if operation in ('>', '>='):
+                if lower is None or value > lower or (value == lower and operation == '>'):
+                    lower, include_lower = value, operation == '>='
+            elif upper is None or value < upper or (value == upper and operation == '<'):
+                upper, include_upper = value, operation == '<='
+
+        if value_rank is None:
+            return None
+
+        values = self._sorted[value_rank]
+
+        if lower is None:
+            start = 0
+        else:
+            start = (bisect_left if include_lower else bisect_right)(values, lower)
+
+        if upper is None:
+            stop = len(values)
+        else:
+            stop = (bisect_right if include_upper else bisect_left)(values, upper)
+
+        return set().union(*(self._ids[value] for value in values[start:stop]))
+
+    def ids(self) -> Iterator:
+        """
+        Iterate over the documents in the order of their values.
+
+        Numbers come before strings, documents with values that can't be
+        ordered come last. Documents with equal values are ordered by their
+        ID.
+
+        :returns: an iterator over the IDs of the documents
+        """
+        ordered = 0
+
+        for values in self._sorted:
+            for value in values:
+                ids = self._ids[value]
+                ordered += len(ids)
+
+                yield from sorted(ids)
+
+        if ordered < len(self._keys):
+            yield from sorted(
+                doc_id for doc_id, key in self._keys.items()
+                if key is UNHASHABLE or rank(key) is None
+            )
+
+    def _add_key(self, key: Any) -> None:
+        key_rank = rank(key)
+
+        if key_rank is None:
+            return
+
+        if self._building:
+            self._sorted[key_rank].append(key)
+        else:
+            insort(self._sorted[key_rank], key)
+
+    def _remove_key(self, key: Any) -> None:
+        key_rank = rank(key)
+
+        if key_rank is None:
+            return
+
+        values = self._sorted[key_rank]
+        del values[bisect_left(values, key)]
+
+
+#: The operators of range queries
+RANGE_OPERATIONS = ('<', '<=', '>', '>=')
+
+
+def find(indexes: Dict[Tuple[str, ...], HashIndex],
+         hashval: Optional[Tuple]) -> Optional[Set]:
+    """
+    Find the documents a query may match using indexes.
+
+    Supported are equality (``==``), ``one_of()`` and ``exists()`` queries on
+    indexed fields, range queries (``<``, ``<=``, ``>``, ``>=``) on fields
+    with a :class:`SortedIndex` and combinations of them. Queries combined by
+    ``&`` need only one of them to be supported, as the others can only narrow
+    the documents down further. Range queries on the same field combined by
+    ``&`` are looked up as a single range.
+
+    :param indexes: The indexes by the path of their field
+    :param hashval: The hash value of the query
+    :returns: the IDs of the documents or ``None`` if the indexes don't
+              support the query
+    """
+    if not hashval:
+        return None
+
+    operation = hashval[0]
+
+    if operation == 'and':
+        found = []
+        bounds: Dict[Tuple[str, ...], List[Tuple[str, Any]]] = {}
+
+        for part in _conjunction(hashval):
+            if (part[0] in RANGE_OPERATIONS
+                    and isinstance(indexes.get(part[1]), SortedIndex)):
+                bounds.setdefault(part[1], []).append((part[0], part[2]))
+            else:
+                found.append(find(indexes, part))
+
+        for path, path_bounds in bounds.items():
+            found.append(cast(SortedIndex, indexes[path]).range(path_bounds))
+
+        found = [ids for ids in found if ids is not None]
+
+        return set.intersection(*found) if found else None
+
+    if operation == 'or':
+        found = [find(indexes, part) for part in hashval[1]]
+
+        if any(ids is None for ids in found):
+            return None
+
+        return set().union(*found)
+
+    if operation not in ('==', 'one_of', 'exists') + RANGE_OPERATIONS:
+        return None
+
+    index = indexes.get(hashval[1])
+
+    if index is None:
+        return None
+
+    if operation == 'exists':
+        return index.all()
+
+    if operation in RANGE_OPERATIONS:
+        if not isinstance(index, SortedIndex):
+            return None
+
+        return index.range([(operation, hashval[2])])
+
+    try:
+        if operation == '==':
+            return index.lookup(hashval[2])
+
+        if not isinstance(hashval[2], (tuple, frozenset)):
+            # ``one_of()`` tests the containment in other objects, like
+            # substrings
+            return None
+
+        return set().union(*(index.lookup(item) for item in hashval[2]))
+    except TypeError:
+        # The value can't be hashed
+        return None
+
+
+def _conjunction(hashval: Tuple) -> Iterator[Tuple]:
+    """
+    Iterate over the queries combined by ``&``, also nested ones.
+    """
+    for part in hashval[1]:
+        if part and part[0] == 'and':
+            yield from _conjunction(part)
+        else:
+            yield part
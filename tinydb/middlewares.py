@@ -3,6 +3,8 @@ Contains the :class:`base class <tinydb.middlewares.Middleware>` for
 middlewares and implementations.
 """
 
+from .storages import TOMBSTONE, apply_changes
+
 
 class Middleware:
     """
@@ -77,11 +79,21 @@ class CachingMiddleware(Middleware):
     This Middleware aims to improve the performance of TinyDB by writing only
     the last DB state every :attr:`WRITE_CACHE_SIZE` time and reading always
     from cache.
+
+    If the storage reads and writes single tables on its own, tables that
+    are accessed on their own are read from the storage table by table until
+    the whole database is read. Changes written to single tables are then
+    flushed to the storage table by table as well.
     """
 
     #: The number of write operations to cache before writing to disc
     WRITE_CACHE_SIZE = 1000
 
+    table_scoped = True
+
+    # Changes are collected in the cache, the storage gets the documents
+    patch_records = False
+
     def __init__(self, storage_cls):
         # Initialize the parent constructor
         super().__init__(storage_cls)
@@ -90,17 +102,84 @@ class CachingMiddleware(Middleware):
         self.cache = None
         self._cache_modified_count = 0
 
+        # The tables read on their own while the whole database isn't cached,
+        # the changes to single tables that haven't been flushed yet and
+        # whether the whole database has to be flushed
+        self._table_cache = {}
+        self._table_changes = {}
+        self._write_all = False
+
     def read(self):
         if self.cache is None:
             # Empty cache: read from the storage
             self.cache = self.storage.read()
 
+            if self._table_cache:
+                # Tables that have been cached on their own may hold
+                # changes that haven't been flushed yet
+                self.cache = dict(self.cache or {})
+                self.cache.update(self._table_cache)
+                self._table_cache = {}
+
         # Return the cached data
         return self.cache
 
+    def read_table(self, table):
+        if self.cache is not None or not self.storage.table_scoped:
+            return (self.read() or {}).get(table, {})
+
+        if table not in self._table_cache:
+            # Read only this table from the storage
+            self._table_cache[table] = dict(self.storage.read_table(table))
+
+        return self._table_cache[table]
+
+    def read_document(self, table, doc_id):
+        # Look the document up in the cached table
+        return self.read_table(table).get(doc_id)
+
+    def read_next_id(self, table):
+        # The storage doesn't know about documents that haven't been flushed
+        # yet, so the cached table has to be looked at
+        return None
+
+    def table_revision(self, table):
+        # The storage doesn't see the changes to the cached tables
+        return None
+
     def write(self, data):
         # Store data in cache
         self.cache = data
+        self._table_cache = {}
+        self._table_changes = {}
+        self._write_all = True
+        self._cache_modified_count += 1
+
+        # Check if we need to flush the cache
+        if self._cache_modified_count >= self.WRITE_CACHE_SIZE:
+            self.flush()
+
+    def write_table(self, table, documents):
+        # Apply the changes to the cached table
+        if self.cache is None and self.storage.table_scoped:
+            cached = self.read_table(table)
+        else:
+            if self.read() is None:
+                # The database is empty
+                self.cache = {}
+
+            cached = self.cache.setdefault(table, {})
+
+        apply_changes(cached, documents)
+
+        if not self._write_all:
+            # Remember the changes, so only they have to be flushed. Patch
+            # records are flushed as the documents they have been applied
+            # to, as earlier changes are overwritten.
+            self._table_changes.setdefault(table, {}).update(
+                (doc_id, cached.get(doc_id, TOMBSTONE)) for doc_id in documents
+            )
+
         self._cache_modified_count += 1
 
         # Check if we need to flush the cache
@@ -113,7 +192,14 @@ class CachingMiddleware(Middleware):
         """
         if self._cache_modified_count > 0:
             # Force-flush the cache by writing the data to the storage
-            self.storage.write(self.cache)
+            if self._write_all or not self.storage.table_scoped:
+                self.storage.write(self.read())
+            else:
+                for table, documents in self._table_changes.items():
+                    self.storage.write_table(table, documents)
+
+            self._table_changes = {}
+            self._write_all = False
             self._cache_modified_count = 0
 
     def close(self):
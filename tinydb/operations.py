@@ -6,64 +6,120 @@ They are used for updates like this:
 >>> db.update(delete('foo'), where('foo') == 2)
 
 This would delete the ``foo`` field from all documents where ``foo`` equals 2.
+
+Every operation is an :class:`Operation` object that changes a single field
+when it is called with a document. As it can be inspected, tables write it to
+log storages as a patch record instead of the whole document.
 """
 
+from typing import Any, List
+
+__all__ = ('Operation', 'delete', 'add', 'subtract', 'set', 'increment',
+           'decrement')
+
+
+class Operation:
+    """
+    An update operation changing a single field of a document.
+
+    Calling the operation with a document applies it. Fields are replaced,
+    not modified in place, so the previous value stays intact.
+
+    :param name: The name of the operation (``delete``, ``add``,
+                 ``subtract`` or ``set``)
+    :param field: The field the operation changes
+    :param value: The value the operation adds, subtracts or sets
+    """
+
+    __slots__ = ('name', 'field', 'value')
+
+    def __init__(self, name: str, field: str, value: Any = None):
+        if name not in ('delete', 'add', 'subtract', 'set'):
+            raise ValueError('Unknown operation: {!r}'.format(name))
+
+        self.name = name
+        self.field = field
+        self.value = value
+
+    def __call__(self, doc):
+        name = self.name
+
+        if name == 'add':
+            doc[self.field] = doc[self.field] + self.value
+        elif name == 'subtract':
+            doc[self.field] = doc[self.field] - self.value
+        elif name == 'set':
+            doc[self.field] = self.value
+        else:
+            del doc[self.field]
+
+    def __repr__(self):
+        if self.name == 'delete':
+            return 'Operation({!r}, {!r})'.format(self.name, self.field)
+
+        return 'Operation({!r}, {!r}, {!r})'.format(self.name, self.field, self.value)
+
+    def __eq__(self, other):
+        if not isinstance(other, Operation):
+            return NotImplemented
+
+        return (self.name, self.field, self.value) == (other.name, other.field, other.value)
+
+    __hash__ = None  # type: ignore
+
+    @property
+    def patch(self) -> List[Any]:
+        """
+        Get the operation of a patch record (see
+        :func:`tinydb.storages.make_patch`) that has the same effect.
+        """
+        if self.name == 'add':
+            return ['inc', [self.field], self.value]
+        if self.name == 'subtract':
+            return ['inc', [self.field], -self.value]
+        if self.name == 'set':
+            return ['set', [self.field], self.value]
+
+        return ['unset', [self.field]]
+
 
 def delete(field):
     """
     Delete a given field from the document.
     """
-    def transform(doc):
-        del doc[field]
-
-    return transform
+    return Operation('delete', field)
 
 
 def add(field, n):
     """
     Add ``n`` to a given field in the document.
     """
-    def transform(doc):
-        doc[field] += n
-
-    return transform
+    return Operation('add', field, n)
 
 
 def subtract(field, n):
     """
     Subtract ``n`` to a given field in the document.
     """
-    def transform(doc):
-        doc[field] -= n
-
-    return transform
+    return Operation('subtract', field, n)
 
 
 def set(field, val):
     """
     Set a given field to ``val``.
     """
-    def transform(doc):
-        doc[field] = val
-
-    return transform
+    return Operation('set', field, val)
 
 
 def increment(field):
     """
     Increment a given field in the document by 1.
     """
-    def transform(doc):
-        doc[field] += 1
-
-    return transform
+    return Operation('add', field, 1)
 
 
 def decrement(field):
     """
     Decrement a given field in the document by 1.
     """
-    def transform(doc):
-        doc[field] -= 1
-
-    return transform
+    return Operation('subtract', field, 1)
@@ -34,14 +34,36 @@ tables[val["T"] ].update( val["V"] )
 
 """
 
+import bisect
 import io
 import json
+import logging
+import marshal
+import mmap
 import os
+import pickle
+import queue
+import re
+import threading
+import time
+import weakref
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Tuple, List, Callable, BinaryIO, Iterator, Pattern, \
+    ContextManager
 
 import struct
-from functools import reduce
+import zlib
+from functools import partial, reduce
+
+try:
+    import fcntl
+except ImportError:
+    # File locking isn't available on this platform (e.g. Windows)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
 
 
 __all__ = ('Storage', 'JSONStorage', 'MemoryStorage')
@@ -66,27 +88,251 @@ def touch(path: str, create_dirs: bool):
     with open(path, 'a'):
         pass
 
-def initdb(path: str, create_dirs: bool, table: str ):
+
+#: The document that is written to a log in place of a removed document
+TOMBSTONE = {'_del': 1}
+
+
+def is_tombstone(document: Any) -> bool:
     """
-    Create a file if it doesn't exist yet.
+    Check whether a document written to a log marks a removed document.
+    """
+    return document == TOMBSTONE
 
-    :param path: The file to create.
-    :param create_dirs: Whether to create all missing parent directories.
+
+#: The key of a patch record written to a log in place of a changed document
+PATCH = '_patch'
+
+
+def is_patch(document: Any) -> bool:
     """
-    if create_dirs:
-        base_dir = os.path.dirname(path)
+    Check whether a document written to a log is a patch record.
+    """
+    return type(document) is dict and len(document) == 1 and PATCH in document
 
-        # Check if we need to create missing parent directories
-        if not os.path.exists(base_dir):
-            os.makedirs(base_dir)
 
-    # Create the file by opening it in 'a' mode which creates the file if it
-    # does not exist yet but does not modify its contents
-    if os.path.exists( path ):
+def make_patch(old: Dict[str, Any], new: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Create the patch record turning the document ``old`` into ``new``.
+
+    A patch record ``{"_patch": [[op, path, value], ...]}`` lists the
+    operations changing single fields of a document, where ``op`` is one of
+    ``set``, ``unset`` (without a value) and ``inc`` and ``path`` is the list
+    of keys leading to the field. Nested documents are patched field by field
+    as well.
+
+    :returns: the patch record or ``None`` if it doesn't have fewer
+              operations than the new document has fields
+    """
+    operations: List[List[Any]] = []
+    _diff(old, new, [], operations)
+
+    if len(operations) >= len(new):
+        return None
+
+    return {PATCH: operations}
+
+
+def _diff(old: Dict[str, Any], new: Dict[str, Any], path: List[str], operations: List[List[Any]]) -> None:
+    for key in old:
+        if key not in new:
+            operations.append(['unset', path + [key]])
+
+    for key, value in new.items():
+        if key not in old:
+            operations.append(['set', path + [key], value])
+            continue
+
+        previous = old[key]
+
+        if previous == value:
+            continue
+
+        if type(previous) is int and type(value) is int:
+            operations.append(['inc', path + [key], value - previous])
+        elif type(previous) is dict and type(value) is dict:
+            _diff(previous, value, path + [key], operations)
+        else:
+            operations.append(['set', path + [key], value])
+
+
+def apply_patch(document: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Apply a patch record to a document.
+
+    The document itself isn't modified: the patched version is a copy that
+    only copies the nested documents the patch changes.
+    """
+    document = dict(document)
+
+    for operation in patch[PATCH]:
+        op, path = operation[0], operation[1]
+        target = document
+
+        for key in path[:-1]:
+            target[key] = dict(target.get(key) or {})
+            target = target[key]
+
+        key = path[-1]
+
+        if op == 'set':
+            target[key] = operation[2]
+        elif op == 'unset':
+            target.pop(key, None)
+        elif op == 'inc':
+            target[key] = target.get(key, 0) + operation[2]
+        else:
+            raise ValueError('Unknown patch operation: {!r}'.format(op))
+
+    return document
+
+
+def apply_changes(documents: Dict[str, Any], changes: Dict[str, Any]) -> None:
+    """
+    Apply the changed documents of a table written with
+    :meth:`Storage.write_table` to the table's documents.
+    """
+    for doc_id, document in changes.items():
+        if is_tombstone(document):
+            documents.pop(doc_id, None)
+        elif is_patch(document):
+            # Patches of missing documents have nothing to apply to
+            if doc_id in documents:
+                documents[doc_id] = apply_patch(documents[doc_id], document)
+        else:
+            documents[doc_id] = document
+
+
+def table_changes(current: Dict[str, Dict[str, Any]],
+                  data: Dict[str, Dict[str, Any]]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Determine the documents to write to each table to turn the database state
+    ``current`` into ``data``.
+
+    Documents that have been removed are mapped to the :data:`TOMBSTONE`.
+
+    :returns: an iterator over the tables and their changed documents
+    """
+    for table in list(current) + [table for table in data if table not in current]:
+        documents = current.get(table, {})
+        updated = data.get(table, {})
+
+        changes = {
+            doc_id: TOMBSTONE
+            for doc_id in documents
+            if doc_id not in updated
+        }
+        changes.update(
+            (doc_id, document)
+            for doc_id, document in updated.items()
+            if documents.get(doc_id) != document
+        )
+
+        if changes:
+            yield table, changes
+
+
+def binary_mode(access_mode: str) -> str:
+    """
+    Turn a text file access mode into the matching binary access mode.
+
+    :param access_mode: mode in which the file is opened (r, r+, w, a, x, t, +)
+    """
+    if 'b' in access_mode:
+        return access_mode
+
+    return access_mode.replace('t', '') + 'b'
+
+
+def fsync_dir(path: str) -> None:
+    """
+    Make a rename of a file in a directory durable by fsyncing the directory.
+
+    This isn't supported on all platforms (e.g. Windows), where it is skipped.
+
+    :param path: A file in the directory to fsync.
+    """
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class FileLock:
+    """
+    A reader/writer lock shared by all processes accessing a database.
+
+    The lock is held on a lock file next to the database with
+    ``fcntl.flock``, so it isn't affected by the database file being
+    replaced. It is reentrant: holding it again in the same storage keeps the
+    lock, asking for the exclusive lock while holding the shared one upgrades
+    it until the inner hold ends.
+    """
+
+    def __init__(self, path: str):
+        """
+        Create a new instance.
+
+        :param path: The lock file, which is created if it doesn't exist
+        """
+        if fcntl is None:
+            raise ValueError('File locking needs fcntl, which is not available on this platform')
+
+        self.path = path
+        self._handle = open(path, 'ab')
+
+        # Whether the lock is held exclusively, for every nested hold
+        self._holds: List[bool] = []
+
+    @contextmanager
+    def hold(self, exclusive=False) -> Iterator[None]:
+        """
+        Hold the lock, waiting for other processes to release it.
+
+        :param exclusive: Whether to hold the lock exclusively or shared
+        """
+        current = self._holds[-1] if self._holds else None
+        wanted = exclusive or bool(current)
+
+        if wanted != current:
+            fcntl.flock(self._handle.fileno(), fcntl.LOCK_EX if wanted else fcntl.LOCK_SH)
+
+        self._holds.append(wanted)
+
+        try:
+            yield
+        finally:
+            self._holds.pop()
+
+            if current is None:
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_UN)
+            elif current != wanted:
+                # Return to the shared lock of the outer hold
+                fcntl.flock(self._handle.fileno(), fcntl.LOCK_SH)
+
+    def close(self) -> None:
+        self._handle.close()
+
+
+@contextmanager
+def locked(lock: Optional[FileLock], exclusive=False) -> Iterator[None]:
+    """
+    Hold a lock if there is one.
+    """
+    if lock is None:
+        yield
         return
-    with open(path, 'w') as f:
-        f.write( table )
-        f.write( '\0'*( 500-len(table) ) )
+
+    with lock.hold(exclusive):
+        yield
+
 
 class Storage(ABC):
     """
@@ -94,8 +340,25 @@ class Storage(ABC):
 
     A Storage (de)serializes the current state of the database and stores it in
     some place (memory, file on disk, ...).
+
+    Storages that can read and write single tables without touching the rest
+    of the database override :meth:`read_table` and :meth:`write_table` and
+    set :attr:`table_scoped`. Tables then use these methods to read and
+    update their data. Otherwise tables read and write the whole database.
     """
 
+    #: Whether reading and writing a single table is cheaper than reading and
+    #: writing the whole database
+    table_scoped = False
+
+    #: Whether other processes may access the storage at the same time,
+    #: see :meth:`exclusive`
+    locking = False
+
+    #: Whether tables should write changed documents as patch records (see
+    #: :func:`make_patch`) as they are cheaper to store than the documents
+    patch_records = False
+
     # Using ABCMeta as metaclass allows instantiating only storages that have
     # implemented read and write
 
@@ -112,41 +375,113 @@ class Storage(ABC):
         raise NotImplementedError('To be overridden!')
 
     @abstractmethod
-    def read(self, table: str ) -> Optional[Dict[str, Dict[str, Any]]]:
+    def write(self, data: Dict[str, Dict[str, Any]]) -> None:
         """
-        Read the current state.
+        Write the current state of the database to the storage.
 
-        Any kind of deserialization should go here.
+        Any kind of serialization should go here.
 
-        Return ``None`` here to indicate that the storage is empty.
+        :param data: The current state of the database.
         """
 
         raise NotImplementedError('To be overridden!')
 
+    def read_table(self, table: str) -> Dict[str, Any]:
+        """
+        Read the documents of a single table.
 
-    @abstractmethod
-    def write(self, data: Dict[str, Dict[str, Any]]) -> None:
+        Storages that can read a table without reading the whole database
+        should override this.
+
+        :param table: The name of the table.
+        :returns: the documents by their ID, empty if the table doesn't exist
         """
-        Write the current state of the database to the storage.
 
-        Any kind of serialization should go here.
+        tables = self.read()
 
-        :param data: The current state of the database.
+        if tables is None:
+            return {}
+
+        return tables.get(table, {})
+
+    def write_table(self, table: str, documents: Dict[str, Any]) -> None:
         """
+        Write the changed documents of a single table.
 
-        raise NotImplementedError('To be overridden!')
+        Storages that can write a table without rewriting the whole database
+        should override this.
 
-    @abstractmethod
-    def write(self, table: str, data: Dict[str, Dict[str, Any]]) -> None:
+        :param table: The name of the table.
+        :param documents: The changed documents by their ID. Removed
+                          documents are mapped to the :data:`TOMBSTONE`,
+                          changed documents may be patch records.
         """
-        Write the current state of the database to the storage.
 
-        Any kind of serialization should go here.
+        tables = self.read() or {}
 
-        :param data: The current state of the database.
+        apply_changes(tables.setdefault(table, {}), documents)
+
+        self.write(tables)
+
+    def read_document(self, table: str, doc_id: str) -> Optional[Dict[str, Any]]:
         """
+        Read a single document.
 
-        raise NotImplementedError('To be overridden!')
+        Storages that can look up a document without reading the whole
+        table should override this.
+
+        Return ``None`` here to indicate that the document doesn't exist.
+
+        :param table: The name of the document's table.
+        :param doc_id: The document's ID.
+        """
+
+        return self.read_table(table).get(doc_id)
+
+    def read_next_id(self, table: str) -> Optional[int]:
+        """
+        Read the ID to give the next document inserted into a table.
+
+        Storages that keep track of the largest numeric document ID of each
+        table override this, so tables don't have to look at all document
+        IDs to find it.
+
+        Return ``None`` here to indicate that the next ID isn't known.
+
+        :param table: The name of the table.
+        """
+
+        return None
+
+    def table_revision(self, table: str) -> Optional[int]:
+        """
+        Get the revision of a table, a number that is incremented whenever
+        changes are applied to the table, once per :meth:`write_table` call.
+
+        Tables use it to tell whether the table has been changed by anyone
+        else since their last update, so they can keep the documents keyed by
+        their document ID class in between updates.
+
+        Return ``None`` here to indicate that the revisions aren't tracked.
+
+        :param table: The name of the table.
+        """
+
+        return None
+
+    def exclusive(self) -> ContextManager[None]:
+        """
+        Keep other processes from accessing the storage.
+
+        Tables hold this while reading a table, giving new documents their
+        IDs and writing the changes, so processes sharing the storage (see
+        :attr:`locking`) neither hand out the same IDs nor overwrite each
+        other's changes. Reads and writes may be nested inside.
+
+        Storages that can be shared with other processes override this.
+        """
+
+        return locked(None)
 
     def close(self) -> None:
         """
@@ -159,9 +494,12 @@ class Storage(ABC):
 class JSONStorage(Storage):
     """
     Store the data in a JSON file.
+
+    With ``locking=True``, reads hold a shared and writes an exclusive
+    :class:`FileLock`, so several processes can use the same file.
     """
 
-    def __init__(self, path: str, create_dirs=False, encoding=None, access_mode='r+', **kwargs):
+    def __init__(self, path: str, create_dirs=False, encoding=None, access_mode='r+', locking=False, **kwargs):
         """
         Create a new instance.
 
@@ -170,6 +508,8 @@ class JSONStorage(Storage):
         :param path: Where to store the JSON data.
         :param access_mode: mode in which the file is opened (r, r+, w, a, x, b, t, +, U)
         :type access_mode: str
+        :param locking: Whether to coordinate access with other processes
+                        using a lock file (``path`` + ``.lock``)
         """
 
         super().__init__()
@@ -182,260 +522,2411 @@ class JSONStorage(Storage):
         if any([character in self._mode for character in ('+', 'w', 'a')]):  # any of the writing modes
             touch(path, create_dirs=create_dirs)
 
+        self._lock = FileLock(path + '.lock') if locking else None
+        self.locking = locking
+
         # Open the file for reading/writing
         self._handle = open(path, mode=self._mode, encoding=encoding)
 
     def close(self) -> None:
         self._handle.close()
 
+        if self._lock is not None:
+            self._lock.close()
+
+    def exclusive(self) -> ContextManager[None]:
+        return locked(self._lock, exclusive=True)
+
     def read(self) -> Optional[Dict[str, Dict[str, Any]]]:
-        # Get the file size by moving the cursor to the file end and reading
-        # its location
-        self._handle.seek(0, os.SEEK_END)
-        size = self._handle.tell()
+        with locked(self._lock):
+            # Get the file size by moving the cursor to the file end and
+            # reading its location
+            self._handle.seek(0, os.SEEK_END)
+            size = self._handle.tell()
+
+            if not size:
+                # File is empty, so we return ``None`` so TinyDB can properly
+                # initialize the database
+                return None
+            else:
+                # Return the cursor to the beginning of the file
+                self._handle.seek(0)
+
+                # Load the JSON contents of the file
+                return json.load(self._handle)
+
+    def write(self, data: Dict[str, Dict[str, Any]]):
+        # Serialize the database state using the user-provided arguments
+        serialized = json.dumps(data, **self.kwargs)
+
+        with locked(self._lock, exclusive=True):
+            # Move the cursor to the beginning of the file just in case
+            self._handle.seek(0)
+
+            # Write the serialized data to the file
+            try:
+                self._handle.write(serialized)
+            except io.UnsupportedOperation:
+                raise IOError('Cannot write to the database. Access mode is "{0}"'.format(self._mode))
+
+            # Ensure the file has been written
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+
+            # Remove data that is behind the new cursor in case the file has
+            # gotten shorter
+            self._handle.truncate()
+
+
+class Codec(ABC):
+    """
+    The interface of the codecs serializing the documents of the log
+    storages.
+
+    A codec turns a JSON-like value into ``bytes`` and back. Codecs are
+    created once per storage and reused for every record.
+    """
+
+    #: Whether the encoded values may contain arbitrary bytes including line
+    #: breaks, so they can't be stored in a line-based log
+    binary = False
+
+    @abstractmethod
+    def encode(self, value: Any) -> bytes:
+        """
+        Serialize a value.
+        """
+
+        raise NotImplementedError('To be overridden!')
+
+    @abstractmethod
+    def decode(self, data: bytes) -> Any:
+        """
+        Deserialize a value.
+        """
+
+        raise NotImplementedError('To be overridden!')
+
+
+class JSONCodec(Codec):
+    """
+    Serialize values to compact JSON.
+
+    The encoder and decoder are created once. The arguments are those of
+    ``json.dumps()``. Unless overridden by ``separators``, no whitespace is
+    written after separators.
+    """
+
+    def __init__(self, encoding='utf-8', **kwargs):
+        """
+        Create a new instance.
+
+        :param encoding: The text encoding of the serialized JSON
+        """
+        self.encoding = encoding
+        self.kwargs = kwargs
+
+        options = dict(kwargs)
+        encoder_cls = options.pop('cls', json.JSONEncoder)
+        options.setdefault('separators', (',', ':'))
+
+        self._encoder = encoder_cls(**options)
+        self._decoder = json.JSONDecoder()
+
+    def __reduce__(self):
+        # The decoder can't be pickled, so the codec is created anew when
+        # sending it to a worker process
+        return partial(self.__class__, self.encoding, **self.kwargs), ()
+
+    def encode(self, value: Any) -> bytes:
+        return self._encoder.encode(value).encode(self.encoding)
+
+    def decode(self, data: bytes) -> Any:
+        return self._decoder.decode(data.decode(self.encoding))
+
+
+class MarshalCodec(Codec):
+    """
+    Serialize values with :mod:`marshal`.
+
+    Marshal is the fastest codec for plain ``dict``/``list``/``str``/number
+    values, but its format may change between Python versions. Only use it
+    for logs written and read by the same Python version and never for data
+    from untrusted sources.
+    """
+
+    binary = True
+
+    def encode(self, value: Any) -> bytes:
+        return marshal.dumps(value)
+
+    def decode(self, data: bytes) -> Any:
+        return marshal.loads(data)
+
+
+class PickleCodec(Codec):
+    """
+    Serialize values with :mod:`pickle`.
+
+    Unpickling data can execute arbitrary code, so only use this codec for
+    data from trusted sources.
+    """
+
+    binary = True
+
+    def __init__(self, protocol=pickle.HIGHEST_PROTOCOL):
+        """
+        Create a new instance.
+
+        :param protocol: The pickle protocol to write
+        """
+        self.protocol = protocol
+
+    def encode(self, value: Any) -> bytes:
+        return pickle.dumps(value, self.protocol)
+
+    def decode(self, data: bytes) -> Any:
+        return pickle.loads(data)
+
+
+#: Durability modes of the log storages: fsync after every write, after a
+#: time interval, after a number of records or only when closing the storage
+FSYNC_EVERY_WRITE = 'fsync_every_write'
+FSYNC_EVERY_N_MS = 'fsync_every_n_ms'
+FSYNC_EVERY_N_RECORDS = 'fsync_every_n_records'
+FSYNC_ON_CLOSE = 'fsync_on_close'
+
+DURABILITY_MODES = (FSYNC_EVERY_WRITE, FSYNC_EVERY_N_MS, FSYNC_EVERY_N_RECORDS,
+                    FSYNC_ON_CLOSE)
+
+
+class GroupCommitWriter:
+    """
+    Append frames to a log file in group commits.
+
+    Frames are collected until the durability mode asks for a commit. Then
+    all pending frames are written with a single write and made durable with
+    a single fsync.
+
+    With ``fsync_every_n_ms``, a timer commits the pending frames once the
+    interval has passed, even if no further frame is appended. Frames that
+    are still pending are committed by :meth:`commit`, e.g. when the storage
+    is read from or closed.
+    """
+
+    def __init__(
+        self,
+        handle: BinaryIO,
+        durability: str = FSYNC_EVERY_WRITE,
+        interval: float = 100,
+        records: int = 100,
+        on_commit: Optional[Callable[[int], None]] = None
+    ):
+        """
+        Create a new instance.
+
+        :param handle: The binary file handle of the log
+        :param durability: One of the ``DURABILITY_MODES``
+        :param interval: The commit interval in milliseconds for
+                         ``fsync_every_n_ms``
+        :param records: The number of records per commit for
+                        ``fsync_every_n_records``
+        :param on_commit: Called with the number of records each commit
+                          covered, from the timer thread for commits
+                          after an interval
+        """
+        if durability not in DURABILITY_MODES:
+            raise ValueError('Unknown durability mode: {!r}'.format(durability))
+
+        self.handle = handle
+        self.durability = durability
+        self.interval = interval
+        self.records = records
+        self.on_commit = on_commit
+
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+        self._last_commit = time.monotonic()
+
+        # The timer committing the pending frames after the interval and
+        # the lock keeping it from committing while frames are appended
+        self._timer: Optional[threading.Timer] = None
+        self._commit_lock = threading.RLock()
+        self._error: Optional[BaseException] = None
+
+    @property
+    def pending(self) -> int:
+        """
+        Get the number of records that haven't been committed yet.
+        """
+        return len(self._pending)
+
+    @property
+    def pending_size(self) -> int:
+        """
+        Get the number of bytes that haven't been committed yet.
+        """
+        return self._pending_size
+
+    @property
+    def failure(self) -> Optional[BaseException]:
+        """
+        Get the error that keeps the writer from writing any more frames.
+        """
+        return None
+
+    def append(self, frame: bytes) -> None:
+        """
+        Append a frame and commit if the durability mode asks for it.
+        """
+        with self._commit_lock:
+            self._pending.append(frame)
+            self._pending_size += len(frame)
+
+            if self._commit_due():
+                self.commit()
+            elif self.durability == FSYNC_EVERY_N_MS and self._timer is None:
+                # Commit the frame once the interval has passed, even if no
+                # other frame is appended until then
+                elapsed = (time.monotonic() - self._last_commit) * 1000
+                self._timer = threading.Timer(max(self.interval - elapsed, 0) / 1000,
+                                              self._commit_expired)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def commit(self) -> int:
+        """
+        Write all pending frames and fsync them.
+
+        :returns: the number of records the commit covered
+        """
+        with self._commit_lock:
+            if self._error is not None:
+                # Report the failure of a commit by the timer to the caller
+                # at least once. The frames are still pending and are written
+                # by the next commit.
+                error, self._error = self._error, None
+                raise error
+
+            return self._commit()
+
+    def _commit(self) -> int:
+        self._cancel_timer()
+
+        if not self._pending:
+            return 0
+
+        # Move the cursor to the end of the file as we only ever append
+        self.handle.seek(0, os.SEEK_END)
+        self.handle.write(b''.join(self._pending))
+
+        # Ensure the file has been written
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+
+        records = len(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        self._last_commit = time.monotonic()
+
+        if self.on_commit is not None:
+            self.on_commit(records)
+
+        return records
+
+    def _commit_due(self) -> bool:
+        if self.durability == FSYNC_EVERY_WRITE:
+            return True
+
+        if self.durability == FSYNC_EVERY_N_RECORDS:
+            return len(self._pending) >= self.records
+
+        if self.durability == FSYNC_EVERY_N_MS:
+            elapsed = (time.monotonic() - self._last_commit) * 1000
+            return elapsed >= self.interval
+
+        return False
+
+    def _commit_expired(self) -> None:
+        with self._commit_lock:
+            self._timer = None
+
+            try:
+                self._commit()
+            except BaseException as e:
+                self._error = e
+
+    def _cancel_timer(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def close(self) -> None:
+        """
+        Stop writing frames. Pending frames have to be committed before.
+        """
+        with self._commit_lock:
+            self._cancel_timer()
+
+
+class BackgroundWriter(GroupCommitWriter):
+    """
+    Append frames to a log file from a background thread.
+
+    Frames are put on a bounded queue, so appending blocks once the writer
+    thread has fallen ``queue_size`` frames behind. The thread drains the
+    queue and commits all frames it has found with a single write and a
+    single fsync, whatever the durability mode. Every appended frame gets a
+    future that resolves to ``None`` once the frame is durable.
+
+    Once a commit has failed, the log may be missing the failed frames, so
+    no frames are written after them. The frames still queued fail and
+    appending and committing raise the error, until the log is reopened.
+    """
+
+    def __init__(
+        self,
+        handle: BinaryIO,
+        queue_size: int,
+        on_commit: Optional[Callable[[int], None]] = None
+    ):
+        """
+        Create a new instance and start the writer thread.
+
+        :param handle: The binary file handle of the log
+        :param queue_size: The number of frames that can be queued
+        :param on_commit: Called with the number of records each commit
+                          covered
+        """
+        super().__init__(handle, on_commit=on_commit)
+
+        self._queue: queue.Queue = queue.Queue(queue_size)
+        self._queued_size = 0
+        self._size_lock = threading.Lock()
+
+        # The error of the commit that has failed
+        self._failure: Optional[BaseException] = None
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.unfinished_tasks
+
+    @property
+    def pending_size(self) -> int:
+        return self._queued_size
+
+    @property
+    def failure(self) -> Optional[BaseException]:
+        return self._failure
+
+    def append(self, frame: bytes) -> Future:
+        """
+        Queue a frame, waiting for the writer thread if the queue is full.
+
+        :returns: a future that resolves once the frame is durable
+        :raises: the error of a failed commit
+        """
+        if self._failure is not None:
+            raise self._failure
+
+        future: Future = Future()
+
+        with self._size_lock:
+            self._queued_size += len(frame)
+
+        self._queue.put((frame, future))
+
+        return future
+
+    def commit(self) -> int:
+        """
+        Wait until all queued frames are durable.
+
+        :returns: the number of records that have been waited for
+        """
+        records = self.pending
+        self._queue.join()
+
+        if self._failure is not None:
+            raise self._failure
+
+        return records
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+
+            # Take everything that has been queued in the meantime
+            while batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            frames = [item for item in batch if item is not None]
+
+            try:
+                if self._failure is not None:
+                    # Frames written after the failed ones would leave a gap
+                    # in the log
+                    raise self._failure
+
+                for frame, _ in frames:
+                    self._pending.append(frame)
+                self._commit()
+            except BaseException as e:
+                self._pending = []
+                self._failure = e
+
+                for _, future in frames:
+                    future.set_exception(e)
+            else:
+                for _, future in frames:
+                    future.set_result(None)
+            finally:
+                with self._size_lock:
+                    self._queued_size -= sum(len(frame) for frame, _ in frames)
+
+                for _ in batch:
+                    self._queue.task_done()
+
+            if batch[-1] is None:
+                return
+
+
+#: The header of a snapshot record: the length of the serialized document
+SNAPSHOT_RECORD = struct.Struct('<I')
+
+
+class LogStorage(Storage):
+    """
+    The base class for storages that append every write as a frame to a log
+    file.
+
+    Every frame is written on a line of its own. The documents replayed from
+    the log are retained in memory together with the byte offset up to which
+    the log has been replayed, so ``read()`` only has to parse the frames
+    that have been appended since the last read.
+
+    With ``materialize=True`` the retained tables become authoritative: every
+    ``write()`` is applied to them directly and ``read()`` returns them
+    without touching the disk once the log has been replayed. Only use this
+    mode if no other storage instance appends to the same file.
+
+    Frames are appended through a :class:`GroupCommitWriter`. The
+    ``durability`` setting decides how many frames share one write and one
+    fsync; anything but ``fsync_every_write`` may lose the last commits on a
+    crash. Combine it with ``materialize=True``, as otherwise every read has
+    to commit the pending frames first to be able to replay them.
+
+    Removing a document writes the :data:`TOMBSTONE` ``{"_del": 1}`` in its
+    place. Replaying a tombstone evicts the document from the tables, so
+    removed documents neither take up memory nor show up in reads.
+
+    Changed documents can be written as patch records (see
+    :func:`make_patch`) that only hold the changed fields. Replaying a patch
+    applies it to the previous version of the document. Compacting the log
+    writes the patched documents in full again, so only the patched document
+    counts as live and the patches as garbage. With ``keydir=True`` a
+    document is written in full instead of as a patch once reading it would
+    take more than ``max_patch_chain`` frames.
+
+    The storage keeps a keydir that maps every live document to the offset
+    and length of the frame holding its current version. With
+    ``keydir=True`` only the keydir is kept in memory instead of the
+    documents: reading a single document with :meth:`read_document` then
+    costs one positioned read and decoding one frame. The keydir is saved to
+    a hint file when closing the storage and loaded from it when opening the
+    storage again, so only the part of the log written after the hint has to
+    be replayed.
+
+    With ``use_mmap=True`` the log is memory-mapped for replaying instead of
+    being read into memory. Frames are then scanned and decoded directly from
+    the mapped file one by one, so replaying a large log doesn't need a copy
+    of it in memory.
+
+    Superseded frames and tombstones stay in the log until it is compacted
+    with :meth:`compact`. If ``compact_threshold`` is set, the log is
+    compacted automatically as soon as the share of dead bytes exceeds it and
+    the log is at least ``compact_min_size`` bytes large.
+
+    With ``segment_size`` set, the log is split into numbered segment files
+    (e.g. ``db.json.000001``) instead of a single file. Writes go to the last
+    segment, which is sealed as soon as it has grown to ``segment_size``
+    bytes and replaced by a new one. Sealed segments are never written to
+    again. A manifest next to them (e.g. ``db.json.manifest``) lists the
+    segments in order. Offsets in the log refer to the segments laid out one
+    after another, each starting with its own header. An existing log that
+    hasn't been segmented yet is continued as the first segment.
+
+    A checkpoint (:meth:`checkpoint`) saves the replayed documents together
+    with the log offset they cover to a snapshot file (e.g.
+    ``db.json.snapshot``). Opening the storage loads the snapshot and only
+    replays the log written after it. The snapshot is written by a
+    background thread, so writers only wait for the replayed state to be
+    copied. Set ``checkpoint_interval`` or ``checkpoint_bytes`` to checkpoint
+    automatically after that many seconds or bytes of log. The interval is
+    checked by a timer thread, so a log that has been written to is
+    checkpointed even if no more writes follow. With ``keydir=True`` the hint
+    file serves as the snapshot.
+
+    The storage keeps track of the ID following the largest numeric document
+    ID added to each table since it has last been empty, see
+    :meth:`read_next_id`. It is saved to the snapshot and the hint file
+    together with the documents.
+
+    Documents are serialized by a :class:`Codec`, by default a
+    :class:`JSONCodec` created from the JSON arguments passed to the storage.
+    """
+
+    table_scoped = True
+
+    patch_records = True
+
+    #: Whether the frames are JSON lines, which requires a :class:`JSONCodec`
+    json_frames = True
+
+    #: The size of the meta header at the beginning of the log file
+    header_size = 0
+
+    #: The suffix of the temporary file the log is compacted to
+    compact_suffix = '.compact'
+
+    #: The suffix of the file the keydir is saved to
+    hint_suffix = '.hint'
+
+    #: The suffix of the manifest listing the segments of a segmented log
+    manifest_suffix = '.manifest'
+
+    #: The suffix of the file the documents are saved to by a checkpoint
+    snapshot_suffix = '.snapshot'
+
+    #: The number of patches after which a document is written in full again
+    #: with ``keydir=True``
+    max_patch_chain = 16
+
+    def __init__(self, path: str, create_dirs=False, encoding=None, access_mode='r+', materialize=False,
+                 durability=FSYNC_EVERY_WRITE, sync_interval=100, sync_records=100, on_commit=None,
+                 compact_threshold=None, compact_min_size=1024 * 1024, keydir=False, use_mmap=False,
+                 segment_size=None, checkpoint_interval=None, checkpoint_bytes=None, write_queue_size=None,
+                 codec=None, locking=False, **kwargs):
+        """
+        Create a new instance.
+
+        Also creates the storage file, if it doesn't exist and the access mode is appropriate for writing.
+
+        :param path: Where to store the JSON data.
+        :param access_mode: mode in which the file is opened (r, r+, w, a, x, b, t, +, U)
+        :type access_mode: str
+        :param materialize: Whether to keep the tables in memory and apply
+                            writes to them instead of replaying the log
+        :param durability: When to fsync written frames, one of
+                           ``DURABILITY_MODES``
+        :param sync_interval: The commit interval in milliseconds for
+                              ``fsync_every_n_ms``
+        :param sync_records: The number of records per commit for
+                             ``fsync_every_n_records``
+        :param on_commit: Called with the number of records of every commit
+        :param compact_threshold: The garbage ratio above which the log is
+                                  compacted automatically, ``None`` disables
+                                  automatic compaction
+        :param compact_min_size: The minimum log size in bytes for automatic
+                                 compaction
+        :param keydir: Whether to keep only the keydir in memory and read
+                       documents from the log on demand
+        :param use_mmap: Whether to replay the log from a memory map
+        :param segment_size: The size in bytes at which a log segment is
+                             sealed, ``None`` stores the log in a single file
+        :param checkpoint_interval: The time in seconds after which a
+                                    checkpoint is started if the log has
+                                    been written to
+        :param checkpoint_bytes: The number of bytes written to the log after
+                                 which a checkpoint is started
+        :param write_queue_size: The number of frames that can be queued for a
+                                 background writer thread, ``None`` writes
+                                 them in the calling thread
+        :param codec: The :class:`Codec` serializing the documents
+        :param locking: Whether to coordinate access with other processes
+                        using a lock file (``path`` + ``.lock``)
+        """
+
+        super().__init__()
+
+        if kwargs.get('indent') is not None:
+            raise ValueError('Log frames have to be written on a single line, '
+                             'indent is not supported')
+
+        if locking and write_queue_size is not None:
+            raise ValueError('A background writer can\'t hold the lock of '
+                             'the database, locking is not supported')
+
+        self._mode = access_mode
+        self._encoding = encoding or 'utf-8'
+        self.kwargs = kwargs
+
+        if codec is None:
+            codec = JSONCodec(self._encoding, **kwargs)
+        elif self.json_frames and not isinstance(codec, JSONCodec):
+            raise ValueError('{} writes JSON lines and needs a JSONCodec'.format(type(self).__name__))
+
+        self.codec = codec
+        self.path = path
+        self.materialize = materialize
+        self.compact_threshold = compact_threshold
+        self.compact_min_size = compact_min_size
+        self.keydir = keydir
+        self.use_mmap = use_mmap
+        self.segment_size = segment_size
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_bytes = checkpoint_bytes
+
+        # The documents replayed from the log so far and the byte offset up
+        # to which the log has been replayed
+        self._tables: Dict[str, Dict[str, Any]] = {}
+        self._offset = self.header_size
+        self._replayed = False
+
+        # The offsets up to which single tables have been replayed ahead of
+        # the rest of the log
+        self._table_offsets: Dict[str, int] = {}
+
+        # The offset and length of the frame holding the current version of
+        # each document and the share of the frame the document takes up.
+        # The sum of the shares is used to calculate the garbage ratio.
+        self._keydir: Dict[str, Dict[str, Tuple[int, int, int]]] = {}
+        self._live_bytes = 0
+
+        # The number of bytes of the frames applied to the tables and the
+        # keydir so far, the frames of single tables replayed ahead of the
+        # rest of the log included
+        self._applied_bytes = 0
+
+        # With keydir=True, the offsets and lengths of the frames a patched
+        # document is replayed from before its keydir entry, starting with
+        # the frame holding it in full. The shares of all these frames are
+        # accounted to the keydir entry, as they are all live.
+        self._chains: Dict[str, Dict[str, List[Tuple[int, int]]]] = {}
+
+        # The ID following the largest numeric document ID of each table
+        self._next_ids: Dict[str, int] = {}
+
+        # The number of times frames have been applied to each table, see
+        # table_revision(). They are never reset, so a table's revision
+        # can't be repeated with different contents.
+        self._revisions: Dict[str, int] = {}
+
+        # The files the log consists of, the offset each of them starts at
+        # and the read handles of the sealed segments
+        self._segments = [path]
+        self._bases = [0]
+        self._sealed: Dict[str, BinaryIO] = {}
+        self._manifest_stat: Optional[Tuple[int, int, int]] = None
+
+        # The background thread writing the latest checkpoint and what has
+        # been written since it was started
+        self._checkpoint_thread: Optional[threading.Thread] = None
+        self._checkpoint_timer: Optional[threading.Timer] = None
+        self._last_checkpoint = time.monotonic()
+        self._written = 0
+
+        writable = any([character in self._mode for character in ('+', 'w', 'a')])  # any of the writing modes
+
+        self._lock: Optional[FileLock] = None
+        if locking:
+            touch(path + '.lock', create_dirs=create_dirs)
+            self._lock = FileLock(path + '.lock')
+        self.locking = locking
+
+        # Serializes the caller and the timer taking checkpoints by time,
+        # the only other thread using the storage
+        self._mutex = threading.RLock() if writable and checkpoint_interval is not None else None
+
+        if self.segment_size is not None:
+            if writable and not os.path.exists(self._manifest_path()):
+                if os.path.exists(path):
+                    # Continue an unsegmented log as the first segment
+                    self._save_manifest([path])
+                else:
+                    # Start a new segmented log
+                    self._create(self._segment_path(1), create_dirs)
+                    self._save_manifest([self._segment_path(1)])
+
+            # Without a manifest, the log hasn't been segmented yet
+            if os.path.exists(self._manifest_path()):
+                self._segments = self._read_manifest()
+                self._bases = self._segment_bases(self._segments)
+
+        # Create the file if it doesn't exist and creating is allowed by the
+        # access mode
+        if writable:
+            self._create(self._segments[-1], create_dirs)
+
+        # Open the file for reading/writing. The log is accessed in binary
+        # mode so file positions are real byte offsets.
+        self._handle = open(self._segments[-1], mode=binary_mode(self._mode))
+        self._writer: GroupCommitWriter
+
+        if write_queue_size is None or not writable:
+            self._writer = GroupCommitWriter(self._handle, durability,
+                                             sync_interval, sync_records,
+                                             on_commit)
+        else:
+            self._writer = BackgroundWriter(self._handle, write_queue_size,
+                                            on_commit)
+
+        if self.keydir:
+            self._load_hint()
+        else:
+            self._load_snapshot()
+
+        # Binary logs are recovered once their header has been read
+        if writable and self.json_frames:
+            with locked(self._lock, exclusive=True):
+                self._recover_tail()
+
+        if writable and checkpoint_interval is not None:
+            self._schedule_checkpoint(checkpoint_interval)
+
+    def close(self) -> None:
+        with self._serialized():
+            if self._checkpoint_timer is not None:
+                self._checkpoint_timer.cancel()
+                self._checkpoint_timer = None
+
+            self._close()
+
+    def _close(self) -> None:
+        try:
+            # Commit the frames that are still pending and let a running
+            # checkpoint finish
+            self.flush()
+            self._join_checkpoint()
+
+            # The keydir isn't saved if frames have failed to be written
+            if self.keydir and self._handle.writable():
+                self._save_hint(os.fstat(self._handle.fileno()).st_ino, self._offset, self._keydir,
+                                self._chains, self._next_ids)
+        finally:
+            self._writer.close()
+            self._close_sealed()
+            self._handle.close()
+
+            if self._lock is not None:
+                self._lock.close()
+
+    def flush(self) -> None:
+        """
+        Commit all pending frames to disk.
+        """
+        self._writer.commit()
+
+    @property
+    def garbage_ratio(self) -> float:
+        """
+        Get the share of the replayed log bytes that are taken up by
+        superseded frames and tombstones.
+        """
+        total = self._applied_bytes
+
+        if total <= 0:
+            return 0.0
+
+        return 1 - self._live_bytes / total
+
+    def read(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        with self._serialized(), locked(self._lock):
+            self._catch_up()
+
+            if self._offset <= self.header_size:
+                # File is empty, so we return ``None`` so TinyDB can properly
+                # initialize the database
+                return None
+
+            # Tables whose documents have all been removed don't exist
+            # anymore
+            return {
+                table: self._documents(table)
+                for table, entries in self._keydir.items()
+                if entries
+            }
+
+    def read_table(self, table: str) -> Dict[str, Any]:
+        with self._serialized(), locked(self._lock):
+            # Only the frames of the table are needed
+            self._catch_up(table)
+
+            return self._documents(table)
+
+    def _catch_up(self, table: Optional[str] = None) -> None:
+        """
+        Replay the frames that have been appended to the log since the last
+        replay if they may be missing from the tables.
+        """
+        if self._writer.failure is not None:
+            # The tables may contain writes that are missing from the log
+            raise self._writer.failure
+
+        # Once the log has been replayed, the materialized tables already
+        # contain every write, unless other processes write to the log
+        if not (self.materialize and self._replayed) or self._lock is not None:
+            self._replay_tail(table)
+
+    def _documents(self, table: str) -> Dict[str, Any]:
+        """
+        Get the replayed documents of a table.
+        """
+        if self.keydir:
+            # Documents written in a batch share their frame, which is only
+            # decoded once
+            frames: Dict[int, Dict[str, Any]] = {}
+
+            return {
+                doc_id: self._read_frame(table, doc_id, entry, frames)
+                for doc_id, entry in self._keydir.get(table, {}).items()
+            }
+
+        return self._tables.get(table, {})
+
+    def read_document(self, table: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        with self._serialized(), locked(self._lock):
+            self._catch_up(table)
+
+            if not self.keydir:
+                return self._tables.get(table, {}).get(doc_id)
+
+            entry = self._keydir.get(table, {}).get(doc_id)
+
+            if entry is None:
+                return None
+
+            return self._read_frame(table, doc_id, entry)
+
+    def read_next_id(self, table: str) -> Optional[int]:
+        with self._serialized(), locked(self._lock):
+            self._catch_up(table)
+
+            return self._next_ids.get(table, 1)
+
+    def table_revision(self, table: str) -> Optional[int]:
+        return self._revisions.get(table, 0)
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        with self._serialized(), locked(self._lock, exclusive=True):
+            yield
+
+    def write(self, data: Dict[str, Dict[str, Any]]):
+        # Append the documents that differ from the current state, so the
+        # log doesn't have to be rewritten
+        for table, documents in table_changes(self.read() or {}, data):
+            self.write_table(table, documents)
+
+    def write_table(self, table: str, documents: Dict[str, Any]) -> Optional[Future]:
+        """
+        Append the documents of a table to the log.
+
+        :returns: the future of the frame if it is written by a background
+                  writer, see :class:`BackgroundWriter`
+        """
+        with self._serialized(), locked(self._lock, exclusive=True):
+            if self._lock is not None:
+                # Other processes may have appended to the log or replaced it
+                # since we've last looked at it
+                if self.materialize:
+                    self._replay_tail()
+                else:
+                    self._follow_log()
+
+            return self._append(table, documents)
+
+    def _append(self, table: str, documents: Dict[str, Any]) -> Optional[Future]:
+        """
+        Append a frame holding the documents of a table to the log.
+        """
+        if self.materialize and not self._replayed:
+            # Load the existing state first, so it can be kept up to date
+            # from now on
+            self._replay_tail()
+
+        if not self._handle.writable():
+            raise IOError('Cannot write to the database. Access mode is "{0}"'.format(self._mode))
+
+        if self.keydir:
+            documents = self._fold_patches(table, documents)
+
+        frame = self._encode(table, documents)
+
+        # Hand the serialized frame to the group commit writer
+        future = self._writer.append(frame)
+        self._written += len(frame)
+
+        if self._lock is not None:
+            # The lock isn't held between writes, so the frame can't wait for
+            # a group commit
+            self.flush()
+
+        if self.materialize:
+            # Apply the write to the materialized tables and skip the frame
+            # we've just written when replaying
+            self._apply(table, documents, self._offset, len(frame))
+            self._offset += len(frame)
+
+        if self._compaction_due():
+            self.compact()
+        elif self._rollover_due():
+            self._roll_over()
+
+        if self._checkpoint_due():
+            self.checkpoint(wait=False)
+
+        return future
+
+    def compact(self) -> None:
+        """
+        Rewrite the log so it only contains the current version of every
+        live document.
+
+        The live documents are written to a new file which then atomically
+        replaces the log, so a crash during compaction leaves the old log
+        intact. A segmented log is compacted into a new segment which
+        replaces all other segments in the manifest.
+        """
+        with self._serialized(), locked(self._lock, exclusive=True):
+            self._compact()
+
+    def _compact(self) -> None:
+        if not self._handle.writable():
+            raise IOError('Cannot compact the database. Access mode is "{0}"'.format(self._mode))
+
+        # Make sure the retained tables are complete
+        self._join_checkpoint()
+        self._replay_tail()
+
+        if self.segment_size is None:
+            compact_path = self.path + self.compact_suffix
+        else:
+            compact_path = self._segment_path(self._segment_number(self._segments[-1]) + 1)
+
+        keydir: Dict[str, Dict[str, Tuple[int, int, int]]] = {}
+
+        with open(compact_path, 'wb') as f:
+            f.write(self._header())
+
+            for table, entries in self._keydir.items():
+                table_keydir = keydir.setdefault(table, {})
+                frames: Dict[int, Dict[str, Any]] = {}
+
+                for doc_id, entry in entries.items():
+                    if self.keydir:
+                        document = self._read_frame(table, doc_id, entry, frames)
+                    else:
+                        document = self._tables[table][doc_id]
+
+                    frame = self._encode(table, {doc_id: document})
+                    table_keydir[doc_id] = (f.tell(), len(frame), len(frame))
+                    f.write(frame)
+
+            # Ensure the file has been written
+            f.flush()
+            os.fsync(f.fileno())
+            size = f.tell()
+
+        # Swap the compacted log in. The log has to be closed for that as
+        # open files can't be replaced on all platforms.
+        self._close_sealed()
+        self._handle.close()
+
+        if self.segment_size is None:
+            os.replace(compact_path, self.path)
+            fsync_dir(self.path)
+        else:
+            obsolete = self._segments
+            self._save_manifest([compact_path])
+            self._segments = [compact_path]
+
+            for segment in obsolete:
+                try:
+                    os.remove(segment)
+                except OSError:
+                    # The segment may still be opened by another storage
+                    # instance. It isn't listed in the manifest anymore, so
+                    # it's ignored anyway.
+                    pass
+
+        # The snapshot and the hint refer to the replaced log. Its inode may
+        # be reused, so they have to go.
+        for suffix in (self.snapshot_suffix, self.hint_suffix):
+            try:
+                os.remove(self.path + suffix)
+            except OSError:
+                pass
+
+        self._handle = open(self._segments[-1], mode='r+b')
+        self._writer.handle = self._handle
+
+        self._bases = [0]
+        self._offset = size
+        self._table_offsets = {}
+        self._keydir = keydir
+        self._chains = {}
+        self._live_bytes = self._applied_bytes = size - self.header_size
+
+    def checkpoint(self, wait=True) -> None:
+        """
+        Save the replayed documents to the snapshot file.
+
+        Pending frames are committed and the log is replayed first, so the
+        snapshot covers the log up to its end. Only copying the replayed
+        state happens in the calling thread, the snapshot is written by a
+        background thread. A checkpoint that is still running is waited for.
+
+        :param wait: Whether to wait for the snapshot to be written
+        """
+        with self._serialized():
+            self._checkpoint(wait)
+
+    @contextmanager
+    def _serialized(self) -> Iterator[None]:
+        if self._mutex is None:
+            yield
+        else:
+            with self._mutex:
+                yield
+
+    def _checkpoint(self, wait: bool) -> None:
+        if not self._handle.writable():
+            raise IOError('Cannot checkpoint the database. Access mode is "{0}"'.format(self._mode))
+
+        self._join_checkpoint()
+        self._replay_tail()
+
+        self._last_checkpoint = time.monotonic()
+        self._written = 0
+
+        # Copy the tables, as they keep changing while the snapshot is
+        # written. The documents themselves are replaced, not modified, when
+        # applying frames.
+        keydir = {table: dict(entries) for table, entries in self._keydir.items()}
+
+        if self.keydir:
+            chains = {table: dict(chain) for table, chain in self._chains.items()}
+            target = self._save_hint
+            args = (os.fstat(self._handle.fileno()).st_ino, self._offset, keydir,
+                    chains, dict(self._next_ids))
+        else:
+            tables = {table: dict(docs) for table, docs in self._tables.items()}
+            target = self._save_snapshot
+            args = (os.stat(self._segments[0]).st_ino, self._offset, keydir,
+                    tables, dict(self._next_ids))
+
+        self._checkpoint_thread = threading.Thread(target=target, args=args, daemon=True)
+        self._checkpoint_thread.start()
+
+        if wait:
+            self._join_checkpoint()
+
+    def _checkpoint_due(self) -> bool:
+        if self._checkpoint_thread is not None and self._checkpoint_thread.is_alive():
+            # Checkpoints don't pile up
+            return False
+
+        if self.checkpoint_bytes is not None and self._written >= self.checkpoint_bytes:
+            return True
+
+        return (self.checkpoint_interval is not None
+                and time.monotonic() - self._last_checkpoint >= self.checkpoint_interval)
+
+    def _schedule_checkpoint(self, delay: float) -> None:
+        """
+        Start a timer checking whether a checkpoint is due after a delay.
+
+        The timer only refers to the storage weakly, so it doesn't keep a
+        storage that hasn't been closed alive.
+        """
+        storage = weakref.ref(self)
+
+        def expired():
+            instance = storage()
+
+            if instance is not None:
+                instance._checkpoint_expired()
+
+        self._checkpoint_timer = threading.Timer(delay, expired)
+        self._checkpoint_timer.daemon = True
+        self._checkpoint_timer.start()
+
+    def _checkpoint_expired(self) -> None:
+        with self._mutex:
+            if self._checkpoint_timer is None:
+                # The storage has been closed
+                return
+
+            if self._written and self._checkpoint_due():
+                try:
+                    with locked(self._lock):
+                        self._checkpoint(wait=False)
+                except Exception:
+                    logger.exception('Failed to checkpoint %s, no more checkpoints '
+                                     'are taken by time', self.path)
+                    self._checkpoint_timer = None
+                    return
+
+            # Check again once the interval has passed since the last
+            # checkpoint
+            delay = self._last_checkpoint + self.checkpoint_interval - time.monotonic()
+            self._schedule_checkpoint(delay if delay > 0 else self.checkpoint_interval)
+
+    def _join_checkpoint(self) -> None:
+        if self._checkpoint_thread is not None:
+            self._checkpoint_thread.join()
+            self._checkpoint_thread = None
+
+    def _compaction_due(self) -> bool:
+        if self.compact_threshold is None:
+            return False
+
+        if self._offset - self.header_size < self.compact_min_size:
+            return False
+
+        return self.garbage_ratio > self.compact_threshold
+
+    def _rollover_due(self) -> bool:
+        if self.segment_size is None:
+            return False
+
+        # The writer may be appending to the handle in the background, so
+        # the size is taken from the file instead of moving the cursor
+        size = os.fstat(self._handle.fileno()).st_size + self._writer.pending_size
+
+        return size >= self.segment_size
+
+    def _roll_over(self) -> None:
+        """
+        Seal the current segment and continue the log in a new one.
+        """
+        # The sealed segment has to be complete
+        self.flush()
+
+        self._handle.seek(0, os.SEEK_END)
+        base = self._bases[-1] + self._handle.tell()
+
+        path = self._segment_path(self._segment_number(self._segments[-1]) + 1)
+        self._create(path, False)
+        self._save_manifest(self._segments + [path])
+
+        self._handle.close()
+        self._handle = open(path, mode='r+b')
+        self._writer.handle = self._handle
+
+        self._segments.append(path)
+        self._bases.append(base)
+
+        if self._offset == base:
+            # Everything has been replayed, so continue behind the header of
+            # the new segment
+            self._offset = base + self.header_size
+
+    def _manifest_path(self) -> str:
+        return self.path + self.manifest_suffix
+
+    def _segment_path(self, number: int) -> str:
+        return '{}.{:06d}'.format(self.path, number)
+
+    def _segment_number(self, path: str) -> int:
+        if os.path.basename(path) == os.path.basename(self.path):
+            # An unsegmented log continued as the first segment
+            return 0
+
+        return int(path.rsplit('.', 1)[1])
+
+    @staticmethod
+    def _segment_bases(segments: List[str]) -> List[int]:
+        """
+        Calculate the offset each segment starts at.
+        """
+        bases = [0]
+
+        # Sealed segments don't change their size anymore
+        for segment in segments[:-1]:
+            bases.append(bases[-1] + os.path.getsize(segment))
+
+        return bases
+
+    def _read_manifest(self) -> List[str]:
+        """
+        Read the paths of the segments from the manifest.
+        """
+        manifest_path = self._manifest_path()
+
+        with open(manifest_path) as f:
+            self._manifest_stat = self._stat_key(os.fstat(f.fileno()))
+            manifest = json.load(f)
+
+        directory = os.path.dirname(self.path)
+
+        return [os.path.join(directory, name) for name in manifest['segments']]
+
+    def _save_manifest(self, segments: List[str]) -> None:
+        """
+        Atomically replace the manifest with one listing the given segments.
+        """
+        manifest_path = self._manifest_path()
+        manifest = {'segments': [os.path.basename(segment) for segment in segments]}
+
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(manifest_path + '.tmp', manifest_path)
+        fsync_dir(manifest_path)
+
+        self._manifest_stat = self._stat_key(os.stat(manifest_path))
+
+    @staticmethod
+    def _stat_key(stat: os.stat_result) -> Tuple[int, int, int]:
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _follow_log(self) -> None:
+        """
+        Pick up the changes another storage instance has made to the files
+        the log consists of.
+        """
+        if self.segment_size is not None:
+            self._follow_manifest()
+        elif self._lock is not None:
+            self._follow_file()
+
+    def _follow_file(self) -> None:
+        """
+        Reopen the log if another storage instance has replaced it, e.g. by
+        compacting it.
+        """
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            return
+
+        if inode == os.fstat(self._handle.fileno()).st_ino:
+            return
+
+        mode = 'r+b' if self._handle.writable() else 'rb'
+        self._handle.close()
+        self._handle = open(self.path, mode=mode)
+        self._writer.handle = self._handle
+
+        # The replayed state belongs to the replaced log
+        self._reset()
+
+    def _follow_manifest(self) -> None:
+        """
+        Pick up segments that another storage instance has added to or
+        removed from the manifest.
+        """
+        try:
+            stat = os.stat(self._manifest_path())
+        except OSError:
+            # The log hasn't been segmented yet
+            return
+
+        if self._stat_key(stat) == self._manifest_stat:
+            return
+
+        segments = self._read_manifest()
+
+        if segments[0] != self._segments[0]:
+            # The log has been compacted, so the replayed state is stale
+            self._reset()
+
+        if segments[-1] != self._segments[-1]:
+            mode = 'r+b' if self._handle.writable() else 'rb'
+            self._handle.close()
+            self._handle = open(segments[-1], mode=mode)
+            self._writer.handle = self._handle
+
+        self._close_sealed()
+        self._segments = segments
+        self._bases = self._segment_bases(segments)
+
+    def _segment_handle(self, index: int) -> BinaryIO:
+        """
+        Get a handle to read the segment at the given index from.
+        """
+        if index == len(self._segments) - 1:
+            return self._handle
+
+        path = self._segments[index]
+        if path not in self._sealed:
+            self._sealed[path] = open(path, 'rb')
+
+        return self._sealed[path]
+
+    def _close_sealed(self) -> None:
+        for handle in self._sealed.values():
+            handle.close()
+
+        self._sealed = {}
+
+    def _create(self, path: str, create_dirs: bool) -> None:
+        """
+        Create a log file if it doesn't exist yet.
+        """
+        touch(path, create_dirs=create_dirs)
+
+    def _header(self) -> bytes:
+        """
+        Get the meta header a new log file starts with.
+        """
+        return b''
+
+    def _apply(self, table: str, documents: Dict[str, Any], offset: int, size: int) -> None:
+        """
+        Merge the documents of a frame into the in-memory tables.
+
+        :param offset: The offset of the frame in the log
+        :param size: The size of the frame in bytes
+        """
+        if offset < self._table_offsets.get(table, 0):
+            # Frames of tables that have been replayed on their own already
+            # have been applied
+            return
+
+        self._applied_bytes += size
+
+        if not documents:
+            return
+
+        docs = self._tables.setdefault(table, {})
+        entries = self._keydir.setdefault(table, {})
+        self._revisions[table] = self._revisions.get(table, 0) + 1
+
+        # Account the frame size to the documents it contains, the
+        # frames of their previous versions have become garbage
+        share = size // len(documents)
+
+        for doc_id, document in documents.items():
+            self._apply_document(table, docs, entries, doc_id, document, (offset, size, share))
+
+    def _apply_document(self, table: str, docs: Dict[str, Any], entries: Dict[str, Tuple[int, int, int]],
+                        doc_id: str, document: Any, entry: Tuple[int, int, int]) -> None:
+        """
+        Merge a single document into a table and its keydir.
+
+        :param entry: The keydir entry of the frame holding the document
+        """
+        previous = entries.get(doc_id)
+
+        if previous is not None and previous[0] >= entry[0]:
+            # The frame has been applied already. This happens when the
+            # log written after a hint is replayed while the keydir saved
+            # to the hint covers parts of it already. Patches must not be
+            # applied twice.
+            return
+
+        if is_patch(document):
+            if previous is None:
+                # Patches of missing documents have nothing to apply to
+                return
+
+            # Compacting writes the patched document in full, so it takes up
+            # as much as its previous version. The patch is garbage.
+            entry = (entry[0], entry[1], previous[2])
+
+            if self.keydir:
+                chains = self._chains.setdefault(table, {})
+                chains[doc_id] = chains.get(doc_id, []) + [(previous[0], previous[1])]
+            else:
+                document = apply_patch(docs[doc_id], document)
+        elif self.keydir and doc_id in self._chains.get(table, {}):
+            del self._chains[table][doc_id]
+
+        if previous is not None:
+            self._live_bytes -= previous[2]
+
+        if is_tombstone(document):
+            # The document has been removed, so we evict it
+            docs.pop(doc_id, None)
+            entries.pop(doc_id, None)
+
+            if not entries:
+                # IDs start over once the table is empty
+                self._next_ids.pop(table, None)
+        else:
+            if not self.keydir:
+                docs[doc_id] = document
+            entries[doc_id] = entry
+            self._live_bytes += entry[2]
+
+            if previous is None:
+                self._track_id(table, doc_id)
+
+    def _track_id(self, table: str, doc_id: str) -> None:
+        """
+        Account a document added to a table to the next ID of the table.
+        """
+        try:
+            next_id = int(doc_id) + 1
+        except ValueError:
+            return
+
+        if next_id > self._next_ids.get(table, 1):
+            self._next_ids[table] = next_id
+
+    def _scan_ids(self) -> None:
+        """
+        Determine the next IDs of the tables from the keydir, e.g. if they
+        are missing from an older snapshot or hint.
+        """
+        self._next_ids = {}
+
+        for table, entries in self._keydir.items():
+            for doc_id in entries:
+                self._track_id(table, doc_id)
+
+    def _fold_patches(self, table: str, documents: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Replace the patches of documents with long patch chains by the
+        patched documents.
+
+        Reading a document takes one frame per patch in its chain, so the
+        chains are kept from growing beyond ``max_patch_chain``.
+        """
+        chains = self._chains.get(table, {})
+        long_chains = [
+            doc_id for doc_id, document in documents.items()
+            if is_patch(document) and len(chains.get(doc_id, ())) >= self.max_patch_chain
+        ]
+
+        if not long_chains:
+            return documents
+
+        # The patches have to be applied to the current versions, which may
+        # have been written by other storage instances
+        self._replay_tail(table)
+
+        documents = dict(documents)
+        entries = self._keydir.get(table, {})
+
+        for doc_id in long_chains:
+            entry = entries.get(doc_id)
+
+            if entry is not None:
+                documents[doc_id] = apply_patch(self._read_frame(table, doc_id, entry),
+                                                documents[doc_id])
+
+        return documents
+
+    def _read_frame(self, table: str, doc_id: str, entry: Tuple[int, int, int],
+                    frames: Optional[Dict[int, Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        Read the current version of a document from the log.
+
+        A patched document is read from the frame holding it in full and
+        patched with the patch records written after it.
+
+        :param entry: The keydir entry of the document
+        :param frames: The documents of the frames decoded so far by their
+                       offset, when reading several documents
+        """
+        # Frames that are still pending can't be read from disk yet
+        if self._writer.pending:
+            self.flush()
+
+        document = None
+
+        for offset, length in self._chains.get(table, {}).get(doc_id, []) + [(entry[0], entry[1])]:
+            version = self._read_version(doc_id, offset, length, frames)
+            document = version if document is None else apply_patch(document, version)
+
+        return document
+
+    def _read_version(self, doc_id: str, offset: int, length: int,
+                      frames: Optional[Dict[int, Dict[str, Any]]] = None) -> Any:
+        """
+        Read the version of a document held by a frame from the log.
+
+        :param frames: The documents of the frames decoded so far by their
+                       offset, the frame is added if it isn't there yet
+        """
+        if frames is not None and offset in frames:
+            return frames[offset][doc_id]
+
+        index = bisect.bisect_right(self._bases, offset) - 1
+        handle = self._segment_handle(index)
+        position = offset - self._bases[index]
+
+        if hasattr(os, 'pread'):
+            frame = os.pread(handle.fileno(), length, position)
+        else:
+            handle.seek(position)
+            frame = handle.read(length)
+
+        documents = self._decode(frame)[1]
+
+        if frames is not None:
+            frames[offset] = documents
+
+        return documents[doc_id]
+
+    def _load_hint(self) -> None:
+        """
+        Load the keydir from the hint file if it matches the log.
+        """
+        try:
+            with open(self.path + self.hint_suffix) as f:
+                hint = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        # The hint is only valid for the log file it has been written for and
+        # as long as that log hasn't been truncated
+        stat = os.fstat(self._handle.fileno())
+        if hint['inode'] != stat.st_ino or hint['offset'] > self._bases[-1] + stat.st_size:
+            return
+
+        self._keydir = {
+            table: {doc_id: tuple(entry) for doc_id, entry in entries.items()}
+            for table, entries in hint['keydir'].items()
+        }
+        self._chains = {
+            table: {doc_id: [tuple(frame) for frame in chain] for doc_id, chain in chains.items()}
+            for table, chains in hint.get('chains', {}).items()
+        }
+        self._live_bytes = sum(
+            entry[2] for entries in self._keydir.values()
+            for entry in entries.values()
+        )
+        self._offset = hint['offset']
+
+        # Every segment starts with a header
+        segments = bisect.bisect_right(self._bases, self._offset)
+        self._applied_bytes = self._offset - self.header_size * segments
+
+        if 'next_ids' in hint:
+            self._next_ids = hint['next_ids']
+        else:
+            self._scan_ids()
+
+    def _save_hint(self, inode: int, offset: int, keydir: Dict[str, Dict[str, Tuple[int, int, int]]],
+                   chains: Dict[str, Dict[str, List[Tuple[int, int]]]], next_ids: Dict[str, int]) -> None:
+        """
+        Save the keydir to the hint file.
+
+        :param inode: The inode of the log file the keydir belongs to
+        :param offset: The offset up to which the keydir covers the log
+        :param chains: The frames patched documents are replayed from
+        :param next_ids: The next document IDs of the tables
+        """
+        hint = {
+            'inode': inode,
+            'offset': offset,
+            'keydir': keydir,
+            'chains': chains,
+            'next_ids': next_ids,
+        }
+
+        hint_path = self.path + self.hint_suffix
+        with open(hint_path + '.tmp', 'w') as f:
+            json.dump(hint, f)
+
+        os.replace(hint_path + '.tmp', hint_path)
+
+    def _load_snapshot(self) -> None:
+        """
+        Load the documents from the snapshot file if it matches the log.
+        """
+        tables: Dict[str, Dict[str, Any]] = {}
+        keydir: Dict[str, Dict[str, Tuple[int, int, int]]] = {}
+
+        try:
+            with open(self.path + self.snapshot_suffix, 'rb') as f:
+                header = json.loads(f.readline().decode('utf-8'))
+
+                # The snapshot is only valid for the log it has been written
+                # for and as long as that log hasn't been truncated
+                if (header['inode'] != os.stat(self._segments[0]).st_ino
+                        or header['offset'] > self._bases[-1] + os.fstat(self._handle.fileno()).st_size):
+                    return
+
+                for _ in range(header['documents']):
+                    length, = SNAPSHOT_RECORD.unpack(f.read(SNAPSHOT_RECORD.size))
+                    table, doc_id, entry, document = self.codec.decode(f.read(length))
+                    tables.setdefault(table, {})[doc_id] = document
+                    keydir.setdefault(table, {})[doc_id] = tuple(entry)
+        except (OSError, ValueError, KeyError, struct.error):
+            return
+
+        self._tables = tables
+        self._keydir = keydir
+        self._live_bytes = sum(
+            entry[2] for entries in keydir.values() for entry in entries.values()
+        )
+        self._offset = header['offset']
+
+        # Every segment starts with a header
+        segments = bisect.bisect_right(self._bases, self._offset)
+        self._applied_bytes = self._offset - self.header_size * segments
+
+        if 'next_ids' in header:
+            self._next_ids = header['next_ids']
+        else:
+            self._scan_ids()
+
+    def _save_snapshot(self, inode: int, offset: int,
+                       keydir: Dict[str, Dict[str, Tuple[int, int, int]]],
+                       tables: Dict[str, Dict[str, Any]], next_ids: Dict[str, int]) -> None:
+        """
+        Save the documents to the snapshot file.
+
+        The snapshot has a JSON header line followed by a record per
+        document holding its table, ID, keydir entry and contents serialized
+        by the codec.
+
+        :param inode: The inode of the first log file
+        :param offset: The offset up to which the documents cover the log
+        :param next_ids: The next document IDs of the tables
+        """
+        snapshot_path = self.path + self.snapshot_suffix
+        header = {
+            'inode': inode,
+            'offset': offset,
+            'documents': sum(len(docs) for docs in tables.values()),
+            'next_ids': next_ids,
+        }
+
+        with open(snapshot_path + '.tmp', 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+
+            for table, docs in tables.items():
+                entries = keydir[table]
+
+                for doc_id, document in docs.items():
+                    record = self.codec.encode([table, doc_id, list(entries[doc_id]), document])
+                    f.write(SNAPSHOT_RECORD.pack(len(record)) + record)
+
+            # Ensure the file has been written before it replaces the
+            # previous snapshot
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(snapshot_path + '.tmp', snapshot_path)
+        fsync_dir(snapshot_path)
+
+    def _recover_tail(self) -> None:
+        """
+        Cut off a frame at the end of the log that hasn't been written
+        completely, e.g. as the process died while writing it.
+
+        The log is scanned backward from its end up to the last line break,
+        so recovering only reads the torn tail, however large the log is.
+        """
+        # Only the last segment can have a torn tail
+        self._handle.seek(0, os.SEEK_END)
+        size = self._handle.tell()
+
+        keep = self.header_size
+        pos = size
+
+        while pos > self.header_size:
+            start = max(pos - io.DEFAULT_BUFFER_SIZE, self.header_size)
+            self._handle.seek(start)
+            index = self._handle.read(pos - start).rfind(b'\n')
+
+            if index >= 0:
+                keep = start + index + 1
+                break
+
+            pos = start
+
+        if keep < size and not self._complete_tail(keep, size):
+            self._truncate_tail(keep, size)
+
+    def _complete_tail(self, start: int, end: int) -> bool:
+        """
+        Check whether the bytes after the last line break of the log form
+        complete frames nonetheless.
+        """
+        return False
+
+    def _truncate_tail(self, keep: int, size: int) -> None:
+        """
+        Truncate the last segment of the log to ``keep`` bytes.
+        """
+        logger.warning('Discarding %d bytes of a torn frame at the end of %s',
+                       size - keep, self._segments[-1])
+
+        self._handle.truncate(keep)
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+
+    def _replay_tail(self, table: Optional[str] = None) -> None:
+        """
+        Replay the frames that have been appended to the log since the last
+        replay.
+
+        :param table: Only replay the frames of this table. The frames of
+                      other tables are skipped and replayed later.
+        """
+        # Pending frames have to be on disk to be replayed
+        self.flush()
+        self._follow_log()
+
+        # Get the file size by moving the cursor to the file end and reading
+        # its location
+        self._handle.seek(0, os.SEEK_END)
+        size = self._bases[-1] + self._handle.tell()
+
+        if size < self._offset:
+            # The log has been truncated or replaced behind our back, so the
+            # replayed state is stale and we have to start over
+            self._reset()
+
+        if table is None:
+            offset = self._offset
+        else:
+            offset = max(self._offset, self._table_offsets.get(table, 0))
+
+        for index, base in enumerate(self._bases):
+            end = self._bases[index + 1] if index + 1 < len(self._bases) else size
+
+            if offset >= end:
+                continue
+
+            # Every segment starts with its own header
+            offset = max(offset, base + self.header_size)
+            offset += self._replay_segment(index, offset - base, end - base, table)
+
+            if offset < end:
+                # The rest of the segment hasn't been written completely
+                break
+
+        if table is not None:
+            self._table_offsets[table] = offset
+            return
+
+        self._offset = offset
+        self._replayed = True
+
+        # All tables have caught up with the log
+        self._table_offsets = {}
+
+    def _reset(self) -> None:
+        """
+        Forget the replayed state.
+        """
+        self._tables = {}
+        self._keydir = {}
+        self._chains = {}
+        self._next_ids = {}
+        self._live_bytes = 0
+        self._applied_bytes = 0
+
+        for table in self._revisions:
+            self._revisions[table] += 1
+
+        self._offset = self.header_size
+        self._table_offsets = {}
+
+    def _replay_segment(self, index: int, start: int, end: int, table: Optional[str] = None) -> int:
+        """
+        Replay a segment of the log from ``start`` up to ``end``.
+
+        :param table: Only replay the frames of this table
+        :returns: the number of bytes that have been replayed
+        """
+        handle = self._segment_handle(index)
+        base = self._bases[index]
+
+        if not self.use_mmap:
+            handle.seek(start)
+            chunk = handle.read(end - start)
+            return self._replay(chunk, 0, base + start, table)
+
+        # Memory maps have to start at a multiple of the allocation
+        # granularity
+        aligned = start - start % mmap.ALLOCATIONGRANULARITY
+
+        with mmap.mmap(handle.fileno(), end - aligned,
+                       access=mmap.ACCESS_READ, offset=aligned) as mapped:
+            return self._replay(mapped, start - aligned, base + aligned, table)
+
+    def _replay(self, buffer, start: int, base: int, table: Optional[str] = None) -> int:
+        """
+        Apply the frames contained in a buffer holding a part of the log.
+
+        Only complete lines are replayed, a partially written last line is
+        picked up once it has been completed.
+
+        :param buffer: The ``bytes`` or ``mmap`` to replay
+        :param start: The position in the buffer to start replaying at
+        :param base: The offset of the buffer in the log
+        :param table: Only apply the frames of this table
+        :returns: the number of bytes that have been replayed
+        """
+        pos = start
+
+        while True:
+            end = buffer.find(b'\n', pos) + 1
+            if not end:
+                break
+
+            if table is None or not self._skip_frame(buffer, pos, table):
+                # Only the frame is copied out of the buffer for decoding
+                frame_table, documents = self._decode(buffer[pos:end])
+
+                if table is None or frame_table == table:
+                    self._apply(frame_table, documents, base + pos, end - pos)
+
+            pos = end
+
+        return pos - start
+
+    def _skip_frame(self, buffer, pos: int, table: str) -> bool:
+        """
+        Check whether the frame at a position in a buffer can be skipped
+        without decoding it, as it belongs to another table.
+        """
+        return False
+
+    @abstractmethod
+    def _encode(self, table: str, documents: Dict[str, Any]) -> bytes:
+        """
+        Serialize the documents of a frame, including the line break.
+        """
+
+        raise NotImplementedError('To be overridden!')
+
+    @abstractmethod
+    def _decode(self, frame: bytes) -> Tuple[str, Dict[str, Any]]:
+        """
+        Deserialize a frame into its table and documents.
+        """
+
+        raise NotImplementedError('To be overridden!')
+
+
+class JSONFrameStorage(LogStorage):
+    """
+    Store the data of a single table in a JSON frame log.
+
+    Every written document is appended as a ``"doc_id": {...},`` line
+    behind a 500 byte header holding the table name. The frames thus form the
+    body of a JSON object.
+
+    Logs written before frames got their own lines consist of a single line
+    of fragments. The last byte of the header tells them apart: it is a line
+    break for logs of lines and a null byte for the older ones.
+    """
+
+    header_size = 500
+
+    #: The last byte of the header of logs whose frames are lines
+    line_frames_mark = b'\n'
+
+    def __init__(self, path: str, table="_default", create_dirs=False, encoding=None, access_mode='r+', **kwargs):
+        """
+        Create a new instance.
+
+        Also creates the storage file, if it doesn't exist and the access mode is appropriate for writing.
+
+        :param path: Where to store the JSON data.
+        :param table: The name of the table stored in the file.
+        :param access_mode: mode in which the file is opened (r, r+, w, a, x, b, t, +, U)
+        :type access_mode: str
+        """
+
+        self._header_table = table
+
+        super().__init__(path, create_dirs=create_dirs, encoding=encoding, access_mode=access_mode, **kwargs)
+
+        self.table = table
+        #meta  head size  500b
+        self.metaHeadSize = self.header_size
+
+    def read(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        tables = super().read()
+
+        if tables is None:
+            return None
+
+        # The log holds one table only, whatever the table is called
+        return {self.table: tables.get(self._header_table, {})}
+
+    def read_table(self, table: str) -> Dict[str, Any]:
+        # The log holds one table only, whatever the table is called
+        return super().read_table(self._header_table)
+
+    def write_table(self, table: str, documents: Dict[str, Any]) -> Optional[Future]:
+        # The log holds one table only, whatever the table is called
+        return super().write_table(self._header_table, documents)
+
+    def _create(self, path: str, create_dirs: bool) -> None:
+        touch(path, create_dirs=create_dirs)
+
+        if os.path.getsize(path) == 0:
+            with open(path, 'r+b') as f:
+                f.write(self._header())
+
+    def _header(self) -> bytes:
+        name = self._header_table.encode('utf-8')
+
+        if len(name) >= self.header_size:
+            raise ValueError('Table name too long: {!r}'.format(self._header_table))
+
+        return name.ljust(self.header_size - 1, b'\0') + self.line_frames_mark
+
+    def _encode(self, table: str, documents: Dict[str, Any]) -> bytes:
+        # Serialize the members of the documents dict as a dict fragment
+        encode = self.codec.encode
+
+        return b','.join([
+            encode(doc_id) + b':' + encode(document)
+            for doc_id, document in documents.items()
+        ]) + b',\n'
+
+    def read_document(self, table: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        # The log holds one table only, whatever the table is called
+        return super().read_document(self._header_table, doc_id)
+
+    def read_next_id(self, table: str) -> Optional[int]:
+        # The log holds one table only, whatever the table is called
+        return super().read_next_id(self._header_table)
+
+    def table_revision(self, table: str) -> Optional[int]:
+        # The log holds one table only, whatever the table is called
+        return super().table_revision(self._header_table)
+
+    def _replay(self, buffer, start: int, base: int, table: Optional[str] = None) -> int:
+        size = len(buffer)
+
+        if (buffer.find(b'\n', start) < 0 and buffer[size - 1:size] == b','
+                and self._legacy_line(base + start)):
+            # Logs written before frames got their own lines consist of a
+            # single line of fragments
+            table, documents = self._decode(buffer[start:])
+            self._apply(table, documents, base + start, size - start)
+            return size - start
+
+        return super()._replay(buffer, start, base, table)
+
+    def _legacy_line(self, offset: int) -> bool:
+        """
+        Check whether the log at an offset continues with the single line of
+        fragments of a log written before frames got their own lines.
+
+        Anywhere else, a line without a line break is a torn frame.
+        """
+        index = bisect.bisect_right(self._bases, offset) - 1
+
+        if offset != self._bases[index] + self.header_size:
+            return False
+
+        handle = self._segment_handle(index)
+
+        if hasattr(os, 'pread'):
+            mark = os.pread(handle.fileno(), 1, self.header_size - 1)
+        else:
+            handle.seek(self.header_size - 1)
+            mark = handle.read(1)
+
+        return mark != self.line_frames_mark
+
+    def _complete_tail(self, start: int, end: int) -> bool:
+        if not self._legacy_line(self._bases[-1] + start):
+            return False
+
+        # Logs written before frames got their own lines consist of a single
+        # line of fragments, which is only complete if it can be decoded
+        self._handle.seek(start)
+        tail = self._handle.read(end - start)
+
+        try:
+            self._decode(tail)
+        except ValueError:
+            return False
+
+        return tail.endswith(b',')
+
+    def _decode(self, frame: bytes) -> Tuple[str, Dict[str, Any]]:
+        # Load the JSON contents of the frame, format  the data
+        return self._header_table, self.codec.decode(b'{' + frame.rstrip()[:-1] + b'}')
+
+
+#: An entry of the extent directory of a :class:`JSONMultiFrameStorage`: the
+#: offsets of the first and the last extent of a table
+DIRECTORY_ENTRY = struct.Struct('<QQ')
+
+#: The header of an extent: the offset of the next extent of the same table
+#: (0 for the last one) and the number of bytes the extent can hold
+EXTENT_HEADER = struct.Struct('<QI')
+
+
+class JSONMultiFrameStorage(Storage):
+    """
+    Store the data of multiple tables in extents of JSON frames.
+
+    The file starts with a 500 byte :class:`JSONMultiFrameMeta` header holding
+    the names of the tables, followed by a directory recording the first and
+    the last extent of every table. An extent is a region of the file
+    reserved for the frames of a single table. It starts with an
+    :data:`EXTENT_HEADER` linking it to the next extent of the table, every
+    frame is written as a JSON object on a line of its own. Once the last
+    extent of a table is full, a new one is allocated at the end of the file.
+
+    Reading a table thus only seeks to the extents of that table and never
+    parses the frames of other tables. The documents of each table are
+    retained together with the position up to which its extents have been
+    replayed, so only frames appended since the last read are parsed.
+
+    Removed documents are written as :data:`TOMBSTONE` and evicted when
+    replaying. Only one storage instance may write to a file at a time,
+    unless ``locking=True``: reads then hold a shared and writes an
+    exclusive :class:`FileLock`, and writes read the extent directory again
+    to continue behind the frames other processes have written.
+    """
+
+    table_scoped = True
+
+    header_size = 500
+
+    #: The version of the frame format stored in the header
+    format_version = 1
+
+    def __init__(self, path: str, tables=(), create_dirs=False, encoding=None, access_mode='r+',
+                 extent_size=64 * 1024, codec=None, locking=False, **kwargs):
+        """
+        Create a new instance.
+
+        Also creates the storage file, if it doesn't exist and the access mode is appropriate for writing.
+
+        :param path: Where to store the JSON data.
+        :param tables: The names of the tables to register when creating the
+                       file, in addition to the default table
+        :param access_mode: mode in which the file is opened (r, r+, w, a, x, b, t, +, U)
+        :type access_mode: str
+        :param extent_size: The number of bytes reserved for the frames of a
+                            table at once
+        :param codec: The :class:`JSONCodec` serializing the documents
+        :param locking: Whether to coordinate access with other processes
+                        using a lock file (``path`` + ``.lock``)
+        """
+
+        super().__init__()
+
+        if kwargs.get('indent') is not None:
+            raise ValueError('Frames have to be written on a single line, '
+                             'indent is not supported')
+
+        self._mode = access_mode
+        self._encoding = encoding or 'utf-8'
+        self.kwargs = kwargs
+        self.path = path
+        self.extent_size = extent_size
+
+        if codec is None:
+            codec = JSONCodec(self._encoding, **kwargs)
+        elif not isinstance(codec, JSONCodec):
+            raise ValueError('{} writes JSON lines and needs a JSONCodec'.format(type(self).__name__))
+
+        self.codec = codec
+
+        self._meta = JSONMultiFrameMeta()
+        self._meta.version = self.format_version
+        self._meta.tables = ['_default', *tables]
+        self._directory = [(0, 0)] * self._meta.tableCountMax
+
+        # The documents replayed from the extents of each table so far, the
+        # extent and the position in it up to which the table has been
+        # replayed and the extent frames of a table are written to
+        self._tables: Dict[str, Dict[str, Any]] = {}
+        self._positions: Dict[str, Tuple[int, int]] = {}
+        self._tails: Dict[str, Tuple[int, int, int]] = {}
+
+        self._lock: Optional[FileLock] = None
+        if locking:
+            touch(path + '.lock', create_dirs=create_dirs)
+            self._lock = FileLock(path + '.lock')
+        self.locking = locking
+
+        # Create the file if it doesn't exist and creating is allowed by the
+        # access mode
+        if any([character in self._mode for character in ('+', 'w', 'a')]):  # any of the writing modes
+            with locked(self._lock, exclusive=True):
+                self._create(create_dirs)
+
+        # Open the file for reading/writing. The file is accessed in binary
+        # mode so file positions are real byte offsets, and unbuffered as
+        # other storage instances update extents in place.
+        self._handle = open(path, mode=binary_mode(self._mode), buffering=0)
+
+        with locked(self._lock):
+            self._read_header()
+
+        if self._meta.version != self.format_version:
+            self.close()
+            raise ValueError('Unsupported frame format version {}'.format(self._meta.version))
+
+    def close(self) -> None:
+        self._handle.close()
+
+        if self._lock is not None:
+            self._lock.close()
+
+    def exclusive(self) -> ContextManager[None]:
+        return locked(self._lock, exclusive=True)
+
+    def read(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        with locked(self._lock):
+            # Pick up tables that have been added by other storage instances
+            self._read_header()
+
+            if not any(first for first, _ in self._directory):
+                # File is empty, so we return ``None`` so TinyDB can properly
+                # initialize the database
+                return None
+
+            tables = {table: self.read_table(table) for table in self._meta.tables}
+
+        # Tables whose documents have all been removed don't exist anymore
+        return {table: documents for table, documents in tables.items() if documents}
+
+    def read_table(self, table: str) -> Dict[str, Any]:
+        """
+        Read the documents of a single table.
+
+        Only the extents of the table are read from the file.
+        """
+        with locked(self._lock):
+            self._replay_table(table)
+
+        return self._tables.get(table, {})
+
+    def read_document(self, table: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        return self.read_table(table).get(doc_id)
+
+    def write(self, data: Dict[str, Dict[str, Any]]):
+        # Write the documents that differ from the current state to the
+        # extents of their tables
+        with locked(self._lock, exclusive=True):
+            for table, documents in table_changes(self.read() or {}, data):
+                self.write_table(table, documents)
+
+    def write_table(self, table: str, documents: Dict[str, Any]) -> None:
+        if not self._handle.writable():
+            raise IOError('Cannot write to the database. Access mode is "{0}"'.format(self._mode))
+
+        with locked(self._lock, exclusive=True):
+            if self._lock is not None:
+                # Other processes may have registered tables, allocated
+                # extents and appended frames since we've last written
+                self._read_header()
+                self._tails = {}
 
-        if not size:
-            # File is empty, so we return ``None`` so TinyDB can properly
-            # initialize the database
-            return None
-        else:
-            # Return the cursor to the beginning of the file
-            self._handle.seek(0)
+            self._append(table, documents)
 
-            # Load the JSON contents of the file
-            return json.load(self._handle)
+    def _append(self, table: str, documents: Dict[str, Any]) -> None:
+        """
+        Write a frame holding the documents of a table to its last extent.
+        """
+        frame = self.codec.encode(documents) + b'\n'
 
-    def write(self, data: Dict[str, Dict[str, Any]]):
-        # Move the cursor to the beginning of the file just in case
-        self._handle.seek(0, 2 )
+        table_id = self._table_id(table, create=True)
+        extent, capacity, used = self._tail(table, table_id)
 
-        # Serialize the database state using the user-provided arguments
-        serialized = json.dumps(data, **self.kwargs)
+        if not extent or used + len(frame) > capacity:
+            extent, capacity, used = self._allocate(table_id, extent, len(frame))
 
-        # Write the serialized data to the file
-        try:
-            self._handle.write(serialized)
-        except io.UnsupportedOperation:
-            raise IOError('Cannot write to the database. Access mode is "{0}"'.format(self._mode))
+        self._handle.seek(extent + EXTENT_HEADER.size + used)
+        self._handle.write(frame)
 
         # Ensure the file has been written
         self._handle.flush()
         os.fsync(self._handle.fileno())
 
-        # Remove data that is behind the new cursor in case the file has
-        # gotten shorter
-        #self._handle.truncate()
+        self._tails[table] = (extent, capacity, used + len(frame))
 
+    def _create(self, create_dirs: bool) -> None:
+        touch(self.path, create_dirs=create_dirs)
 
-class JSONFrameStorage(Storage):
-    """
-    Store the data in a JSON file.
-    """
+        if os.path.getsize(self.path) == 0:
+            with open(self.path, 'r+b') as f:
+                f.write(self._meta.packHeadMeta())
+                f.write(DIRECTORY_ENTRY.pack(0, 0) * self._meta.tableCountMax)
 
-    def __init__(self, path: str, table="_default", create_dirs=False, encoding=None, access_mode='r+', **kwargs):
+    def _read_header(self) -> None:
         """
-        Create a new instance.
-
-        Also creates the storage file, if it doesn't exist and the access mode is appropriate for writing.
-
-        :param path: Where to store the JSON data.
-        :param access_mode: mode in which the file is opened (r, r+, w, a, x, b, t, +, U)
-        :type access_mode: str
+        Read the table names and the extent directory.
         """
+        directory_size = DIRECTORY_ENTRY.size * self._meta.tableCountMax
 
-        super().__init__()
-
-        self._mode = access_mode
-        self.kwargs = kwargs
-        self.table = table
-        #meta  head size  500b
-        self.metaHeadSize = 500
-        self.path = path
+        self._handle.seek(0)
+        header = self._handle.read(self.header_size + directory_size)
+        self._meta.parse(header[:self.header_size])
 
-        # Create the file if it doesn't exist and creating is allowed by the
-        # access mode
-        if any([character in self._mode for character in ('+', 'w', 'a')]):  # any of the writing modes
-            initdb(path, create_dirs, table )
+        self._directory = [
+            DIRECTORY_ENTRY.unpack_from(header, self.header_size + DIRECTORY_ENTRY.size * i)
+            for i in range(self._meta.tableCountMax)
+        ]
 
-        # Open the file for reading/writing
-        self._handle = open(path, mode=self._mode, encoding=encoding)
+    def _table_id(self, table: str, create: bool = False) -> Optional[int]:
+        """
+        Get the ID of a table.
 
-    def close(self) -> None:
-        self._handle.close()
+        :param create: Whether to register the table in the header if it
+                       doesn't exist yet
+        :returns: the ID or ``None`` if the table doesn't exist
+        """
+        if table not in self._meta.tables:
+            # The table may have been added by another storage instance
+            self._read_header()
 
-    def read(self) -> Optional[Dict[str, Dict[str, Any]]]:
-        # Get the file size by moving the cursor to the file end and reading
-        # its location
-        self._handle.seek(0, os.SEEK_END)
-        size = self._handle.tell()
+        if table in self._meta.tables:
+            return self._meta.tables.index(table)
 
-        if size <= self.metaHeadSize:
-            # File is empty, so we return ``None`` so TinyDB can properly
-            # initialize the database
+        if not create:
             return None
-        else:
-            # Return the cursor to the beginning of the file
-            self._handle.seek( self.metaHeadSize )
 
-            # Load the JSON contents of the file, format  the data 
-            sdata = self._handle.read()
-            #print( "{\"" + self.table + "\": {"+ sdata[0:-1] + "}}" )
-            return json.loads( "{\"" + self.table + "\": {"+ sdata[0:-1] + "}}" )
+        self._meta.tables.append(table)
 
-    def write(self, data: Dict[str, Dict[str, Any]]):
-        # write one data
-        # Move the cursor to the beginning of the file just in case
-        self._handle.seek(0, os.SEEK_END )
+        try:
+            header = self._meta.packHeadMeta()
+        except ValueError:
+            self._meta.tables.pop()
+            raise
+
+        # Update the header in place
+        self._handle.seek(0)
+        self._handle.write(header)
+        self._handle.flush()
 
-        # Serialize the database state using the user-provided arguments
-        serialized = json.dumps(data, **self.kwargs)
-        #print( serialized[1:-1] )
+        return len(self._meta.tables) - 1
 
-        # Write the serialized data to the file
-        try:
-            self._handle.write(serialized[1:-1] )
-            self._handle.write( "," )
-        except io.UnsupportedOperation:
-            raise IOError('Cannot write to the database. Access mode is "{0}"'.format(self._mode))
+    def _read_extent(self, extent: int, start: int) -> Tuple[int, bytes]:
+        """
+        Read the frames written to an extent.
 
-        # Ensure the file has been written
-        self._handle.flush()
-        os.fsync(self._handle.fileno())
+        :param start: The position in the extent to start reading at
+        :returns: the offset of the next extent and the frames
+        """
+        self._handle.seek(extent)
+        next_extent, capacity = EXTENT_HEADER.unpack(self._handle.read(EXTENT_HEADER.size))
 
-        # Remove data that is behind the new cursor in case the file has
-        # gotten shorter
-        #self._handle.truncate()
+        self._handle.seek(extent + EXTENT_HEADER.size + start)
+        data = self._handle.read(capacity - start)
 
-    def snap(self, data: Dict[str, Dict[str, Any]]):
-        #initdb( self.path+ ".0", create_dirs=True, self.table )
-        with open( self.path+ ".0", 'bw') as f:
-            f.write( self.table )
-            f.write( '\0'*( 500-len(self.table) ) )
-            # Move the cursor to the beginning of the file just in case
-            f.seek( self.metaHeadSize )
+        # The unused part of an extent is filled with zero bytes, which never
+        # occur in JSON
+        end = data.find(b'\0')
+        if end >= 0:
+            data = data[:end]
 
-            # Serialize the database state using the user-provided arguments
-            serialized = json.dumps(data, **self.kwargs)
+        return next_extent, data
 
-            # Write the serialized data to the file
-            try:
-                f.write(serialized)
-            except io.UnsupportedOperation:
-                raise IOError('Cannot write to the database. Access mode is "{0}"'.format(self._mode))
+    def _replay_table(self, table: str) -> None:
+        """
+        Replay the frames that have been written to the extents of a table
+        since the last replay.
+        """
+        table_id = self._table_id(table)
+        if table_id is None:
+            return
 
-            # Ensure the file has been written
-            f.flush()
-            os.fsync( f.fileno())
+        extent, pos = self._positions.get(table, (0, 0))
 
-        # Remove data that is behind the new cursor in case the file has
-        # gotten shorter
-        #self._handle.truncate()
+        if not extent:
+            # Nothing has been replayed yet, start with the first extent. It
+            # may have been allocated by another storage instance.
+            if not self._directory[table_id][0]:
+                self._read_header()
 
+            extent = self._directory[table_id][0]
+            if not extent:
+                return
 
+        docs = self._tables.setdefault(table, {})
 
-class JSONMultiFrameStorage(Storage):
-    """
-    Store the data in a JSON file.
-    """
+        while True:
+            next_extent, data = self._read_extent(extent, pos)
 
-    def __init__(self, path: str, tables=[], create_dirs=False, encoding=None, access_mode='r+', **kwargs):
-        """
-        Create a new instance.
+            # Only complete lines are replayed, a partially written last
+            # line is picked up once it has been completed
+            end = data.rfind(b'\n') + 1
 
-        Also creates the storage file, if it doesn't exist and the access mode is appropriate for writing.
+            for line in data[:end].splitlines():
+                apply_changes(docs, self._decode(line))
 
-        :param path: Where to store the JSON data.
-        :param access_mode: mode in which the file is opened (r, r+, w, a, x, b, t, +, U)
-        :type access_mode: str
-        """
+            pos += end
 
-        super().__init__()
+            if not next_extent:
+                break
 
-        self._mode = access_mode
-        self.kwargs = kwargs
-        self.tables = tables.insert(0, "_default" )
-        
-        self.metaHeadSize = 500
-        self.path = path
+            # The extent is full, continue with the next one
+            extent, pos = next_extent, 0
 
-        # Create the file if it doesn't exist and creating is allowed by the
-        # access mode
-        if any([character in self._mode for character in ('+', 'w', 'a')]):  # any of the writing modes
-            initdb(path, create_dirs, table )
+        self._positions[table] = (extent, pos)
 
-        # Open the file for reading/writing
-        self._handle = open(path, mode=self._mode, encoding=encoding)
+    def _tail(self, table: str, table_id: int) -> Tuple[int, int, int]:
+        """
+        Get the extent frames of a table are appended to, its capacity and
+        the number of bytes used in it.
+        """
+        if table in self._tails:
+            return self._tails[table]
 
-    def close(self) -> None:
-        self._handle.close()
+        extent = self._directory[table_id][1]
+        if not extent:
+            return 0, 0, 0
 
-    def read(self) -> Optional[Dict[str, Dict[str, Any]]]:
-        # Get the file size by moving the cursor to the file end and reading
-        # its location
-        self._handle.seek(0, os.SEEK_END)
-        size = self._handle.tell()
+        _, data = self._read_extent(extent, 0)
+        used = data.rfind(b'\n') + 1
 
-        if size <= self.metaHeadSize:
-            # File is empty, so we return ``None`` so TinyDB can properly
-            # initialize the database
-            return None
-        else:
-            # Return the cursor to the beginning of the file
-            self._handle.seek( self.metaHeadSize )
+        if used < len(data):
+            # Clear a partially written last frame, so the next frame doesn't
+            # end up behind it
+            self._handle.seek(extent + EXTENT_HEADER.size + used)
+            self._handle.write(b'\0' * (len(data) - used))
 
-            # Load the JSON contents of the file, format  the data 
-            sdata = self._handle.read()
-            #print( "{\"" + self.table + "\": {"+ sdata[0:-1] + "}}" )
-            return json.loads( "{\"" + self.table + "\": {"+ sdata[0:-1] + "}}" )
+        self._handle.seek(extent)
+        _, capacity = EXTENT_HEADER.unpack(self._handle.read(EXTENT_HEADER.size))
 
-    def write(self, data: Dict[str, Dict[str, Any]]):
-        # write one data
-        # Move the cursor to the beginning of the file just in case
-        self._handle.seek(0, os.SEEK_END )
+        return extent, capacity, used
 
-        # Serialize the database state using the user-provided arguments
-        serialized = json.dumps(data, **self.kwargs)
-        #print( serialized[1:-1] )
+    def _allocate(self, table_id: int, previous: int, size: int) -> Tuple[int, int, int]:
+        """
+        Allocate a new extent for a table at the end of the file and link it
+        to the table's previous extent.
 
-        # Write the serialized data to the file
-        try:
-            self._handle.write(serialized[1:-1] )
-            self._handle.write( "," )
-        except io.UnsupportedOperation:
-            raise IOError('Cannot write to the database. Access mode is "{0}"'.format(self._mode))
+        :param size: The size of the frame that has to fit into the extent
+        """
+        capacity = max(self.extent_size, size)
 
-        # Ensure the file has been written
-        self._handle.flush()
-        os.fsync(self._handle.fileno())
+        self._handle.seek(0, os.SEEK_END)
+        extent = self._handle.tell()
+        self._handle.write(EXTENT_HEADER.pack(0, capacity) + b'\0' * capacity)
 
-        # Remove data that is behind the new cursor in case the file has
-        # gotten shorter
-        #self._handle.truncate()
+        if previous:
+            # The next extent is stored at the beginning of the extent header
+            self._handle.seek(previous)
+            self._handle.write(struct.pack('<Q', extent))
 
-    def snap(self, data: Dict[str, Dict[str, Any]]):
-        #initdb( self.path+ ".0", create_dirs=True, self.table )
-        with open( self.path+ ".0", 'bw') as f:
-            f.write( self.table )
-            f.write( '\0'*( 500-len(self.table) ) )
-            # Move the cursor to the beginning of the file just in case
-            f.seek( self.metaHeadSize )
+        first = self._directory[table_id][0] or extent
+        self._directory[table_id] = (first, extent)
 
-            # Serialize the database state using the user-provided arguments
-            serialized = json.dumps(data, **self.kwargs)
+        self._handle.seek(self.header_size + DIRECTORY_ENTRY.size * table_id)
+        self._handle.write(DIRECTORY_ENTRY.pack(first, extent))
 
-            # Write the serialized data to the file
-            try:
-                f.write(serialized)
-            except io.UnsupportedOperation:
-                raise IOError('Cannot write to the database. Access mode is "{0}"'.format(self._mode))
+        return extent, capacity, 0
 
-            # Ensure the file has been written
-            f.flush()
-            os.fsync( f.fileno())
+    def _decode(self, frame: bytes) -> Dict[str, Any]:
+        return self.codec.decode(frame)
 
-        # Remove data that is behind the new cursor in case the file has
-        # gotten shorter
-        #self._handle.truncate()
 
 class JSONMultiFrameMeta():
     """
@@ -468,7 +2959,8 @@ class JSONMultiFrameMeta():
                 break   # 0s
         #print( namefmt )
         #print( headbytes[21: struct.calcsize(namefmt) + 21 ] )
-        self.tables = struct.unpack( namefmt, headbytes[21: struct.calcsize(namefmt) + 21 ] )
+        names = struct.unpack( namefmt, headbytes[21: struct.calcsize(namefmt) + 21 ] )
+        self.tables = [name.decode('utf-8') for name in names]
 
 
     def packHeadMeta( self ):
@@ -494,21 +2986,25 @@ class JSONMultiFrameMeta():
         b'aa\x00'
 
         """
+        names = [name.encode('utf-8') for name in self.tables]
+
+        if len(names) > self.tableCountMax:
+            raise ValueError( "table count > {}".format(self.tableCountMax) )
+
         namelength_list = []
-        namefmt = ""
         sum = 0
-        for name in self.tables:
+        for name in names:
             length = len( name )
+            if not 0 < length <= self.tableNameLengthMax:
+                raise ValueError( "tablename length > {}".format(self.tableNameLengthMax) )
             namelength_list.append( length  )
-            namefmt = namefmt + f"{length}s"
             sum = sum + length 
 
         if sum + 21 > self.headSizeMax:
-            raise Error( "tablenames length > " + self.headSizeMax )
+            raise ValueError( "tablenames length > {}".format(self.headSizeMax) )
        
-        headfmt = "1b20B{0}s{1}s".format( sum, self.headSizeMax - 21 - sum )
-        print( "headfmt=" + headfmt ) 
-        headbytes = struct.pack( headfmt, self.version, *namelength_list, *b'\0'*(20- len(self.tables) ), bytes( "".join(self.tables), 'utf-8' ), b''*(500-21-sum) )
+        headfmt = "1B20B{0}s{1}s".format( sum, self.headSizeMax - 21 - sum )
+        headbytes = struct.pack( headfmt, self.version, *namelength_list, *b'\0'*(20- len(self.tables) ), b"".join(names), b'' )
         
 
         return headbytes
@@ -517,14 +3013,92 @@ class JSONMultiFrameMeta():
         return reduce( lambda x,y : x + len( y) , [0, *self.tables] )
 
 
-class JSONMultiTableLineStorage(Storage):
+def _replay_line_chunk(path: str, start: int, end: int, base: int, codec: Codec):
+    """
+    Decode the ``{"T": ..., "V": ...}`` lines of a chunk of a log file.
+
+    This runs in a worker process when replaying a log in parallel. The
+    documents of the chunk are merged into a partial table dict mapping
+    every document to its last version, the keydir entry of that version and
+    whether the document has been removed within the chunk before. Patch
+    records are applied to the version of the document in the chunk. If
+    there is none, the patch records are combined and the result is a patch
+    record itself.
+
+    :param base: The offset of the file in the log
+    :returns: the partial tables and the number of bytes decoded
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        chunk = f.read(end - start)
+
+    partial: Dict[str, Dict[str, Tuple[Any, Tuple[int, int, int], bool]]] = {}
+    pos = 0
+
+    while True:
+        stop = chunk.find(b'\n', pos) + 1
+        if not stop:
+            break
+
+        val = codec.decode(chunk[pos:stop])
+        documents = val["V"]
+
+        if documents:
+            table = partial.setdefault(val["T"], {})
+            entry = (base + start + pos, stop - pos, (stop - pos) // len(documents))
+
+            for doc_id, document in documents.items():
+                previous = table.get(doc_id)
+
+                if previous is not None and is_patch(document):
+                    if is_tombstone(previous[0]):
+                        # Patches of missing documents have nothing to
+                        # apply to
+                        continue
+
+                    if is_patch(previous[0]):
+                        document = {PATCH: previous[0][PATCH] + document[PATCH]}
+                    else:
+                        document = apply_patch(previous[0], document)
+
+                    # The frames of the previous versions stay live
+                    table[doc_id] = (document, entry[:2] + (previous[1][2] + entry[2],), previous[2])
+                    continue
+
+                removed = previous is not None and (previous[2] or is_tombstone(previous[0]))
+
+                if removed:
+                    # A document added again after its removal moves to the
+                    # end of the table
+                    del table[doc_id]
+
+                table[doc_id] = (document, entry, removed)
+
+        pos = stop
+
+    return partial, pos
+
+
+class JSONMultiTableLineStorage(LogStorage):
     """
     Store the data in a JSON file. 
     一行一条数据，格式：
     {"T": "tablename", "V": {"doc_id": object} } 
+
+    With ``replay_workers`` set, logs larger than ``replay_chunk_size`` are
+    replayed in parallel: the log is split into chunks at line boundaries,
+    which are decoded by a pool of worker processes and merged in log order.
+    As the worker processes import the module that opens the storage on some
+    platforms (e.g. Windows), the main module has to be guarded with
+    ``if __name__ == '__main__'`` then.
+
+    Reading a single table only decodes the lines of that table: the lines of
+    other tables are recognized by their raw ``{"T": "tablename"`` prefix and
+    skipped.
     """
 
-    def __init__(self, path: str, tables=[], create_dirs=False, encoding=None, access_mode='r+', **kwargs):
+    def __init__(self, path: str, tables=(), create_dirs=False, encoding=None, access_mode='r+',
+                 replay_workers=None, replay_chunk_size=16 * 1024 * 1024, **kwargs):
         """
         Create a new instance.
 
@@ -533,80 +3107,390 @@ class JSONMultiTableLineStorage(Storage):
         :param path: Where to store the JSON data.
         :param access_mode: mode in which the file is opened (r, r+, w, a, x, b, t, +, U)
         :type access_mode: str
+        :param replay_workers: The number of processes to replay the log
+                               with, ``None`` replays it in this process
+        :param replay_chunk_size: The size in bytes of the chunks the log is
+                                  split into for replaying it in parallel
         """
 
-        super().__init__()
+        self.replay_workers = replay_workers
+        self.replay_chunk_size = replay_chunk_size
 
-        self._mode = access_mode
-        self.kwargs = kwargs
-        self.tables = tables.insert(0, "_default" )
-        
-        #self.metaHeadSize = 500
-        self.path = path
+        # The raw prefixes of the lines of each table and the patterns
+        # finding them
+        self._prefixes: Dict[str, bytes] = {}
+        self._patterns: Dict[Optional[str], Pattern[bytes]] = {}
 
-        # Create the file if it doesn't exist and creating is allowed by the
-        # access mode
-        if any([character in self._mode for character in ('+', 'w', 'a')]):  # any of the writing modes
-            touch(path, create_dirs=create_dirs)
+        super().__init__(path, create_dirs=create_dirs, encoding=encoding, access_mode=access_mode, **kwargs)
 
-        # Open the file for reading/writing
-        self._handle = open(path, mode=self._mode, encoding=encoding)
+        self.tables = ['_default', *tables]
 
-    def close(self) -> None:
-        self._handle.close()
+    def _replay_segment(self, index: int, start: int, end: int, table: Optional[str] = None) -> int:
+        # Replaying a single table is cheap enough as it skips most lines.
+        # Patched documents are only tracked frame by frame with keydir=True.
+        if (table is not None or self.keydir or self.replay_workers is None
+                or end - start <= self.replay_chunk_size):
+            return super()._replay_segment(index, start, end, table)
+
+        bounds = self._chunk_bounds(self._segment_handle(index), start, end)
+        path = self._segments[index]
+        base = self._bases[index]
+        replayed = 0
+
+        with ProcessPoolExecutor(max_workers=self.replay_workers) as executor:
+            # The chunks are decoded in parallel, but merged in log order so
+            # later frames still overwrite earlier ones
+            for partial, size in executor.map(
+                    _replay_line_chunk,
+                    [path] * (len(bounds) - 1), bounds[:-1], bounds[1:],
+                    [base] * (len(bounds) - 1),
+                    [self.codec] * (len(bounds) - 1)):
+                self._merge(partial)
+                replayed += size
+
+        return replayed
+
+    def _chunk_bounds(self, handle: BinaryIO, start: int, end: int) -> List[int]:
+        """
+        Split a part of a log file into chunks at line boundaries.
+
+        :returns: the offsets the chunks start at, followed by ``end``
+        """
+        bounds = [start]
+
+        while bounds[-1] + self.replay_chunk_size < end:
+            # Continue at the beginning of the next line
+            handle.seek(bounds[-1] + self.replay_chunk_size)
+            handle.readline()
+
+            if handle.tell() >= end:
+                break
+
+            bounds.append(handle.tell())
+
+        bounds.append(end)
+
+        return bounds
+
+    def _merge(self, partial: Dict[str, Dict[str, Tuple[Any, Tuple[int, int, int], bool]]]) -> None:
+        """
+        Merge the partial tables of a chunk decoded by
+        :func:`_replay_line_chunk` into the in-memory tables.
+        """
+        for table, documents in partial.items():
+            docs = self._tables.setdefault(table, {})
+            entries = self._keydir.setdefault(table, {})
+            replayed = self._table_offsets.get(table, 0)
+            self._revisions[table] = self._revisions.get(table, 0) + 1
+
+            for doc_id, (document, entry, removed) in documents.items():
+                if entry[0] < replayed:
+                    # The table has been replayed on its own beyond the
+                    # document's last frame already
+                    continue
+
+                if removed:
+                    # Removing the document first moves it to the end of the
+                    # table, as replaying the chunk frame by frame would
+                    self._apply_document(table, docs, entries, doc_id, TOMBSTONE, entry)
+
+                self._apply_document(table, docs, entries, doc_id, document, entry)
+
+    def _encode(self, table: str, documents: Dict[str, Any]) -> bytes:
+        # Serialize the documents into the frame directly
+        return self._prefix(table) + b',"V":' + self.codec.encode(documents) + b'}\n'
+
+    def _decode(self, frame: bytes) -> Tuple[str, Dict[str, Any]]:
+        # Load the JSON contents of the line, format  the data
+        val = self.codec.decode(frame)
+        return val["T"], val["V"]
+
+    def _replay(self, buffer, start: int, base: int, table: Optional[str] = None) -> int:
+        # The end of the last complete line
+        stop = buffer.rfind(b'\n', start) + 1
+        tag = self._prefix('')[:-1]
+
+        if (table is None or stop <= start or buffer[start:start + len(tag)] != tag
+                or self._pattern(None).search(buffer, start, stop - 1)):
+            # Some lines don't start with a table name, e.g. as they have been
+            # written with spaces after the separators by older versions, so
+            # every line has to be looked at
+            return super()._replay(buffer, start, base, table)
+
+        # Jump from line to line of the table without looking at the lines
+        # in between
+        prefix = self._prefix(table)
+        positions = [start] if buffer[start:start + len(prefix)] == prefix else []
+        positions.extend(match.start() + 1 for match in
+                         self._pattern(table).finditer(buffer, start, stop - 1))
+
+        for pos in positions:
+            end = buffer.find(b'\n', pos) + 1
+
+            frame_table, documents = self._decode(buffer[pos:end])
+            self._apply(frame_table, documents, base + pos, end - pos)
+
+        return stop - start
+
+    def _pattern(self, table: Optional[str]) -> Pattern[bytes]:
+        """
+        Get the pattern finding the line breaks followed by a line of a table
+        or, for ``None``, by a line without a table name.
+        """
+        if table not in self._patterns:
+            if table is None:
+                tag = self._prefix('')[:-1]
+                self._patterns[table] = re.compile(b'\n(?!' + re.escape(tag) + b')')
+            else:
+                self._patterns[table] = re.compile(b'\n' + re.escape(self._prefix(table)))
+
+        return self._patterns[table]
+
+    def _skip_frame(self, buffer, pos: int, table: str) -> bool:
+        prefix = self._prefix(table)
+        if buffer[pos:pos + len(prefix)] == prefix:
+            return False
+
+        # Lines that don't start with a table name at all have been written
+        # in another layout, so they have to be decoded
+        tag = self._prefix('')[:-1]
+        return buffer[pos:pos + len(tag)] == tag
+
+    def _prefix(self, table: str) -> bytes:
+        """
+        Get the raw prefix of the lines of a table up to the closing quote of
+        the table name.
+        """
+        if table not in self._prefixes:
+            self._prefixes[table] = b'{"T":' + self.codec.encode(table)
+
+        return self._prefixes[table]
+
+
+#: The operations a binary frame record can hold: store a document or
+#: remove it
+OP_PUT = 1
+OP_DELETE = 2
+
+#: Set on the operation of every record of a write but the last one, so the
+#: records of a write are replayed together
+OP_CONTINUED = 0x80
+
+#: The header of a binary frame record: the CRC32 of the rest of the record,
+#: the payload length, the operation, the table ID and the length of the
+#: document ID. It is followed by the document ID and the JSON payload.
+RECORD_HEADER = struct.Struct('<IIBBH')
+
+
+class BinaryFrameStorage(LogStorage):
+    """
+    Store the data in a log of length-prefixed, checksummed records.
+
+    The log starts with a 500 byte :class:`JSONMultiFrameMeta` header holding
+    the format version and the names of the tables. Every record consists of
+    a :data:`RECORD_HEADER` followed by the document ID and the document
+    encoded by the codec. A table is referenced by its position in the
+    header, so a database holds at most 20 tables with names of up to 20
+    bytes. As the records are length-prefixed, any :class:`Codec` can be
+    used, e.g. :class:`MarshalCodec`. The log has to be read with the codec
+    it has been written with.
+
+    The records of a write form a frame: all but the last one are marked
+    with :data:`OP_CONTINUED`. A frame is replayed as a whole, like a frame
+    of the JSON logs.
+
+    As every record carries its length and checksum, replay can skip the
+    payload of records without decoding it and verifies the log's integrity
+    in a single streaming pass. Replay stops at the first incomplete or
+    corrupt record or at a frame missing its last record. When opening the
+    log for writing, such a torn tail is truncated.
+    """
+
+    header_size = 500
+
+    json_frames = False
+
+    #: The version of the record format stored in the header
+    format_version = 3
+
+    def __init__(self, path: str, create_dirs=False, encoding=None, access_mode='r+', **kwargs):
+        """
+        Create a new instance.
+
+        Also creates the storage file, if it doesn't exist and the access mode is appropriate for writing.
+
+        :param path: Where to store the data.
+        :param access_mode: mode in which the file is opened (r, r+, w, a, x, b, t, +, U)
+        :type access_mode: str
+        """
+
+        self._meta = JSONMultiFrameMeta()
+        self._meta.version = self.format_version
+
+        super().__init__(path, create_dirs=create_dirs, encoding=encoding, access_mode=access_mode, **kwargs)
+
+        self._read_header()
+
+        if self._meta.version != self.format_version:
+            self._handle.close()
+            raise ValueError('Unsupported log format version {}'.format(self._meta.version))
+
+        if self._handle.writable():
+            with locked(self._lock, exclusive=True):
+                self._recover_tail()
+
+    def _read_header(self) -> None:
+        """
+        Read the format version and the table names from the header.
+        """
+        self._handle.seek(0)
+        self._meta.parse(self._handle.read(self.header_size))
+
+    def _recover_tail(self) -> None:
+        """
+        Cut off records at the end of the log that haven't been written
+        completely.
+
+        Records can't be told apart from their payload when scanning
+        backward, so the log is replayed up to the first incomplete or
+        corrupt record.
+        """
+        self._replay_tail()
+
+        # Offsets span all segments, but only the last one can have a torn
+        # tail
+        offset = self._offset - self._bases[-1]
 
-    def read(self) -> Optional[Dict[str, Dict[str, Any]]]:
-        # Get the file size by moving the cursor to the file end and reading
-        # its location
         self._handle.seek(0, os.SEEK_END)
         size = self._handle.tell()
-        data = {}
 
-        if size <= 0:
-            # File is empty, so we return ``None`` so TinyDB can properly
-            # initialize the database
-            return None
-        else:
-            # Return the cursor to the beginning of the file
-            self._handle.seek( 0 )
+        if size > offset >= self.header_size:
+            self._truncate_tail(offset, size)
 
-            # Load the JSON contents of the file, format  the data 
-            for line in self._handle.readlines():
-                val = json.loads( line )
-                if not data.get( val["T"] ):
-                    data[val["T"] ] = {}
-                data[val["T"] ].update( val["V"] )
+    def _create(self, path: str, create_dirs: bool) -> None:
+        touch(path, create_dirs=create_dirs)
 
-            return data
+        if os.path.getsize(path) == 0:
+            with open(path, 'r+b') as f:
+                f.write(self._header())
 
-    def write(self, data: Dict[str, Dict[str, Any]]):
-        # write one data
-        # Move the cursor to the beginning of the file just in case
-        self._handle.seek(0, os.SEEK_END )
+    def _header(self) -> bytes:
+        return self._meta.packHeadMeta()
 
-        # Serialize the database state using the user-provided arguments
-        sdata = {"T": data["__T"] }
-        del data[ "__T" ]
-        sdata["V"] = data
+    def _table_id(self, table: str) -> int:
+        """
+        Get the ID of a table, registering new tables in the header.
+        """
+        if table not in self._meta.tables:
+            # The header is read and written through the handle the writer
+            # appends the frames with, so the pending frames have to be
+            # written first
+            self.flush()
 
-        serialized = json.dumps(sdata, **self.kwargs)
-        #print( serialized[1:-1] )
+            # Another storage instance may have registered the table already
+            self._read_header()
 
-        # Write the serialized data to the file
         try:
-            self._handle.write( serialized )
-            self._handle.write( "\n" )
-        except io.UnsupportedOperation:
-            raise IOError('Cannot write to the database. Access mode is "{0}"'.format(self._mode))
+            return self._meta.tables.index(table)
+        except ValueError:
+            pass
 
-        # Ensure the file has been written
+        self._meta.tables.append(table)
+
+        try:
+            header = self._header()
+        except ValueError:
+            self._meta.tables.pop()
+            raise
+
+        # Update the header in place
+        self._handle.seek(0)
+        self._handle.write(header)
         self._handle.flush()
-        os.fsync(self._handle.fileno())
 
-        # Remove data that is behind the new cursor in case the file has
-        # gotten shorter
-        #self._handle.truncate()
+        return len(self._meta.tables) - 1
+
+    def _encode(self, table: str, documents: Dict[str, Any]) -> bytes:
+        table_id = self._table_id(table)
+        records = []
+
+        for number, (doc_id, document) in enumerate(documents.items(), 1):
+            key = doc_id.encode('utf-8')
 
+            if is_tombstone(document):
+                op = OP_DELETE
+                payload = b''
+            else:
+                op = OP_PUT
+                payload = self.codec.encode(document)
+
+            if number < len(documents):
+                op |= OP_CONTINUED
+
+            body = RECORD_HEADER.pack(0, len(payload), op, table_id, len(key))[4:] + key + payload
+            records.append(struct.pack('<I', zlib.crc32(body)) + body)
+
+        return b''.join(records)
+
+    def _replay(self, buffer, start: int, base: int, table: Optional[str] = None) -> int:
+        size = len(buffer)
+        pos = frame_start = start
+
+        while pos + RECORD_HEADER.size <= size:
+            crc, length, op, table_id, key_length = RECORD_HEADER.unpack_from(buffer, pos)
+            end = pos + RECORD_HEADER.size + key_length + length
+
+            # Stop at an incomplete record
+            if end > size:
+                break
+
+            # Stop at a corrupt record
+            if zlib.crc32(memoryview(buffer)[pos + 4:end]) != crc:
+                break
+            if op & ~OP_CONTINUED not in (OP_PUT, OP_DELETE):
+                break
+
+            if table_id >= len(self._meta.tables):
+                # The table may have been added by another storage instance
+                self._read_header()
+
+                if table_id >= len(self._meta.tables):
+                    break
+
+            pos = end
+
+            if op & OP_CONTINUED:
+                continue
+
+            # The frame is complete. Frames of other tables are skipped
+            # without decoding them, only the frame is copied out of the
+            # buffer for decoding.
+            if table is None or self._meta.tables[table_id] == table:
+                frame_table, documents = self._decode(buffer[frame_start:end])
+                self._apply(frame_table, documents, base + frame_start, end - frame_start)
+
+            frame_start = end
+
+        # Records of a frame missing its last record aren't replayed
+        return frame_start - start
+
+    def _decode(self, frame: bytes) -> Tuple[str, Dict[str, Any]]:
+        documents = {}
+        pos = 0
+
+        while pos < len(frame):
+            _, length, op, table_id, key_length = RECORD_HEADER.unpack_from(frame, pos)
+            start = pos + RECORD_HEADER.size
+            pos = start + key_length + length
+
+            doc_id = frame[start:start + key_length].decode('utf-8')
+
+            if op & ~OP_CONTINUED == OP_DELETE:
+                documents[doc_id] = TOMBSTONE
+            else:
+                documents[doc_id] = self.codec.decode(frame[start + key_length:pos])
+
+        return self._meta.tables[table_id], documents
 
 
 class MemoryStorage(Storage):
@@ -614,6 +3498,8 @@ class MemoryStorage(Storage):
     Store the data as JSON in memory.
     """
 
+    table_scoped = True
+
     def __init__(self):
         """
         Create a new instance.
@@ -622,8 +3508,37 @@ class MemoryStorage(Storage):
         super().__init__()
         self.memory = None
 
+        # The number of changes of each table, see table_revision()
+        self._revisions: Dict[str, int] = {}
+
     def read(self) -> Optional[Dict[str, Dict[str, Any]]]:
         return self.memory
 
     def write(self, data: Dict[str, Dict[str, Any]]):
+        # Every table may have changed
+        for table in set(self.memory or {}) | set(data):
+            self._revisions[table] = self._revisions.get(table, 0) + 1
+
         self.memory = data
+
+    def read_table(self, table: str) -> Dict[str, Any]:
+        if self.memory is None:
+            return {}
+
+        return self.memory.get(table, {})
+
+    def read_document(self, table: str, doc_id: str) -> Optional[Dict[str, Any]]:
+        if self.memory is None:
+            return None
+
+        return self.memory.get(table, {}).get(doc_id)
+
+    def table_revision(self, table: str) -> Optional[int]:
+        return self._revisions.get(table, 0)
+
+    def write_table(self, table: str, documents: Dict[str, Any]) -> None:
+        if self.memory is None:
+            self.memory = {}
+
+        apply_changes(self.memory.setdefault(table, {}), documents)
+        self._revisions[table] = self._revisions.get(table, 0) + 1
@@ -3,6 +3,8 @@ This module implements tables, the central place for accessing and manipulating
 data in TinyDB.
 """
 
+from copy import deepcopy
+from functools import wraps
 from typing import (
     Callable,
     Dict,
@@ -16,8 +18,10 @@ from typing import (
     Tuple
 )
 
-from .queries import QueryLike
-from .storages import Storage
+from .indexes import HashIndex, SortedIndex, find
+from .operations import Operation
+from .queries import Query, QueryInstance, QueryLike
+from .storages import Storage, PATCH, TOMBSTONE, make_patch
 from .utils import LRUCache
 
 __all__ = ('Document', 'Table')
@@ -36,6 +40,26 @@ class Document(dict):
         self.doc_id = doc_id
 
 
+def exclusive(method):
+    """
+    Hold the storage of a table exclusively while a table method runs, see
+    :meth:`Storage.exclusive() <tinydb.storages.Storage.exclusive>`.
+    """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._storage.exclusive():
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                if self._storage.locking:
+                    # Other processes may insert documents once the storage
+                    # is released, so the next ID has to be read again
+                    self._next_id = None
+
+    return wrapper
+
+
 class Table:
     """
     Represents a single TinyDB table.
@@ -105,13 +129,29 @@ class Table:
         """
 
         self._storage = storage
-        self._storage.table = name
         self._name = name
         self._query_cache: LRUCache[QueryLike, List[Document]] \
             = self.query_cache_class(capacity=cache_size)
 
         self._next_id = None
 
+        # The documents changed by the current table update operation and
+        # the patch record operations known to have changed them (``None``
+        # if the changes are unknown)
+        self._changes: Dict[str, Mapping] = {}
+        self._patches: Dict[str, Optional[List[list]]] = {}
+
+        # The table data keyed by document ID class as left by the last
+        # table update operation and the table revision it belongs to, see
+        # Storage.table_revision()
+        self._native_table: Optional[Tuple[int, Dict[int, Mapping]]] = None
+
+        # The indexes by the path of their field, whether they are up to
+        # date and the table revision they belong to
+        self._indexes: Dict[Tuple[str, ...], HashIndex] = {}
+        self._indexes_current = False
+        self._index_revision: Optional[int] = None
+
     def __repr__(self):
         args = [
             'name={!r}'.format(self.name),
@@ -135,6 +175,7 @@ class Table:
         """
         return self._storage
 
+    @exclusive
     def insert(self, document: Mapping) -> int:
         """
         Insert a new document into the table.
@@ -159,6 +200,12 @@ class Table:
             # In all other cases we use the next free ID
             doc_id = self._get_next_id()
 
+        if self._storage.table_scoped:
+            # Appending the document doesn't need the rest of the table
+            self._append_documents({doc_id: document})
+
+            return doc_id
+
         # Now, we update the table and add the document
         def updater(table: dict):
             if doc_id in table:
@@ -169,14 +216,14 @@ class Table:
             # ``dict`` instance even if it was a different class that
             # implemented the ``Mapping`` interface
             table[doc_id] = dict(document)
-            self.storageWrite( { f"{doc_id}": table[doc_id] } )
-
+            self._write(doc_id, table[doc_id])
 
         # See below for details on ``Table._update``
         self._update_table(updater)
 
         return doc_id
 
+    @exclusive
     def insert_multiple(self, documents: Iterable[Mapping]) -> List[int]:
         """
         Insert multiple documents into the table.
@@ -186,6 +233,31 @@ class Table:
         """
         doc_ids = []
 
+        if self._storage.table_scoped:
+            # Appending the documents doesn't need the rest of the table
+            appended: Dict[int, Mapping] = {}
+
+            for document in documents:
+                # Make sure the document implements the ``Mapping`` interface
+                if not isinstance(document, Mapping):
+                    raise ValueError('Document is not a Mapping')
+
+                if isinstance(document, Document):
+                    doc_id = document.doc_id
+
+                    if doc_id in appended:
+                        raise ValueError(f'Document with ID {str(doc_id)} '
+                                         f'already exists')
+                else:
+                    doc_id = self._get_next_id()
+
+                doc_ids.append(doc_id)
+                appended[doc_id] = document
+
+            self._append_documents(appended)
+
+            return doc_ids
+
         def updater(table: dict):
             for document in documents:
 
@@ -207,7 +279,7 @@ class Table:
                     doc_id = document.doc_id
                     doc_ids.append(doc_id)
                     table[doc_id] = dict(document)
-                    self.storageWrite( { f"{doc_id}": table[doc_id] } )
+                    self._write(doc_id, table[doc_id])
                     continue
 
                 # Generate new document ID for this document
@@ -216,7 +288,7 @@ class Table:
                 doc_id = self._get_next_id()
                 doc_ids.append(doc_id)
                 table[doc_id] = dict(document)
-                self.storageWrite( { f"{doc_id}": table[doc_id] } )
+                self._write(doc_id, table[doc_id])
 
         # See below for details on ``Table._update``
         self._update_table(updater)
@@ -251,14 +323,27 @@ class Table:
         if cached_results is not None:
             return cached_results[:]
 
-        # Perform the search by applying the query to all documents.
-        # Then, only if the document matches the query, convert it
-        # to the document class and document ID class.
-        docs = [
-            self.document_class(doc, self.document_id_class(doc_id))
-            for doc_id, doc in self._read_table().items()
-            if cond(doc)
-        ]
+        table = self._read_table()
+        doc_ids = self._find_indexed(cond, table)
+
+        if doc_ids is not None:
+            # Only apply the query to the documents found in the indexes
+            docs = []
+
+            for doc_id in doc_ids:
+                doc = table.get(str(doc_id))
+
+                if doc is not None and cond(doc):
+                    docs.append(self.document_class(doc, doc_id))
+        else:
+            # Perform the search by applying the query to all documents.
+            # Then, only if the document matches the query, convert it
+            # to the document class and document ID class.
+            docs = [
+                self.document_class(doc, self.document_id_class(doc_id))
+                for doc_id, doc in table.items()
+                if cond(doc)
+            ]
 
         # Only cache cacheable queries.
         #
@@ -299,8 +384,7 @@ class Table:
 
         if doc_id is not None:
             # Retrieve a document specified by its ID
-            table = self._read_table()
-            raw_doc = table.get(str(doc_id), None)
+            raw_doc = self._storage.read_document(self.name, str(doc_id))
 
             if raw_doc is None:
                 return None
@@ -314,7 +398,20 @@ class Table:
             # doesn't think that `doc_id_` (which is a string) needs
             # to have the same type as `doc_id` which is this function's
             # parameter and is an optional `int`.
-            for doc_id_, doc in self._read_table().items():
+            table = self._read_table()
+            doc_ids = self._find_indexed(cond, table)
+
+            if doc_ids is not None:
+                # Only apply the query to the documents found in the indexes
+                for found_id in doc_ids:
+                    doc = table.get(str(found_id))
+
+                    if doc is not None and cond(doc):
+                        return self.document_class(doc, found_id)
+
+                return None
+
+            for doc_id_, doc in table.items():
                 if cond(doc):
                     return self.document_class(
                         doc,
@@ -366,15 +463,7 @@ class Table:
         """
 
         # Define the function that will perform the update
-        if callable(fields):
-            def perform_update(table, doc_id):
-                # Update documents by calling the update function provided by
-                # the user
-                fields(table[doc_id])
-        else:
-            def perform_update(table, doc_id):
-                # Update documents by setting all fields from the provided data
-                table[doc_id].update(fields)
+        perform_update = self._document_updater(fields)
 
         if doc_ids is not None:
             # Perform the update operation for documents specified by a list
@@ -386,7 +475,7 @@ class Table:
                 # Call the processing callback with all document IDs
                 for doc_id in updated_ids:
                     perform_update(table, doc_id)
-                    self.storageWrite( { f"{doc_id}": table[doc_id] } )
+                    self._write(doc_id, table[doc_id])
 
             # Perform the update operation (see _update_table for details)
             self._update_table(updater)
@@ -416,7 +505,7 @@ class Table:
 
                         # Perform the update (see above)
                         perform_update(table, doc_id)
-                        self.storageWrite(  { f"{doc_id}": table[doc_id] } )
+                        self._write(doc_id, table[doc_id])
 
             # Perform the update operation (see _update_table for details)
             self._update_table(updater)
@@ -436,7 +525,7 @@ class Table:
 
                     # Perform the update (see above)
                     perform_update(table, doc_id)
-                    self.storageWrite(  { f"{doc_id}": table[doc_id] }  )
+                    self._write(doc_id, table[doc_id])
 
             # Perform the update operation (see _update_table for details)
             self._update_table(updater)
@@ -455,16 +544,11 @@ class Table:
         :returns: a list containing the updated document's ID
         """
 
-        # Define the function that will perform the update
-        def perform_update(fields, table, doc_id):
-            if callable(fields):
-                # Update documents by calling the update function provided
-                # by the user
-                fields(table[doc_id])
-            else:
-                # Update documents by setting all fields from the provided
-                # data
-                table[doc_id].update(fields)
+        # Define the functions that will perform the updates
+        updaters = [
+            (self._document_updater(fields), cond)
+            for fields, cond in updates
+        ]
 
         # Perform the update operation for documents specified by a query
 
@@ -478,7 +562,7 @@ class Table:
             # result in an exception (RuntimeError: dictionary changed size
             # during iteration)
             for doc_id in list(table.keys()):
-                for fields, cond in updates:
+                for perform_update, cond in updaters:
                     _cond = cast(QueryLike, cond)
 
                     # Pass through all documents to find documents matching the
@@ -488,14 +572,15 @@ class Table:
                         updated_ids.append(doc_id)
 
                         # Perform the update (see above)
-                        perform_update(fields, table, doc_id)
-                        self.storageWrite(  { f"{doc_id}": table[doc_id] }  )
+                        perform_update(table, doc_id)
+                        self._write(doc_id, table[doc_id])
 
         # Perform the update operation (see _update_table for details)
         self._update_table(updater)
 
         return updated_ids
 
+    @exclusive
     def upsert(self, document: Mapping, cond: Optional[QueryLike] = None) -> List[int]:
         """
         Update documents, if they exist, insert them otherwise.
@@ -561,10 +646,8 @@ class Table:
 
             def updater(table: dict):
                 for doc_id in removed_ids:
-                    #table[doc_id]["_del"] = "1"
-                    self.storageWrite( { f"{doc_id}" : {"_del":1 } } )
                     table.pop(doc_id)
-
+                    self._write(doc_id, TOMBSTONE)
 
             # Perform the remove operation
             self._update_table(updater)
@@ -593,9 +676,9 @@ class Table:
                         # Add document ID to list of removed document IDs
                         removed_ids.append(doc_id)
 
-                        self.storageWrite( { f"{doc_id}" : {"_del":1 } } )
                         # Remove document from the table
                         table.pop(doc_id)
+                        self._write(doc_id, TOMBSTONE)
 
             # Perform the remove operation
             self._update_table(updater)
@@ -609,8 +692,15 @@ class Table:
         Truncate the table by removing all documents.
         """
 
+        def updater(table: dict):
+            # Remove all documents
+            for doc_id in table:
+                self._write(doc_id, TOMBSTONE)
+
+            table.clear()
+
         # Update the table by resetting all data
-        #self._update_table(lambda table: table.clear())
+        self._update_table(updater)
 
         # Reset document ID counter
         self._next_id = None
@@ -624,13 +714,130 @@ class Table:
 
         return len(self.search(cond))
 
+    def create_index(
+        self,
+        field: Union[str, Query],
+        ordered: bool = False
+    ) -> None:
+        """
+        Create an index on a field.
+
+        The index maps the values of the field to the documents having them.
+        Searching with equality (``==``), ``one_of()`` and ``exists()`` queries
+        on the field, also when combined with other queries, then only tests
+        the documents found in the index instead of all documents. Documents
+        found using an index are returned in the order of their IDs.
+
+        An ordered index also keeps the values of the field sorted. Range
+        queries (``<``, ``<=``, ``>``, ``>=``) on the field and combinations
+        of them like ``(Query().a >= 1) & (Query().a < 5)`` are then looked
+        up as a slice of the values, and :meth:`order_by` uses it to return
+        documents in order. Numbers are only compared with numbers and strings
+        only with strings, documents with values of another type never match
+        a range query looked up in the index.
+
+        The index is kept up to date when documents are inserted, updated or
+        removed through this table. If the storage reports changes of the
+        table made elsewhere (see :meth:`Storage.table_revision()
+        <tinydb.storages.Storage.table_revision>`), the index is rebuilt when
+        it is used next. Like the query cache, the index of a storage that
+        doesn't report them only follows the changes made through this table
+        until :meth:`clear_cache` is called.
+
+        :param field: the name of the field or a query of a nested field,
+                      like ``Query().a.b``
+        :param ordered: whether to keep the values of the field sorted
+        """
+
+        path = self._index_path(field)
+        index = self._indexes.get(path)
+
+        if index is None or (ordered and not isinstance(index, SortedIndex)):
+            self._indexes[path] = SortedIndex(path) if ordered else HashIndex(path)
+
+            # The index is built when it is used first
+            self._indexes_current = False
+
+    def drop_index(self, field: Union[str, Query]) -> None:
+        """
+        Remove the index on a field, if there is one.
+
+        :param field: the name of the field or a query of a nested field
+        """
+
+        self._indexes.pop(self._index_path(field), None)
+
+    def order_by(
+        self,
+        field: Union[str, Query],
+        cond: Optional[QueryLike] = None,
+        reverse: bool = False
+    ) -> List[Document]:
+        """
+        Get the documents having a field in the order of its values.
+
+        Numbers come before strings, documents with values of other types come
+        last. Documents with equal values are ordered by their ID. An ordered
+        index on the field (see :meth:`create_index`) is iterated in order,
+        otherwise the documents are sorted.
+
+        :param field: the name of the field or a query of a nested field
+        :param cond: the condition the documents have to match, if any
+        :param reverse: whether to return the documents in reverse order
+        :returns: list of documents
+        """
+
+        path = self._index_path(field)
+        table = self._read_table()
+        index = self._indexes.get(path)
+
+        if isinstance(index, SortedIndex):
+            self._refresh_indexes(table)
+        else:
+            index = SortedIndex(path)
+            index.build(
+                (self.document_id_class(doc_id), doc)
+                for doc_id, doc in table.items()
+            )
+
+        doc_ids = list(index.ids())
+
+        if reverse:
+            doc_ids.reverse()
+
+        # Skip the documents the indexes rule out for the query
+        found = None
+
+        if isinstance(cond, QueryInstance):
+            self._refresh_indexes(table)
+            found = find(self._indexes, cond._hash)
+
+        docs = []
+
+        for doc_id in doc_ids:
+            if found is not None and doc_id not in found:
+                continue
+
+            doc = table.get(str(doc_id))
+
+            if doc is not None and (cond is None or cond(doc)):
+                docs.append(self.document_class(doc, doc_id))
+
+        return docs
+
     def clear_cache(self) -> None:
         """
         Clear the query cache.
+
+        Indexes are rebuilt when they are used next if the storage doesn't
+        report table revisions, so changes made elsewhere are seen again.
         """
 
         self._query_cache.clear()
 
+        if self._index_revision is None:
+            self._indexes_current = False
+
     def __len__(self):
         """
         Count the total number of documents in this table.
@@ -662,12 +869,21 @@ class Table:
 
             return next_id
 
+        # Storages may keep track of the next ID, so we don't have to look
+        # at all documents
+        if self.document_id_class is int:
+            next_id = self._storage.read_next_id(self.name)
+
+            if next_id is not None:
+                self._next_id = next_id + 1
+
+                return next_id
+
         # Determine the next document ID by finding out the max ID value
         # of the current table documents
 
         # Read the table documents
         table = self._read_table()
-        #print( table )
         # If the table is empty, set the initial ID
         if not table:
             next_id = 1
@@ -694,77 +910,356 @@ class Table:
         only one document for example.
         """
 
-        # Retrieve the tables from the storage
-        tables = self._storage.read()
+        # Retrieve the current table's data from the storage. If the table
+        # does not exist yet, it is empty.
+        return self._storage.read_table(self.name)
 
-        if tables is None:
-            # The database is empty
-            return {}
+    @staticmethod
+    def _index_path(field: Union[str, Query]) -> Tuple[str, ...]:
+        """
+        Get the path of a field to index.
+        """
 
-        # Retrieve the current table's data
-        try:
-            table = tables[self.name]
-        except KeyError:
-            # The table does not exist yet, so it is empty
-            return {}
+        if isinstance(field, str):
+            return (field,)
+
+        if (isinstance(field, Query) and field.is_cacheable() and field._path
+                and all(isinstance(part, str) for part in field._path)):
+            return tuple(field._path)
+
+        raise ValueError('Cannot index {!r}'.format(field))
+
+    def _find_indexed(
+        self,
+        cond: QueryLike,
+        table: Dict[str, Mapping]
+    ) -> Optional[List]:
+        """
+        Find the documents a query may match using the indexes.
+
+        :param cond: the query
+        :param table: the current table data
+        :returns: the sorted IDs of the documents or ``None`` if the query
+                  has to be applied to all documents
+        """
+
+        if not self._indexes or not isinstance(cond, QueryInstance):
+            return None
+
+        self._refresh_indexes(table)
+        doc_ids = find(self._indexes, cond._hash)
+
+        return None if doc_ids is None else sorted(doc_ids)
+
+    def _refresh_indexes(self, table: Dict[str, Mapping]) -> None:
+        """
+        Build the indexes from scratch if they aren't up to date.
+
+        :param table: the current table data
+        """
+
+        revision = self._storage.table_revision(self.name)
 
-        return table
+        # Storages that don't report table revisions can't tell about changes
+        # made elsewhere, so like the query cache the indexes then only
+        # follow the changes made through this table, see clear_cache()
+        if self._indexes_current and revision == self._index_revision:
+            return
 
+        # Somebody else has changed the table, so the indexes are built from
+        # scratch
+        for index in self._indexes.values():
+            index.build(
+                (self.document_id_class(doc_id), doc)
+                for doc_id, doc in table.items()
+            )
+
+        self._indexes_current = True
+        self._index_revision = revision
+
+    def _update_indexes(self, changes: Dict[str, Mapping], writes: int) -> None:
+        """
+        Update the indexes with the documents a table update operation has
+        written.
+
+        :param changes: the changed documents by their ID, see :meth:`_write`
+        :param writes: the number of writes the table revision is incremented
+                       by once the storage has applied the documents
+        """
+
+        if not self._indexes_current:
+            # The indexes are rebuilt when they are used next
+            return
+
+        for doc_id, document in changes.items():
+            native_id = self.document_id_class(doc_id)
+
+            for index in self._indexes.values():
+                index.remove(native_id)
+
+                if document is not TOMBSTONE:
+                    index.add(native_id, document)
+
+        # Storages may apply the documents only when the table is read next
+        # (e.g. log storages that aren't materialized), so whether somebody
+        # else has changed the table too is checked when the indexes are
+        # used next, see _refresh_indexes()
+        if self._index_revision is not None:
+            self._index_revision += writes
+
+    def _append_documents(self, documents: Dict[int, Mapping]) -> None:
+        """
+        Add new documents to the table of a storage that writes single
+        tables.
+
+        Unlike :meth:`_update_table`, this doesn't read the table. The
+        documents are written on their own, only the IDs of ``Document``
+        objects are looked up to make sure they aren't in use yet. The IDs
+        of all other documents are new, see :meth:`_get_next_id`.
+
+        :param documents: The new documents by their ID
+        """
+
+        if not documents:
+            return
+
+        for doc_id, document in documents.items():
+            if (isinstance(document, Document)
+                    and self._storage.read_document(self.name, str(doc_id)) is not None):
+                raise ValueError(f'Document with ID {str(doc_id)} '
+                                 f'already exists')
+
+        native_table, self._native_table = self._native_table, None
+
+        # By calling ``dict(document)`` we convert the data we got to a
+        # ``dict`` instance even if it was a different class that
+        # implemented the ``Mapping`` interface
+        documents = {doc_id: dict(document) for doc_id, document in documents.items()}
+        changes = {
+            str(doc_id): document
+            for doc_id, document in documents.items()
+        }
+
+        self._storage.write_table(self.name, changes)
+
+        if self._indexes:
+            self._update_indexes(changes, 1)
+
+        if (native_table is not None
+                and self._storage.table_revision(self.name) == native_table[0] + 1):
+            # Add the documents to the table data of the last update as
+            # nobody else has changed the table in between
+            native_table[1].update(documents)
+            self._native_table = (native_table[0] + 1, native_table[1])
+
+        # Clear the query cache, as the table contents have changed
+        self._query_cache.clear()
+
+    @exclusive
     def _update_table(self, updater: Callable[[Dict[int, Mapping]], None]):
         """
         Perform a table update operation.
 
-        The storage interface used by TinyDB only allows to read/write the
-        complete database data, but not modifying only portions of it. Thus,
-        to only update portions of the table data, we first perform a read
-        operation, perform the update on the table data and then write
-        the updated data back to the storage.
+        If the storage can read and write single tables, we read the table
+        data, perform the update on it and then write the documents the
+        updater has changed back to the storage. The updater reports every
+        document it adds, changes or removes using :meth:`_write`. These
+        documents are written in a single call once the updater has
+        finished, so nothing is written if it fails.
+
+        Otherwise the storage interface only allows to read/write the
+        complete database data. Thus, we read the whole database, perform the
+        update on the table data and then write the updated data back to the
+        storage.
 
         As a further optimization, we don't convert the documents into the
         document class, as the table data will *not* be returned to the user.
         """
 
-        tables = self._storage.read()
+        revision = None
 
-        if tables is None:
-            # The database is empty
-            tables = {}
+        if self._storage.table_scoped:
+            # Only the table itself has to be read
+            tables = None
+            raw_table = self._storage.read_table(self.name)
+            revision = self._storage.table_revision(self.name)
+        else:
+            tables = self._storage.read()
 
-        try:
-            raw_table = tables[self.name]
-        except KeyError:
-            # The table does not exist yet, so it is empty
-            raw_table = {}
+            if tables is None:
+                # The database is empty
+                tables = {}
 
-        # Convert the document IDs to the document ID class.
-        # This is required as the rest of TinyDB expects the document IDs
-        # to be an instance of ``self.document_id_class`` but the storage
-        # might convert dict keys to strings.
-        #
-        table = {
-            self.document_id_class(doc_id): doc
-            for doc_id, doc in raw_table.items()
-        }
+            try:
+                raw_table = tables[self.name]
+            except KeyError:
+                # The table does not exist yet, so it is empty
+                raw_table = {}
+
+        native_table, self._native_table = self._native_table, None
+
+        if revision is not None and native_table is not None and native_table[0] == revision:
+            # Nobody else has changed the table since the last update, so
+            # the table data of the last update is still up to date
+            table = native_table[1]
+        else:
+            # Convert the document IDs to the document ID class.
+            # This is required as the rest of TinyDB expects the document IDs
+            # to be an instance of ``self.document_id_class`` but the storage
+            # might convert dict keys to strings.
+            table = {
+                self.document_id_class(doc_id): doc
+                for doc_id, doc in raw_table.items()
+            }
 
         # Perform the table update operation
+        self._changes = {}
+        self._patches = {}
         updater(table)
 
-        # Convert the document IDs back to strings.
-        # This is required as some storages (most notably the JSON file format)
-        # don't support IDs other than strings.
-        #tables[self.name] = {
-        #    str(doc_id): doc
-        #    for doc_id, doc in table.items()
-        #}
+        changes, self._changes = self._changes, {}
+        patches, self._patches = self._patches, {}
 
-        # Write the newly updated data back to the storage
-        #self._storage.write(tables)
+        # The changed documents for the indexes, as patch records may
+        # replace them below
+        indexed = dict(changes) if self._indexes else None
+
+        if tables is None:
+            if self._storage.patch_records:
+                # Write changed documents as patch records holding the
+                # changed fields only, if that's cheaper
+                for doc_id, document in changes.items():
+                    previous = raw_table.get(doc_id)
+
+                    if previous is None or document is TOMBSTONE:
+                        continue
+
+                    operations = patches.get(doc_id)
+
+                    if operations is None:
+                        patch = make_patch(previous, document)
+                    elif len(operations) < len(document):
+                        patch = {PATCH: operations}
+                    else:
+                        patch = None
+
+                    if patch is not None:
+                        changes[doc_id] = patch
+
+            # Write the changed documents back to the storage
+            if changes:
+                self._storage.write_table(self.name, changes)
+                revision = revision if revision is None else revision + 1
+
+            # Keep the table data for the next update if the storage has
+            # applied our changes and nothing else
+            if revision is not None and self._storage.table_revision(self.name) == revision:
+                self._native_table = (revision, table)
+        else:
+            # Convert the document IDs back to strings.
+            # This is required as some storages (most notably the JSON file
+            # format) don't support IDs other than strings.
+            tables[self.name] = {
+                str(doc_id): doc
+                for doc_id, doc in table.items()
+            }
+
+            # Write the newly updated data back to the storage
+            self._storage.write(tables)
+
+        if indexed is not None:
+            # Only the changed documents of a single table are written if
+            # there are any, otherwise the whole database is
+            self._update_indexes(indexed, int(bool(changes)) if tables is None else 1)
 
         # Clear the query cache, as the table contents have changed
-        self.clear_cache()
+        self._query_cache.clear()
 
+    def _document_updater(
+        self,
+        fields: Union[Mapping, Callable[[Mapping], None]]
+    ) -> Callable[[Dict[int, Mapping], int], None]:
+        """
+        Get the function updating a document of a table update operation.
+
+        If the storage reads and writes single tables, the document is
+        copied before it is updated. The table data may hold the storage's
+        own documents (or those of a middleware caching them) which must not
+        change before the update is written.
+
+        If the storage takes patch records, operations from
+        :mod:`tinydb.operations` and dicts of fields are known to replace
+        single fields of the document only. The patch record operations doing
+        the same are recorded, so the updated document doesn't have to be
+        compared with its previous version.
+
+        :param fields: The fields to set or the function updating the
+                       document
+        :returns: a function taking the table data passed to the updater and
+                  the ID of the document to update
+        """
+
+        if not self._storage.table_scoped:
+            if callable(fields):
+                def perform_update(table, doc_id):
+                    # Update documents by calling the update function
+                    # provided by the user
+                    fields(table[doc_id])
+            else:
+                def perform_update(table, doc_id):
+                    # Update documents by setting all fields from the
+                    # provided data
+                    table[doc_id].update(fields)
+
+            return perform_update
+
+        # Functions may modify the document in place anywhere while
+        # operations and dicts of fields only replace single fields
+        modifies = callable(fields) and not isinstance(fields, Operation)
+
+        if isinstance(fields, Operation):
+            operations: Optional[List[list]] = [fields.patch]
+        elif modifies:
+            operations = None
+        else:
+            operations = [['set', [field], value] for field, value in fields.items()]
+
+        def perform_update(table, doc_id):
+            if modifies:
+                # The document is copied entirely to keep the previous
+                # version intact
+                table[doc_id] = document = deepcopy(table[doc_id])
+            else:
+                # A shallow copy suffices as only fields are replaced
+                table[doc_id] = document = dict(table[doc_id])
 
+            if callable(fields):
+                fields(document)
+            else:
+                document.update(fields)
+
+            if not self._storage.patch_records:
+                return
+
+            key = str(doc_id)
+
+            if key not in self._patches or operations is None:
+                self._patches[key] = operations
+            elif self._patches[key] is not None:
+                self._patches[key] = self._patches[key] + operations
+
+        return perform_update
+
+    def _write(self, doc_id, document: Mapping) -> None:
+        """
+        Report a document changed by a table update operation.
+
+        :param doc_id: The ID of the document
+        :param document: The new document or the :data:`TOMBSTONE` if the
+                         document has been removed
+        """
 
-    def storageWrite( self, data: Document ):
-        #data["__T"] = self._name
-        self._storage.write( data )
+        # Convert the document ID back to a string. This is required as some
+        # storages (most notably the JSON file format) don't support IDs
+        # other than strings.
+        self._changes[str(doc_id)] = document